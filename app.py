@@ -1,11 +1,29 @@
 import os
+import abc
 import json
 import subprocess
 import threading
 import time
 import socket
+import re
+import atexit
+import signal
+import sys
+import sqlite3
+import selectors
+import asyncio
+import random
+import hashlib
+import hmac
+import uuid
+import pty
+import termios
+import math
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, send_file, send_from_directory, abort
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, send_file, send_from_directory, abort, Response, g
 from werkzeug.utils import secure_filename
 import zipfile
 import shutil
@@ -16,29 +34,2431 @@ app = Flask(__name__)
 # Secure secret key - use environment variable if available, otherwise use default
 app.secret_key = os.environ.get('SECRET_KEY', 'ff_developer_2025_secure_key_8f7d6e5c4b3a2918')
 
+# Maximum delay (seconds) between a change and it being written to disk
+SAVE_INTERVAL = float(os.environ.get('FLARE_SAVE_INTERVAL', '1.0'))
+# Compact the state journal into a fresh servers.json snapshot after this many records
+JOURNAL_COMPACT_RECORDS = int(os.environ.get('FLARE_JOURNAL_COMPACT_RECORDS', '2000'))
+# Server registry backend: 'json' (servers.json + journal, default) or 'sqlite'
+STORAGE_BACKEND = os.environ.get('FLARE_STORAGE', 'json').lower()
+SQLITE_PATH = os.environ.get('FLARE_SQLITE_PATH', 'servers.db')
+
+class ServerStore(abc.ABC):
+    """Base class for server registry backends.
+    
+    Backends receive the same change records the journal uses ('set'/'del'),
+    so ServerManager does not care where the registry lives.
+    """
+    
+    journal_records = 0
+    journal_bytes = 0
+    
+    @abc.abstractmethod
+    def load(self):
+        """Return the full registry as {name: server}"""
+    
+    @abc.abstractmethod
+    def append(self, records):
+        """Persist a batch of change records, return bytes written"""
+    
+    @abc.abstractmethod
+    def write_snapshot(self, servers):
+        """Persist the full registry, return bytes written"""
+    
+    def needs_compaction(self):
+        return False
+    
+    def query(self, servers, filters):
+        """Names of servers whose fields equal every value in filters"""
+        return [name for name, server in list(servers.items())
+                if all(server.get(field) == value for field, value in filters.items())]
+    
+    @staticmethod
+    def apply_record(servers, record):
+        name = record.get('name')
+        if record.get('op') == 'set':
+            servers.setdefault(name, {}).update(record.get('fields', {}))
+        elif record.get('op') == 'del':
+            servers.pop(name, None)
+
+class JsonStateStore(ServerStore):
+    """servers.json snapshot plus an append-only journal of per-server changes.
+    
+    Each journal line is a small JSON record:
+        {"op": "set", "name": ..., "fields": {...}}  - create/update fields of a server
+        {"op": "del", "name": ...}                   - remove a server
+    load() replays the journal on top of the snapshot; write_snapshot() compacts it.
+    """
+    
+    def __init__(self, snapshot_file='servers.json', journal_file='servers.journal'):
+        self.snapshot_file = snapshot_file
+        self.journal_file = journal_file
+        self.journal_records = 0
+        self.journal_bytes = 0
+        self._journal = None
+    
+    def load(self):
+        servers = {}
+        if os.path.exists(self.snapshot_file):
+            try:
+                with open(self.snapshot_file, 'r') as f:
+                    servers = json.load(f)
+            except Exception as e:
+                print(f"Error reading {self.snapshot_file}: {e}")
+                servers = {}
+        self.journal_records = 0
+        self.journal_bytes = 0
+        if os.path.exists(self.journal_file):
+            with open(self.journal_file, 'r') as f:
+                for line in f:
+                    self.journal_bytes += len(line)
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Torn write from a crash - everything before it is still valid
+                        continue
+                    self.apply_record(servers, record)
+                    self.journal_records += 1
+        return servers
+    
+    def append(self, records):
+        """Append change records to the journal; cost is proportional to the change"""
+        if not records:
+            return 0
+        data = ''.join(json.dumps(record, separators=(',', ':')) + '\n' for record in records)
+        if self._journal is None:
+            self._journal = open(self.journal_file, 'a')
+        self._journal.write(data)
+        self._journal.flush()
+        self.journal_records += len(records)
+        self.journal_bytes += len(data)
+        return len(data)
+    
+    def write_snapshot(self, servers):
+        """Atomically replace the snapshot with the full registry and reset the journal"""
+        data = json.dumps(servers, indent=2)
+        tmp_file = self.snapshot_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            f.write(data)
+        os.replace(tmp_file, self.snapshot_file)
+        # Replaying the old journal over the new snapshot is harmless, so a crash here is safe
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        open(self.journal_file, 'w').close()
+        self.journal_records = 0
+        self.journal_bytes = 0
+        return len(data)
+    
+    def needs_compaction(self):
+        return self.journal_records >= JOURNAL_COMPACT_RECORDS
+
+class SQLiteStateStore(ServerStore):
+    """Server registry in SQLite (WAL mode) with indexed name/status/port/server_type.
+    
+    Every batch of changes is one transaction touching only the changed rows.
+    The full server record is kept as JSON in the data column.
+    """
+    
+    INDEXED_FIELDS = ('status', 'port', 'server_type')
+    
+    def __init__(self, db_path='servers.db', import_from='servers.json'):
+        self.db_path = db_path
+        self._local = threading.local()
+        conn = self._connect()
+        with conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS servers (
+                name TEXT PRIMARY KEY,
+                status TEXT,
+                port INTEGER,
+                server_type TEXT,
+                data TEXT NOT NULL
+            )''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_servers_status ON servers (status)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_servers_port ON servers (port)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_servers_type ON servers (server_type)')
+        # First run on SQLite: carry over the existing JSON registry
+        empty = conn.execute('SELECT COUNT(*) FROM servers').fetchone()[0] == 0
+        if empty and import_from and os.path.exists(import_from):
+            servers = JsonStateStore(import_from, os.path.splitext(import_from)[0] + '.journal').load()
+            if servers:
+                self.write_snapshot(servers)
+    
+    def _connect(self):
+        # One connection per thread; WAL lets readers run alongside the flusher's writes
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+    
+    def _row(self, name, server):
+        data = json.dumps(server, separators=(',', ':'))
+        return (name, server.get('status'), server.get('port'), server.get('server_type'), data), len(data)
+    
+    def load(self):
+        servers = {}
+        for name, data in self._connect().execute('SELECT name, data FROM servers'):
+            try:
+                servers[name] = json.loads(data)
+            except ValueError:
+                print(f"Skipping corrupt registry row for {name}")
+        return servers
+    
+    def append(self, records):
+        if not records:
+            return 0
+        written = 0
+        conn = self._connect()
+        with conn:
+            for record in records:
+                name = record.get('name')
+                if record.get('op') == 'del':
+                    conn.execute('DELETE FROM servers WHERE name = ?', (name,))
+                    continue
+                existing = conn.execute('SELECT data FROM servers WHERE name = ?', (name,)).fetchone()
+                server = json.loads(existing[0]) if existing else {}
+                server.update(record.get('fields', {}))
+                row, size = self._row(name, server)
+                conn.execute('INSERT OR REPLACE INTO servers (name, status, port, server_type, data) '
+                             'VALUES (?, ?, ?, ?, ?)', row)
+                written += size
+        return written
+    
+    def write_snapshot(self, servers):
+        rows = []
+        written = 0
+        for name, server in list(servers.items()):
+            row, size = self._row(name, server)
+            rows.append(row)
+            written += size
+        conn = self._connect()
+        with conn:
+            conn.execute('DELETE FROM servers')
+            conn.executemany('INSERT INTO servers (name, status, port, server_type, data) '
+                             'VALUES (?, ?, ?, ?, ?)', rows)
+        return written
+    
+    def query(self, servers, filters):
+        columns = {field: value for field, value in filters.items()
+                   if field == 'name' or field in self.INDEXED_FIELDS}
+        if not columns:
+            return super().query(servers, filters)
+        where = ' AND '.join(f'{field} = ?' for field in columns)
+        names = [row[0] for row in self._connect().execute(
+            f'SELECT name FROM servers WHERE {where}', tuple(columns.values()))]
+        rest = {field: value for field, value in filters.items() if field not in columns}
+        if rest:
+            names = [name for name in names
+                     if name in servers and all(servers[name].get(f) == v for f, v in rest.items())]
+        return names
+
+def create_state_store(servers_file='servers.json'):
+    """Build the registry backend selected by FLARE_STORAGE"""
+    if STORAGE_BACKEND == 'sqlite':
+        return SQLiteStateStore(SQLITE_PATH, import_from=servers_file)
+    return JsonStateStore(servers_file, os.path.splitext(servers_file)[0] + '.journal')
+
+# Seconds a server gets to exit after SIGTERM before it is killed (per-server 'stop_timeout' overrides)
+STOP_TIMEOUT = float(os.environ.get('FLARE_STOP_TIMEOUT', '10'))
+
+_interpreter_versions = {}
+
+def interpreter_version(executable='python3'):
+    """Resolved path and sys.version of an interpreter, memoised per binary"""
+    path = shutil.which(executable) or executable
+    path = os.path.realpath(path)
+    try:
+        key = (path, os.stat(path).st_mtime)
+    except OSError:
+        return path
+    if key not in _interpreter_versions:
+        try:
+            version = subprocess.run([path, '-c', 'import sys; print(sys.version)'],
+                                     capture_output=True, text=True, timeout=10).stdout.strip()
+        except (OSError, subprocess.SubprocessError):
+            version = ''
+        _interpreter_versions[key] = f"{path} {version}"
+    return _interpreter_versions[key]
+
+_host_pip_version = []
+
+def host_pip_targets_venvs():
+    """True if python3's pip supports --python (22.3+), so venvs do not need their own pip"""
+    if not _host_pip_version:
+        try:
+            output = subprocess.run(['python3', '-m', 'pip', '--version'], capture_output=True,
+                                    text=True, timeout=30).stdout
+            _host_pip_version.append(tuple(int(part) for part in output.split()[1].split('.')[:2]))
+        except (OSError, subprocess.SubprocessError, IndexError, ValueError):
+            _host_pip_version.append((0, 0))
+    return _host_pip_version[0] >= (22, 3)
+
+def requirements_hash(requirements_file, executable='python3'):
+    """Content hash of a requirements file combined with the interpreter it is installed for"""
+    digest = hashlib.sha256()
+    with open(requirements_file, 'rb') as f:
+        digest.update(f.read())
+    digest.update(b'\0' + interpreter_version(executable).encode())
+    return digest.hexdigest()
+
+def process_tree_pids(pid):
+    """pid and all its descendants; empty if pid is gone"""
+    try:
+        import psutil
+        try:
+            leader = psutil.Process(pid)
+            if leader.status() == psutil.STATUS_ZOMBIE:
+                return []
+            return [pid] + [child.pid for child in leader.children(recursive=True)]
+        except psutil.NoSuchProcess:
+            return []
+    except ImportError:
+        return [pid] if os.path.exists(f'/proc/{pid}') else []
+
+def session_members(sids):
+    """{sid: [pid, ...]} for the given session ids, in one pass over the process table.
+    
+    Servers lead their own session, so this also finds workers that were reparented
+    to init after their parent exited or that moved to a process group of their own.
+    """
+    members = {sid: [] for sid in sids}
+    if not members:
+        return members
+    if os.path.isdir('/proc'):
+        pids = [int(entry) for entry in os.listdir('/proc') if entry.isdigit()]
+    else:
+        try:
+            import psutil
+            pids = psutil.pids()
+        except ImportError:
+            return members
+    for pid in pids:
+        try:
+            sid = os.getsid(pid)
+        except OSError:
+            continue
+        if sid in members:
+            members[sid].append(pid)
+    return members
+
+def listening_ports(pids):
+    """TCP ports in LISTEN state on sockets held by any of pids (/proc, or psutil off Linux)"""
+    if not os.path.exists('/proc/net/tcp'):
+        import psutil
+        ports = set()
+        for pid in pids:
+            try:
+                for conn in psutil.Process(pid).net_connections(kind='tcp'):
+                    if conn.status == psutil.CONN_LISTEN:
+                        ports.add(conn.laddr.port)
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                pass
+        return ports
+    inodes = set()
+    for pid in pids:
+        try:
+            for fd in os.listdir(f'/proc/{pid}/fd'):
+                try:
+                    link = os.readlink(f'/proc/{pid}/fd/{fd}')
+                except OSError:
+                    continue
+                if link.startswith('socket:['):
+                    inodes.add(link[8:-1])
+        except OSError:
+            continue
+    ports = set()
+    if not inodes:
+        return ports
+    for table in ('/proc/net/tcp', '/proc/net/tcp6'):
+        try:
+            with open(table) as f:
+                next(f)
+                for line in f:
+                    fields = line.split()
+                    # st 0A = LISTEN; field 9 is the socket inode
+                    if fields[3] == '0A' and fields[9] in inodes:
+                        ports.add(int(fields[1].rsplit(':', 1)[1], 16))
+        except OSError:
+            pass
+    return ports
+
+async def http_probe(host, port, path='/', timeout=2.0):
+    """HTTP status code of GET path, or None if there is no HTTP answer"""
+    writer = None
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        writer.write(f'GET {path} HTTP/1.0\r\nHost: {host}:{port}\r\nUser-Agent: flare-panel\r\n\r\n'.encode())
+        status_line = await asyncio.wait_for(reader.readline(), timeout)
+        return int(status_line.split()[1])
+    except (OSError, asyncio.TimeoutError, ValueError, IndexError):
+        return None
+    finally:
+        if writer is not None:
+            writer.close()
+
+def tree_listening(pid, port):
+    """(alive, listening) for pid's process tree; walks /proc, so keep it off the event loop"""
+    pids = process_tree_pids(pid)
+    return bool(pids), bool(pids) and port in listening_ports(pids)
+
+async def wait_until_ready(pid, port, timeout, http_path=None, host='127.0.0.1', interval=0.05, max_interval=0.5):
+    """Wait until pid's process tree listens on port (and answers HTTP < 500); returns (ready, error).
+    
+    Polls every `interval` seconds at first, backing off to `max_interval` for slow starters.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    delay = interval
+    while True:
+        alive, listening = await loop.run_in_executor(None, tree_listening, pid, port)
+        if not alive:
+            return False, "Process exited before it was ready"
+        if listening:
+            break
+        if loop.time() >= deadline:
+            return False, f"Not listening on port {port} after {timeout:g}s"
+        await asyncio.sleep(min(delay, max(deadline - loop.time(), 0)))
+        delay = min(delay * 1.5, max_interval)
+    while http_path:
+        status = await http_probe(host, port, http_path)
+        if status is not None and status < 500:
+            break
+        if loop.time() >= deadline:
+            return False, f"No successful HTTP response from {http_path} after {timeout:g}s (last status: {status})"
+        await asyncio.sleep(max(interval, 0.2))
+    return True, None
+
+# Each server gets its own venv in servers/<name>/.venv, filled from a shared local wheel cache
+SERVER_VENVS = os.environ.get('FLARE_SERVER_VENVS', '1').lower() not in ('0', 'false', 'no')
+SERVER_VENV_DIR = '.venv'
+# Panel state inside a server directory that a backup restore carries over instead of replacing
+RESTORE_KEEP = ('backups', '.console', SERVER_VENV_DIR)
+WHEELHOUSE_DIR = os.environ.get('FLARE_WHEELHOUSE', 'wheelhouse')
+# Seconds allowed for downloading/building wheels the cache does not have yet
+WHEEL_BUILD_TIMEOUT = float(os.environ.get('FLARE_WHEEL_BUILD_TIMEOUT', '600'))
+
+# Background jobs: worker threads shared by all kinds, and how many of each kind may run at once
+JOB_WORKERS = int(os.environ.get('FLARE_JOB_WORKERS', '4'))
+JOB_LIMITS = {'install': 1, 'backup': 2, 'restore': 1, 'extract': 2, 'copy': 2}
+for _limit in filter(None, os.environ.get('FLARE_JOB_LIMITS', '').split(',')):
+    _kind, _, _count = _limit.partition('=')
+    JOB_LIMITS[_kind.strip()] = int(_count)
+# Finished jobs kept for the status API
+JOB_HISTORY = int(os.environ.get('FLARE_JOB_HISTORY', '200'))
+
+# Console commands: how many may run at once per server, and how long each may run
+COMMAND_LIMIT = int(os.environ.get('FLARE_COMMAND_LIMIT', '2'))
+COMMAND_TIMEOUT = float(os.environ.get('FLARE_COMMAND_TIMEOUT', '300'))
+
+# Interactive shell sessions (PTY) per server, closed after this many idle seconds
+SHELL_IDLE_TIMEOUT = float(os.environ.get('FLARE_SHELL_IDLE_TIMEOUT', '1800'))
+# Prefix for PTY children: takes the terminal on stdin as the controlling tty of the new
+# session, then execs the real argv. A preexec_fn would run between fork and exec of a
+# threaded process, where it can deadlock on a lock held by another thread.
+PTY_EXEC = [sys.executable, '-S', '-c',
+            'import fcntl, os, sys, termios; fcntl.ioctl(0, termios.TIOCSCTTY, 0); '
+            'os.execvp(sys.argv[1], sys.argv[1:])']
+
+# Readiness: 'port' waits for the process tree to listen on the server port, 'http' also
+# needs an HTTP answer below 500 from 'readiness_path', 'none' treats a spawned process as ready
+READINESS_MODES = ('port', 'http', 'none')
+READY_TIMEOUT = float(os.environ.get('FLARE_READY_TIMEOUT', '60'))
+
+# Health checks of running servers, run concurrently on the supervisor loop
+HEALTH_MODES = ('tcp', 'http', 'none')
+HEALTH_INTERVAL = float(os.environ.get('FLARE_HEALTH_INTERVAL', '10'))
+HEALTH_TIMEOUT = float(os.environ.get('FLARE_HEALTH_TIMEOUT', '2'))
+HEALTH_CONCURRENCY = int(os.environ.get('FLARE_HEALTH_CONCURRENCY', '64'))
+# Probes kept for rolling stats, failures in a row that make a server unhealthy,
+# and average latency (ms) above which it is degraded
+HEALTH_WINDOW = int(os.environ.get('FLARE_HEALTH_WINDOW', '20'))
+HEALTH_FAILURES = int(os.environ.get('FLARE_HEALTH_FAILURES', '3'))
+HEALTH_DEGRADED_MS = float(os.environ.get('FLARE_HEALTH_DEGRADED_MS', '1000'))
+
+# Seconds between system metrics samples (CPU, memory, disk, network, load)
+METRICS_INTERVAL = float(os.environ.get('FLARE_METRICS_INTERVAL', '1'))
+# Samples kept in the in-memory ring buffer
+METRICS_HISTORY = int(os.environ.get('FLARE_METRICS_HISTORY', '300'))
+# Seconds between process table samples (CPU% is measured over this window)
+PROCESS_TABLE_INTERVAL = float(os.environ.get('FLARE_PROCESS_TABLE_INTERVAL', '5'))
+# Stop sampling the process table after this many seconds without a request for it
+PROCESS_TABLE_IDLE = float(os.environ.get('FLARE_PROCESS_TABLE_IDLE', '300'))
+# With no earlier reading to measure against, a request samples twice this many seconds apart
+PROCESS_COLD_WINDOW = 0.25
+PROCESS_FIELDS = ('pid', 'ppid', 'name', 'username', 'status', 'cpu_percent', 'memory_percent',
+                  'memory_info', 'num_threads', 'create_time', 'cmdline')
+# Time-series tiers as step_seconds:slots (default 1 s for 10 min, 10 s for 24 h, 5 min for 30 d)
+METRICS_TIERS = [tuple(int(part) for part in tier.split(':'))
+                 for tier in os.environ.get('FLARE_METRICS_TIERS', '1:600,10:8640,300:8640').split(',')]
+
+# Histogram buckets (seconds) for panel request latency in /metrics
+REQUEST_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# /metrics answers logged-in sessions and scrapers sending this bearer token. Localhost is
+# only trusted on request: behind a reverse proxy every client appears to come from there.
+METRICS_TOKEN = os.environ.get('FLARE_METRICS_TOKEN', '')
+METRICS_ALLOW_LOCALHOST = os.environ.get('FLARE_METRICS_ALLOW_LOCALHOST', '0').lower() in ('1', 'true', 'yes')
+
+# Seconds between full rescans of each server directory's disk usage
+DISK_RESCAN_INTERVAL = float(os.environ.get('FLARE_DISK_RESCAN_INTERVAL', '600'))
+# What an upload over a server's disk_quota_mb does: 'warn' (log and allow) or 'block'
+DISK_QUOTA_ACTIONS = ('warn', 'block')
+DISK_QUOTA_ACTION = os.environ.get('FLARE_DISK_QUOTA_ACTION', 'warn').lower()
+
+# Server fields whose change is visible in /api/servers/status
+STATUS_FIELDS = frozenset(('name', 'status', 'pid', 'start_time', 'restart_stats', 'last_exit_code', 'ready'))
+
+# Automatic restarts (per-server 'restart_policy': never, on-failure or always)
+RESTART_POLICIES = ('never', 'on-failure', 'always')
+RESTART_BACKOFF_BASE = float(os.environ.get('FLARE_RESTART_BACKOFF_BASE', '0.5'))
+RESTART_BACKOFF_MAX = float(os.environ.get('FLARE_RESTART_BACKOFF_MAX', '60'))
+RESTART_JITTER = float(os.environ.get('FLARE_RESTART_JITTER', '0.2'))
+# A process that stayed up this long resets the backoff
+RESTART_STABLE_AFTER = float(os.environ.get('FLARE_RESTART_STABLE_AFTER', '30'))
+# Crash-loop breaker: give up after this many automatic restarts within the window
+RESTART_LOOP_LIMIT = int(os.environ.get('FLARE_RESTART_LOOP_LIMIT', '5'))
+RESTART_LOOP_WINDOW = float(os.environ.get('FLARE_RESTART_LOOP_WINDOW', '60'))
+
+# Console scrollback: a ring of CONSOLE_SEGMENTS files of CONSOLE_SEGMENT_LINES lines per server
+CONSOLE_SEGMENT_LINES = int(os.environ.get('FLARE_CONSOLE_SEGMENT_LINES', '16384'))
+CONSOLE_SEGMENTS = int(os.environ.get('FLARE_CONSOLE_SEGMENTS', '8'))
+# Most recent console records per server kept in memory for polling without disk reads
+CONSOLE_MEMORY_LINES = int(os.environ.get('FLARE_CONSOLE_MEMORY_LINES', '1000'))
+
+class ConsoleLogRing:
+    """Fixed-size on-disk console log for one server.
+    
+    Lines are appended to segment files (segment-<slot>.log) as
+    "<seq>\\t<unix time>\\t<message>" records. When the newest segment is full
+    the oldest slot is truncated and reused, so disk use is bounded and memory
+    use is constant. index.json keeps, per segment, its first sequence number,
+    line count and the byte offset of every OFFSET_STRIDE-th line, which makes
+    tail and seek-by-sequence reads cheap. The newest records are also kept in
+    a bounded in-memory deque so live polling never touches the disk.
+    """
+    
+    OFFSET_STRIDE = 256
+    FLUSH_INTERVAL = 1.0
+    
+    def __init__(self, directory, segment_lines=CONSOLE_SEGMENT_LINES, max_segments=CONSOLE_SEGMENTS,
+                 memory_lines=CONSOLE_MEMORY_LINES):
+        self.directory = directory
+        self.segment_lines = max(segment_lines, 1)
+        self.max_segments = max(max_segments, 2)
+        self.index_file = os.path.join(directory, 'index.json')
+        self._lock = threading.Lock()
+        self._segments = []  # Oldest first
+        self._next_seq = 1
+        self._cleared_seq = 0  # Records up to this sequence number were cleared
+        self._fh = None
+        self._unflushed = False
+        self._last_flush = 0.0
+        self._load_index()
+        memory_lines = max(memory_lines, 1)
+        # Invariant: holds the newest min(total lines, memory_lines) records
+        self._recent = deque(self._read_tail(memory_lines), maxlen=memory_lines)
+    
+    def _segment_path(self, slot):
+        return os.path.join(self.directory, f'segment-{slot}.log')
+    
+    def _load_index(self):
+        try:
+            with open(self.index_file, 'r') as f:
+                data = json.load(f)
+            self._segments = data['segments']
+            self._next_seq = data['next_seq']
+            self._cleared_seq = data.get('cleared_seq', 0)
+        except (OSError, ValueError, KeyError):
+            self._segments = []
+            self._next_seq = 1
+        if self._segments:
+            # The newest segment may hold lines written after the index was saved
+            self._rescan(self._segments[-1])
+    
+    def _rescan(self, segment):
+        lines = 0
+        size = 0
+        offsets = []
+        last_seq = None
+        path = self._segment_path(segment['slot'])
+        try:
+            with open(path, 'rb') as f:
+                for raw in f:
+                    if not raw.endswith(b'\n'):
+                        break  # Torn write at the tail
+                    if lines % self.OFFSET_STRIDE == 0:
+                        offsets.append(size)
+                    size += len(raw)
+                    lines += 1
+                    last_seq = raw.split(b'\t', 1)[0]
+            if os.path.getsize(path) > size:
+                os.truncate(path, size)
+        except OSError:
+            pass
+        segment.update({'lines': lines, 'size': size, 'offsets': offsets})
+        if last_seq:
+            try:
+                self._next_seq = max(self._next_seq, int(last_seq) + 1)
+            except ValueError:
+                pass
+    
+    def _write_index(self):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_file = self.index_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump({'next_seq': self._next_seq, 'cleared_seq': self._cleared_seq,
+                       'segments': self._segments}, f)
+        os.replace(tmp_file, self.index_file)
+    
+    def _close_file(self):
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+            self._unflushed = False
+    
+    def _rotate(self):
+        self._close_file()
+        used = {segment['slot'] for segment in self._segments}
+        if len(self._segments) >= self.max_segments:
+            slot = self._segments.pop(0)['slot']
+        else:
+            slot = next(i for i in range(self.max_segments) if i not in used)
+        self._segments.append({'slot': slot, 'first_seq': self._next_seq,
+                               'lines': 0, 'size': 0, 'offsets': []})
+        os.makedirs(self.directory, exist_ok=True)
+        self._fh = open(self._segment_path(slot), 'wb')
+        self._write_index()
+    
+    def _flush(self):
+        if self._unflushed and self._fh is not None:
+            self._fh.flush()
+            self._unflushed = False
+            self._last_flush = time.monotonic()
+    
+    def append(self, message, timestamp=None):
+        """Append one line, return its sequence number"""
+        return self.append_many([message], timestamp)
+    
+    def append_many(self, messages, timestamp=None):
+        """Append several lines under one lock, return the last sequence number"""
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._lock:
+            for message in messages:
+                message = str(message).replace('\r', '').replace('\n', ' ').replace('\t', '    ')
+                if not self._segments or self._segments[-1]['lines'] >= self.segment_lines:
+                    self._rotate()
+                segment = self._segments[-1]
+                if self._fh is None:
+                    os.makedirs(self.directory, exist_ok=True)
+                    self._fh = open(self._segment_path(segment['slot']), 'ab')
+                seq = self._next_seq
+                record = f'{seq}\t{timestamp:.3f}\t{message}\n'.encode('utf-8', 'replace')
+                if segment['lines'] % self.OFFSET_STRIDE == 0:
+                    segment['offsets'].append(segment['size'])
+                self._fh.write(record)
+                segment['size'] += len(record)
+                segment['lines'] += 1
+                self._next_seq += 1
+                self._recent.append((seq, timestamp, message))
+            self._unflushed = True
+            if time.monotonic() - self._last_flush >= self.FLUSH_INTERVAL:
+                self._flush()
+            return self._next_seq - 1
+    
+    def _read_segment(self, segment, start_line, count):
+        records = []
+        if count <= 0 or start_line >= segment['lines']:
+            return records
+        stride = start_line // self.OFFSET_STRIDE
+        offsets = segment['offsets']
+        offset = offsets[stride] if stride < len(offsets) else 0
+        skip = start_line - stride * self.OFFSET_STRIDE if stride < len(offsets) else start_line
+        try:
+            with open(self._segment_path(segment['slot']), 'rb') as f:
+                f.seek(offset)
+                for raw in f:
+                    if skip:
+                        skip -= 1
+                        continue
+                    parts = raw.decode('utf-8', 'replace').rstrip('\n').split('\t', 2)
+                    if len(parts) == 3:
+                        try:
+                            records.append((int(parts[0]), float(parts[1]), parts[2]))
+                        except ValueError:
+                            pass
+                    if len(records) >= count:
+                        break
+        except OSError:
+            pass
+        return records
+    
+    def _read_tail(self, count):
+        self._flush()
+        chunks = []
+        remaining = count
+        for segment in reversed(self._segments):
+            if remaining <= 0:
+                break
+            take = min(remaining, segment['lines'])
+            chunks.append(self._read_segment(segment, segment['lines'] - take, take))
+            remaining -= take
+        return [record for chunk in reversed(chunks) for record in chunk]
+    
+    def tail(self, count):
+        """Last count records as (seq, timestamp, message), oldest first"""
+        if count <= 0:
+            return []
+        with self._lock:
+            recent = self._recent
+            if count <= len(recent) or len(recent) < recent.maxlen:
+                # Everything requested (or everything there is) is already in memory
+                return list(recent)[-count:]
+            return self._read_tail(count)
+    
+    def read_since(self, seq, limit=1000):
+        """Up to limit records with sequence numbers greater than seq, oldest first"""
+        with self._lock:
+            recent = self._recent
+            if not recent or seq >= recent[0][0] - 1 or len(recent) < recent.maxlen:
+                records = []
+                for record in reversed(recent):
+                    if record[0] <= seq:
+                        break
+                    records.append(record)
+                records.reverse()
+                return records[:limit]
+            self._flush()
+            records = []
+            for segment in self._segments:
+                last_seq = segment['first_seq'] + segment['lines'] - 1
+                if last_seq <= seq:
+                    continue
+                start_line = max(seq + 1 - segment['first_seq'], 0)
+                records.extend(self._read_segment(segment, start_line, limit - len(records)))
+                if len(records) >= limit:
+                    break
+            return records
+    
+    def clear(self):
+        """Drop all lines; sequence numbers keep increasing"""
+        with self._lock:
+            self._close_file()
+            for segment in self._segments:
+                try:
+                    os.remove(self._segment_path(segment['slot']))
+                except OSError:
+                    pass
+            self._segments = []
+            self._recent.clear()
+            # The clear consumes a sequence number, so a reader whose cursor was at the
+            # last line before the clear is still behind cleared_seq and gets a reset
+            self._cleared_seq = self._next_seq
+            self._next_seq += 1
+            if os.path.isdir(self.directory):
+                self._write_index()
+    
+    @property
+    def last_seq(self):
+        return self._next_seq - 1
+    
+    @property
+    def cleared_seq(self):
+        return self._cleared_seq
+    
+    def close(self):
+        with self._lock:
+            self._flush()
+            self._close_file()
+            if self._segments:
+                try:
+                    self._write_index()
+                except OSError:
+                    pass
+    
+    def stats(self):
+        with self._lock:
+            return {
+                'lines': sum(segment['lines'] for segment in self._segments),
+                'bytes': sum(segment['size'] for segment in self._segments),
+                'segments': len(self._segments),
+                'capacity_lines': self.segment_lines * self.max_segments,
+                'memory_lines': len(self._recent),
+                'next_seq': self._next_seq
+            }
+
+class ConsoleLogStore:
+    """Per-server ConsoleLogRing instances under servers/<name>/.console"""
+    
+    def __init__(self, base_dir='servers'):
+        self.base_dir = base_dir
+        self._rings = {}
+        self._lock = threading.Lock()
+        atexit.register(self.close_all)
+    
+    def ring(self, name):
+        with self._lock:
+            ring = self._rings.get(name)
+            if ring is None:
+                ring = self._rings[name] = ConsoleLogRing(os.path.join(self.base_dir, name, '.console'))
+            return ring
+    
+    def get(self, name):
+        """The ring if it is already open; never creates one"""
+        with self._lock:
+            return self._rings.get(name)
+    
+    def close(self, name):
+        """Release a server's log files (call before renaming or deleting its directory)"""
+        with self._lock:
+            ring = self._rings.pop(name, None)
+        if ring is not None:
+            ring.close()
+    
+    def close_all(self):
+        with self._lock:
+            rings, self._rings = list(self._rings.values()), {}
+        for ring in rings:
+            ring.close()
+
+class ServerEventHub:
+    """Wakes console stream viewers when a server's console or status changes.
+    
+    Each server has a version counter; producers bump it with notify() and
+    viewers block in wait() until it moves past the version they last saw.
+    All viewers of a server read the same console buffer, so adding viewers
+    adds no extra producers.
+    """
+    
+    def __init__(self):
+        self._versions = {}
+        self._condition = threading.Condition()
+    
+    def version(self, name):
+        return self._versions.get(name, 0)
+    
+    def notify(self, name):
+        with self._condition:
+            self._versions[name] = self._versions.get(name, 0) + 1
+            self._condition.notify_all()
+    
+    def wait(self, name, seen_version, timeout):
+        """Block until name changes after seen_version; False on timeout"""
+        with self._condition:
+            return self._condition.wait_for(lambda: self._versions.get(name, 0) != seen_version, timeout)
+
+class OutputMultiplexer:
+    """One I/O thread that reads every child's output pipe via selectors (epoll on Linux).
+    
+    Pipes are read non-blocking as data arrives, split into lines incrementally
+    and handed to on_lines(lines) in batches; on_eof() runs when the pipe closes.
+    This replaces a blocking monitor thread per server process.
+    """
+    
+    READ_SIZE = 65536
+    MAX_LINE = 65536  # Longer partial lines are emitted as-is
+    
+    def __init__(self):
+        self._selector = selectors.DefaultSelector()
+        self._pending = []
+        self._lock = threading.Lock()
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ, None)
+        self.stats = {'lines': 0, 'bytes': 0, 'streams': 0, 'streams_total': 0}
+        self._thread = None
+    
+    def _ensure_started(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='output-multiplexer', daemon=True)
+            self._thread.start()
+    
+    def _wake(self):
+        try:
+            os.write(self._wake_w, b'\0')
+        except BlockingIOError:
+            pass  # Already pending
+    
+    def register(self, stream, on_lines, on_eof=None, flush_partial=False):
+        """Start reading stream (file object or fd) on the I/O thread.
+        
+        flush_partial emits an unterminated line as soon as it is read (for
+        prompts on interactive terminals) instead of waiting for its newline.
+        """
+        fd = stream if isinstance(stream, int) else stream.fileno()
+        os.set_blocking(fd, False)
+        with self._lock:
+            self._pending.append((fd, stream, on_lines, on_eof, flush_partial))
+        self._ensure_started()
+        self._wake()
+    
+    def _run(self):
+        while True:
+            with self._lock:
+                pending, self._pending = self._pending, []
+            for fd, stream, on_lines, on_eof, flush_partial in pending:
+                self._selector.register(fd, selectors.EVENT_READ, [stream, on_lines, on_eof, b'', flush_partial])
+                self.stats['streams'] += 1
+                self.stats['streams_total'] += 1
+            
+            events = self._selector.select()
+            for key, mask in events:
+                if key.data is None:
+                    try:
+                        while os.read(self._wake_r, 4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    continue
+                self._read(key)
+    
+    def _read(self, key):
+        stream, on_lines, on_eof, buffer, flush_partial = key.data
+        try:
+            chunk = os.read(key.fd, self.READ_SIZE)
+        except BlockingIOError:
+            return
+        except OSError:
+            chunk = b''
+        
+        if chunk:
+            self.stats['bytes'] += len(chunk)
+            buffer += chunk
+            parts = buffer.split(b'\n')
+            buffer = parts.pop()
+            if len(buffer) > self.MAX_LINE or flush_partial:
+                parts.append(buffer)
+                buffer = b''
+            key.data[3] = buffer
+            self._dispatch(on_lines, parts)
+            return
+        
+        # EOF: flush the trailing partial line and release the pipe
+        self._selector.unregister(key.fd)
+        self.stats['streams'] -= 1
+        if buffer:
+            self._dispatch(on_lines, [buffer])
+        try:
+            if isinstance(stream, int):
+                os.close(stream)
+            else:
+                stream.close()
+        except OSError:
+            pass
+        if on_eof is not None:
+            try:
+                on_eof()
+            except Exception as e:
+                print(f"Output multiplexer EOF callback failed: {e}")
+    
+    def _dispatch(self, on_lines, parts):
+        lines = []
+        for part in parts:
+            line = part.decode('utf-8', 'replace').rstrip()
+            if line:
+                lines.append(line)
+        if lines:
+            self.stats['lines'] += len(lines)
+            try:
+                on_lines(lines)
+            except Exception as e:
+                print(f"Output multiplexer line callback failed: {e}")
+
+class ProcessSupervisor:
+    """Owns all server processes from an asyncio loop running in its own thread.
+    
+    Children are started with asyncio.create_subprocess_exec and their exits
+    are awaited (pidfd on Linux) instead of polled. Each child leads its own
+    session/process group, so signals reach everything it forks (gunicorn
+    workers, bot subprocesses). Output goes through a pipe registered with the
+    OutputMultiplexer. Flask handlers use the thread-safe wrappers
+    (spawn/stop/kill/is_alive), which schedule the work on the loop.
+    """
+    
+    def __init__(self, output, on_exit):
+        self.output = output
+        self.on_exit = on_exit
+        self.children = {}  # pid -> asyncio.subprocess.Process
+        self.stdin_fds = {}  # pid -> write end of the child's stdin pipe
+        self.loop = asyncio.new_event_loop()
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='process-supervisor', daemon=True)
+        self._thread.start()
+        self._ready.wait()
+    
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        if sys.version_info < (3, 12) and hasattr(asyncio, 'PidfdChildWatcher') and hasattr(os, 'pidfd_open'):
+            # Await exits on pidfds instead of the default one-thread-per-child watcher
+            try:
+                os.close(os.pidfd_open(os.getpid()))
+                watcher = asyncio.PidfdChildWatcher()
+                watcher.attach_loop(self.loop)
+                asyncio.set_child_watcher(watcher)
+            except OSError:
+                pass
+        self.loop.call_soon(self._ready.set)
+        self.loop.run_forever()
+    
+    def call(self, coro, timeout=None):
+        """Run a coroutine on the supervisor loop and wait for its result"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+    
+    def submit(self, coro):
+        """Schedule a coroutine on the supervisor loop, returns a concurrent Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+    
+    async def _spawn(self, argv, cwd, env, on_lines, on_eof=None, on_exit=None, timeout=None, stdin=None,
+                     on_start=None):
+        read_fd, write_fd = os.pipe()
+        stdin_fds = None
+        if stdin == subprocess.PIPE:
+            # Our own pipe rather than asyncio's StreamWriter, so any thread can write to it
+            stdin_fds = os.pipe()
+            stdin = stdin_fds[0]
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *argv, stdin=stdin, stdout=write_fd, stderr=subprocess.STDOUT, cwd=cwd, env=env,
+                start_new_session=True)
+        except BaseException:
+            os.close(read_fd)
+            if stdin_fds:
+                os.close(stdin_fds[1])
+            raise
+        finally:
+            os.close(write_fd)
+            if stdin_fds:
+                os.close(stdin_fds[0])
+        if stdin_fds:
+            os.set_blocking(stdin_fds[1], False)
+            self.stdin_fds[process.pid] = stdin_fds[1]
+        self.children[process.pid] = process
+        self.output.register(read_fd, on_lines, on_eof)
+        if on_start is not None:
+            # Runs before the watcher exists, so even an instant exit finds the pid recorded
+            try:
+                on_start(process.pid)
+            except Exception as e:
+                print(f"Process start handler failed for PID {process.pid}: {e}")
+        self.loop.create_task(self._watch(process, on_exit or self.on_exit, timeout))
+        return process.pid
+    
+    async def _spawn_pty(self, argv, cwd, env, on_lines, on_eof=None, on_exit=None):
+        """Start argv on a new pseudo-terminal (as its controlling tty); returns (pid, master_fd)"""
+        master_fd, slave_fd = pty.openpty()
+        # Input is logged by the panel, so the terminal should not echo it back
+        attrs = termios.tcgetattr(slave_fd)
+        attrs[3] &= ~termios.ECHO
+        termios.tcsetattr(slave_fd, termios.TCSANOW, attrs)
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *PTY_EXEC, *argv, stdin=slave_fd, stdout=slave_fd, stderr=slave_fd, cwd=cwd, env=env,
+                start_new_session=True)
+        except BaseException:
+            os.close(master_fd)
+            raise
+        finally:
+            os.close(slave_fd)
+        self.children[process.pid] = process
+        # The multiplexer owns master_fd from here on and closes it on EOF (EIO once the shell exits)
+        self.output.register(master_fd, on_lines, on_eof, flush_partial=True)
+        self.loop.create_task(self._watch(process, on_exit or self.on_exit))
+        return process.pid, master_fd
+    
+    async def _watch(self, process, on_exit, timeout=None):
+        try:
+            returncode = await asyncio.wait_for(process.wait(), timeout)
+        except asyncio.TimeoutError:
+            # Out of time: the whole group goes, like a kill
+            self._signal(process.pid, signal.SIGKILL, process.pid)
+            returncode = await process.wait()
+        self.children.pop(process.pid, None)
+        stdin_fd = self.stdin_fds.pop(process.pid, None)
+        if stdin_fd is not None:
+            os.close(stdin_fd)
+        try:
+            on_exit(process.pid, returncode)
+        except Exception as e:
+            print(f"Process exit handler failed for PID {process.pid}: {e}")
+    
+    async def _watch_adopted(self, pid):
+        await self._wait_exit(pid, None)
+        try:
+            self.on_exit(pid, None)
+        except Exception as e:
+            print(f"Process exit handler failed for PID {pid}: {e}")
+    
+    async def _wait_exit(self, pid, timeout):
+        """True once pid has exited, False on timeout; also works for pids we did not spawn"""
+        process = self.children.get(pid)
+        if process is not None:
+            try:
+                await asyncio.wait_for(process.wait(), timeout)
+                return True
+            except asyncio.TimeoutError:
+                return False
+        
+        pidfd = None
+        if hasattr(os, 'pidfd_open'):
+            try:
+                pidfd = os.pidfd_open(pid)
+            except ProcessLookupError:
+                return True
+            except OSError:
+                pidfd = None
+        if pidfd is not None:
+            # A pidfd becomes readable when the process exits, no polling needed
+            exited = self.loop.create_future()
+            self.loop.add_reader(pidfd, lambda: exited.done() or exited.set_result(True))
+            try:
+                await asyncio.wait_for(exited, timeout)
+                return True
+            except asyncio.TimeoutError:
+                return False
+            finally:
+                self.loop.remove_reader(pidfd)
+                os.close(pidfd)
+        
+        deadline = None if timeout is None else self.loop.time() + timeout
+        while deadline is None or self.loop.time() < deadline:
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                return True
+            except PermissionError:
+                pass
+            await asyncio.sleep(0.1)
+        return False
+    
+    @staticmethod
+    def _signal(pid, sig, pgid=None):
+        """Signal the whole process group and session if there is one, else just the pid"""
+        signalled = False
+        if pgid:
+            try:
+                os.killpg(pgid, sig)
+                signalled = True
+            except ProcessLookupError:
+                pass
+            # Members that moved to a process group of their own are still in the leader's session
+            for member in session_members([pgid])[pgid]:
+                try:
+                    if os.getpgid(member) != pgid:
+                        os.kill(member, sig)
+                        signalled = True
+                except (ProcessLookupError, PermissionError):
+                    pass
+            if signalled:
+                return True
+        try:
+            os.kill(pid, sig)
+            return True
+        except ProcessLookupError:
+            return False
+    
+    @staticmethod
+    def group_alive(pgid):
+        """True while any process of the group, or of the session it leads, is left"""
+        try:
+            os.killpg(pgid, 0)
+            return True
+        except ProcessLookupError:
+            return bool(session_members([pgid])[pgid])
+        except PermissionError:
+            return True
+    
+    async def _wait_group_exit(self, pgid, timeout):
+        # Members left behind by the leader (forked workers) have no pidfd we own
+        deadline = self.loop.time() + timeout
+        while self.group_alive(pgid):
+            if self.loop.time() >= deadline:
+                return False
+            await asyncio.sleep(0.05)
+        return True
+    
+    async def _stop(self, pid, timeout, pgid=None):
+        """Returns (graceful, returncode); graceful is False if SIGKILL was needed"""
+        graceful = True
+        started = self.loop.time()
+        if self._signal(pid, signal.SIGTERM, pgid):
+            exited = await self._wait_exit(pid, timeout)
+            if exited and pgid:
+                exited = await self._wait_group_exit(pgid, max(timeout - (self.loop.time() - started), 0.5))
+            if not exited:
+                graceful = False
+                self._signal(pid, signal.SIGKILL, pgid)
+                await self._wait_exit(pid, 5)
+        process = self.children.get(pid)
+        if process is not None:
+            await process.wait()
+            return graceful, process.returncode
+        return graceful, None
+    
+    async def _kill(self, pid, pgid=None):
+        self._signal(pid, signal.SIGKILL, pgid)
+        await self._wait_exit(pid, 5)
+        if pgid:
+            await self._wait_group_exit(pgid, 5)
+        process = self.children.get(pid)
+        if process is not None:
+            await process.wait()
+            return process.returncode
+        return None
+    
+    async def _stop_many(self, targets):
+        results = await asyncio.gather(*(self._stop(pid, timeout, pgid) for pid, timeout, pgid in targets),
+                                       return_exceptions=True)
+        return dict(zip((target[0] for target in targets), results))
+    
+    def spawn(self, argv, cwd, env, on_lines, on_eof=None, on_exit=None, timeout=None, stdin=None, on_start=None):
+        """Start a child, return its pid; on_exit overrides the supervisor-wide exit callback.
+        
+        on_start(pid) runs on the loop before the exit watcher is created; record the
+        pid there rather than after spawn() returns, or a fast exit can slip past.
+        """
+        return self.call(self._spawn(argv, cwd, env, on_lines, on_eof, on_exit, timeout, stdin, on_start),
+                         timeout=30)
+    
+    def stop(self, pid, timeout=STOP_TIMEOUT, pgid=None):
+        """SIGTERM the group, await exit for up to timeout seconds, then SIGKILL; returns (graceful, returncode)"""
+        return self.call(self._stop(pid, timeout, pgid))
+    
+    def kill(self, pid, pgid=None):
+        """SIGKILL the group immediately; returns the exit code if it was our child"""
+        return self.call(self._kill(pid, pgid))
+    
+    def spawn_pty(self, argv, cwd, env, on_lines, on_eof=None, on_exit=None):
+        """Start a child on a pseudo-terminal, return (pid, master_fd)"""
+        return self.call(self._spawn_pty(argv, cwd, env, on_lines, on_eof, on_exit), timeout=30)
+    
+    def write_stdin(self, pid, data):
+        """Write bytes to a child's stdin pipe (spawned with stdin=PIPE)"""
+        fd = self.stdin_fds.get(pid)
+        if fd is None:
+            raise RuntimeError("Process has no open stdin")
+        view = memoryview(data)
+        while view:
+            try:
+                written = os.write(fd, view)
+            except BlockingIOError:
+                raise RuntimeError("Process is not reading its stdin")
+            except BrokenPipeError:
+                raise RuntimeError("Process closed its stdin")
+            view = view[written:]
+    
+    def kill_nowait(self, pid, pgid=None):
+        """Schedule a group SIGKILL without waiting; safe from any thread"""
+        return self.submit(self._kill(pid, pgid))
+    
+    def stop_many(self, targets):
+        """Stop [(pid, timeout, pgid), ...] concurrently; returns {pid: (graceful, returncode) or exception}"""
+        return self.call(self._stop_many(targets))
+    
+    def adopt(self, pid):
+        """Report the exit of a process left running by a previous panel instance"""
+        self.submit(self._watch_adopted(pid))
+    
+    def owns(self, pid):
+        return pid in self.children
+    
+    def is_alive(self, pid):
+        process = self.children.get(pid)
+        return process is not None and process.returncode is None
+    
+    @staticmethod
+    def pid_alive(pid, started_at=None):
+        """Whether a pid we did not spawn is still the process started at started_at (a timestamp).
+        
+        A process created more than a couple of seconds after started_at is one that
+        reused the pid; the slack covers the coarse create_time the kernel reports.
+        """
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        try:
+            import psutil
+        except ImportError:
+            return True
+        try:
+            process = psutil.Process(pid)
+            if process.status() == psutil.STATUS_ZOMBIE:
+                return False
+            return started_at is None or process.create_time() <= started_at + 2
+        except psutil.NoSuchProcess:
+            return False
+        except psutil.AccessDenied:
+            return True
+
+class HealthProber:
+    """Periodically probes every running server (TCP connect or HTTP GET) on the supervisor loop.
+    
+    All probes of a tick run concurrently as coroutines, bounded by a semaphore,
+    so hundreds of servers cost no extra threads. Per-server rolling windows give
+    latency stats and a state: healthy, degraded, unhealthy or unknown.
+    """
+    
+    def __init__(self, manager, loop, interval=HEALTH_INTERVAL):
+        self.manager = manager
+        self.loop = loop
+        self.interval = interval
+        self.results = {}  # name -> {'samples': deque of (ok, latency_ms), 'failures': int, ...}
+        self.stats = {'ticks': 0, 'probes': 0, 'last_tick_ms': 0.0, 'last_tick_at': None}
+        self._semaphore = None
+    
+    def start(self):
+        if self.interval > 0:
+            asyncio.run_coroutine_threadsafe(self._run(), self.loop)
+    
+    async def _run(self):
+        self._semaphore = asyncio.Semaphore(HEALTH_CONCURRENCY)
+        while True:
+            try:
+                await self.tick()
+            except Exception as e:
+                print(f"Health check tick failed: {e}")
+            await asyncio.sleep(self.interval)
+    
+    async def tick(self):
+        started = self.loop.time()
+        targets = []
+        for name, server in list(self.manager.servers.items()):
+            mode, path = self.manager.get_health_check(name)
+            if mode == 'none' or server.get('status') != 'running' or not server.get('ready'):
+                continue
+            targets.append((server, mode, path))
+        live = {server['name'] for server, _, _ in targets}
+        for name in list(self.results):
+            if name not in live:
+                del self.results[name]
+        await asyncio.gather(*(self._probe(server, mode, path) for server, mode, path in targets))
+        self.stats['ticks'] += 1
+        self.stats['probes'] += len(targets)
+        self.stats['last_tick_ms'] = round((self.loop.time() - started) * 1000, 1)
+        self.stats['last_tick_at'] = time.time()
+    
+    async def _probe(self, server, mode, path):
+        name = server['name']
+        host = self.manager.probe_host(name)
+        port = int(server['port'])
+        async with self._semaphore:
+            started = self.loop.time()
+            if mode == 'http':
+                status = await http_probe(host, port, path, HEALTH_TIMEOUT)
+                ok = status is not None and status < 500
+                error = None if ok else (f"HTTP {status}" if status else "No HTTP response")
+            else:
+                status = None
+                try:
+                    _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), HEALTH_TIMEOUT)
+                    writer.close()
+                    ok, error = True, None
+                except (OSError, asyncio.TimeoutError) as e:
+                    ok, error = False, str(e) or 'Timed out'
+            latency_ms = round((self.loop.time() - started) * 1000, 2)
+        self.record(name, ok, latency_ms, error, status)
+    
+    def record(self, name, ok, latency_ms, error=None, status=None):
+        result = self.results.get(name)
+        if result is None:
+            result = self.results[name] = {'samples': deque(maxlen=HEALTH_WINDOW), 'failures': 0, 'state': 'unknown'}
+        result['samples'].append((ok, latency_ms))
+        result['failures'] = 0 if ok else result['failures'] + 1
+        result.update(last_ok=ok, last_latency_ms=latency_ms, last_error=error, last_status=status,
+                      checked_at=time.time())
+        state = self._state(result)
+        if state != result['state']:
+            if result['state'] != 'unknown' or state != 'healthy':
+                self.manager.add_console_log(name, f"Health check: {state}" + (f" ({error})" if error else ''))
+            result['state'] = state
+            # The state is part of /api/servers/status
+            self.manager.status_version += 1
+    
+    def _state(self, result):
+        if result['failures'] >= HEALTH_FAILURES:
+            return 'unhealthy'
+        latencies = [latency for ok, latency in result['samples'] if ok]
+        if result['failures'] or not latencies or sum(latencies) / len(latencies) > HEALTH_DEGRADED_MS:
+            return 'degraded'
+        return 'healthy'
+    
+    def state(self, name):
+        result = self.results.get(name)
+        return result['state'] if result else 'unknown'
+    
+    def summary(self, name):
+        """Rolling stats for one server"""
+        result = self.results.get(name)
+        if result is None:
+            return {'state': 'unknown', 'samples': 0}
+        samples = list(result['samples'])
+        latencies = sorted(latency for ok, latency in samples if ok)
+        return {
+            'state': result['state'],
+            'samples': len(samples),
+            'success_rate': round(sum(1 for ok, _ in samples if ok) / len(samples), 3),
+            'consecutive_failures': result['failures'],
+            'last_ok': result['last_ok'],
+            'last_latency_ms': result['last_latency_ms'],
+            'last_status': result['last_status'],
+            'last_error': result['last_error'],
+            'checked_at': result['checked_at'],
+            'avg_ms': round(sum(latencies) / len(latencies), 2) if latencies else None,
+            'min_ms': latencies[0] if latencies else None,
+            'max_ms': latencies[-1] if latencies else None,
+            'p95_ms': latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)] if latencies else None
+        }
+
+# Terminal control sequences (colours, cursor movement, titles) have no place in the console log
+ANSI_ESCAPE = re.compile(r'\x1b\[[0-9;?]*[ -/]*[@-~]|\x1b\][^\x07\x1b]*(?:\x07|\x1b\\)|\x1b[@-Z\\-_]')
+
+class ShellSession:
+    """A long-lived shell on a pseudo-terminal in a server's directory.
+    
+    Commands are written to the PTY, so cwd, variables and activated venvs
+    persist between them, and interactive programs see a real terminal.
+    Output is read by the OutputMultiplexer and goes to the server console.
+    """
+    
+    def __init__(self, pid=None, master_fd=None):
+        self.pid = pid
+        self.master_fd = master_fd
+        self.alive = True
+        self.created_at = time.time()
+        self.last_used = self.created_at
+        self.inputs = 0
+        self._lock = threading.Lock()
+    
+    def write(self, data):
+        with self._lock:
+            if not self.alive:
+                raise RuntimeError("Shell session has ended")
+            self.last_used = time.time()
+            self.inputs += 1
+            view = memoryview(data)
+            while view:
+                try:
+                    view = view[os.write(self.master_fd, view):]
+                except BlockingIOError:
+                    raise RuntimeError("Shell is not reading its input")
+    
+    def closed(self):
+        # Called on EOF, once the multiplexer has closed master_fd
+        with self._lock:
+            self.alive = False
+    
+    def to_dict(self):
+        return {
+            'pid': self.pid,
+            'alive': self.alive,
+            'created_at': self.created_at,
+            'last_used': self.last_used,
+            'idle': round(time.time() - self.last_used, 1),
+            'inputs': self.inputs
+        }
+
+class JobCancelled(Exception):
+    """Raised by Job.check() inside a job whose cancellation was requested"""
+
+class Job:
+    """One long-running operation: status, progress, result and cooperative cancellation"""
+    
+    def __init__(self, kind, target=None, description=''):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.target = target
+        self.description = description
+        self.status = 'queued'
+        self.done = 0
+        self.total = None
+        self.message = ''
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._cancel = threading.Event()
+        self._cancel_callbacks = []
+    
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+    
+    @property
+    def finished(self):
+        return self.status in ('succeeded', 'failed', 'cancelled')
+    
+    def progress(self, done=None, total=None, message=None):
+        if done is not None:
+            self.done = done
+        if total is not None:
+            self.total = total
+        if message is not None:
+            self.message = message
+    
+    def check(self):
+        """Cancellation point for job functions"""
+        if self._cancel.is_set():
+            raise JobCancelled()
+    
+    def on_cancel(self, callback):
+        """Run callback (e.g. process.kill) when the job is cancelled while running"""
+        self._cancel_callbacks.append(callback)
+        if self._cancel.is_set():
+            callback()
+    
+    def cancel(self):
+        self._cancel.set()
+        for callback in list(self._cancel_callbacks):
+            try:
+                callback()
+            except Exception:
+                pass
+    
+    def to_dict(self):
+        percent = None
+        if self.total:
+            percent = round(min(self.done / self.total, 1.0) * 100, 1)
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'server': self.target,
+            'description': self.description,
+            'status': self.status,
+            'done': self.done,
+            'total': self.total,
+            'percent': percent,
+            'message': self.message,
+            'result': self.result,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at
+        }
+
+class JobQueue:
+    """Bounded worker pool for heavy operations with per-kind concurrency limits.
+    
+    A job only gets a worker when fewer than `workers` jobs run in total and its
+    kind is below its limit; otherwise it waits in FIFO order. Finished jobs are
+    kept (up to `history`) so clients can poll for the result.
+    """
+    
+    def __init__(self, workers=JOB_WORKERS, limits=None, history=JOB_HISTORY):
+        self.workers = workers
+        self.limits = dict(JOB_LIMITS if limits is None else limits)
+        self.history = history
+        self.jobs = {}
+        self._queued = deque()
+        self._running = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+    
+    def submit(self, kind, func, *args, target=None, description=''):
+        """Queue func(job, *args); returns the Job"""
+        job = Job(kind, target, description)
+        with self._lock:
+            self.jobs[job.id] = job
+            self._queued.append((job, func, args))
+            self._dispatch()
+            self._trim()
+        return job
+    
+    def track(self, kind, target=None, description=''):
+        """Register work that runs elsewhere (e.g. a child process) as a running job"""
+        job = Job(kind, target, description)
+        job.status = 'running'
+        job.started_at = time.time()
+        with self._lock:
+            self.jobs[job.id] = job
+            self._trim()
+        return job
+    
+    def finish(self, job, result=None, error=None):
+        """Complete a tracked job"""
+        job.result = result
+        job.error = error
+        if job.cancelled:
+            job.status = 'cancelled'
+        else:
+            job.status = 'failed' if error else 'succeeded'
+        job.finished_at = time.time()
+        with self._lock:
+            self._trim()
+    
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+    
+    def list(self, kind=None, target=None):
+        return [job for job in list(self.jobs.values())
+                if (kind is None or job.kind == kind) and (target is None or job.target == target)]
+    
+    def cancel(self, job_id):
+        """Cancel a queued job, or ask a running one to stop; False if unknown or finished"""
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.finished:
+                return False
+            if job.status == 'queued':
+                self._queued = deque(entry for entry in self._queued if entry[0] is not job)
+                job.status = 'cancelled'
+                job.finished_at = time.time()
+                return True
+        job.cancel()
+        return True
+    
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'limits': dict(self.limits),
+                'queued': len(self._queued),
+                'running': dict(self._running),
+                'jobs': len(self.jobs)
+            }
+    
+    def _dispatch(self):
+        # Called with the lock held
+        if sum(self._running.values()) >= self.workers:
+            return
+        for entry in list(self._queued):
+            job = entry[0]
+            if self._running.get(job.kind, 0) >= self.limits.get(job.kind, self.workers):
+                continue
+            self._queued.remove(entry)
+            self._running[job.kind] = self._running.get(job.kind, 0) + 1
+            job.status = 'running'
+            job.started_at = time.time()
+            self._executor.submit(self._run, *entry)
+            if sum(self._running.values()) >= self.workers:
+                break
+    
+    def _trim(self):
+        finished = [job for job in self.jobs.values() if job.finished]
+        for job in finished[:max(len(finished) - self.history, 0)]:
+            del self.jobs[job.id]
+    
+    def _run(self, job, func, args):
+        try:
+            job.check()
+            job.result = func(job, *args)
+            job.status = 'succeeded'
+        except JobCancelled:
+            job.status = 'cancelled'
+        except Exception as e:
+            job.error = str(e)
+            job.status = 'failed'
+        finally:
+            job.finished_at = time.time()
+            with self._lock:
+                self._running[job.kind] -= 1
+                self._dispatch()
+                self._trim()
+
+class TimeSeries:
+    """Fixed-memory round-robin series with one float32 ring per resolution tier.
+    
+    Values are averaged into the current bucket of every tier; when a tier moves
+    to a new bucket the average is written to its slot and skipped slots are set
+    to NaN. Slot timestamps are implied by the position, so a point costs 4 bytes.
+    """
+    
+    def __init__(self, tiers=None):
+        self.tiers = []
+        for step, slots in (tiers or METRICS_TIERS):
+            self.tiers.append({
+                'step': step,
+                'slots': slots,
+                'values': array('f', [math.nan]) * slots,
+                'bucket': None,  # index (time // step) of the bucket being accumulated
+                'sum': 0.0,
+                'count': 0,
+            })
+    
+    def add(self, timestamp, value):
+        for tier in self.tiers:
+            bucket = int(timestamp // tier['step'])
+            if tier['bucket'] is None:
+                tier['bucket'] = bucket
+            elif bucket > tier['bucket']:
+                values, slots = tier['values'], tier['slots']
+                if tier['count']:
+                    values[tier['bucket'] % slots] = tier['sum'] / tier['count']
+                for skipped in range(tier['bucket'] + 1, min(bucket, tier['bucket'] + slots + 1)):
+                    values[skipped % slots] = math.nan
+                tier['bucket'] = bucket
+                tier['sum'] = 0.0
+                tier['count'] = 0
+            elif bucket < tier['bucket']:
+                continue  # clock went backwards; drop the point
+            tier['sum'] += value
+            tier['count'] += 1
+    
+    def pick_tier(self, seconds):
+        """Finest tier whose retention covers `seconds`, else the coarsest"""
+        for tier in self.tiers:
+            if tier['step'] * tier['slots'] >= seconds:
+                return tier
+        return self.tiers[-1]
+    
+    def query(self, start, end, tier=None):
+        """[[timestamp, value], ...] between start and end, skipping empty slots"""
+        tier = tier or self.pick_tier(end - start)
+        if tier['bucket'] is None:
+            return []
+        step, slots, values = tier['step'], tier['slots'], tier['values']
+        first = max(int(start // step), tier['bucket'] - slots + 1)
+        last = min(int(end // step), tier['bucket'])
+        points = []
+        for bucket in range(first, last + 1):
+            if bucket == tier['bucket']:
+                value = tier['sum'] / tier['count'] if tier['count'] else math.nan
+            else:
+                value = values[bucket % slots]
+            if not math.isnan(value):
+                points.append([bucket * step, round(value, 3)])
+        return points
+    
+    def nbytes(self):
+        return sum(tier['values'].itemsize * tier['slots'] for tier in self.tiers)
+
+class MetricsStore:
+    """Named TimeSeries, created on first write"""
+    
+    def __init__(self, tiers=None):
+        self.tiers = list(tiers or METRICS_TIERS)
+        self.series = {}
+        self._lock = threading.Lock()
+    
+    def record(self, timestamp, values):
+        with self._lock:
+            for name, value in values.items():
+                if value is None:
+                    continue
+                series = self.series.get(name)
+                if series is None:
+                    series = self.series[name] = TimeSeries(self.tiers)
+                series.add(timestamp, float(value))
+    
+    def query(self, names, start, end):
+        """Points per known series name and the step that was used"""
+        step = None
+        result = {}
+        with self._lock:
+            for name in names:
+                series = self.series.get(name)
+                if series is None:
+                    continue
+                tier = series.pick_tier(end - start)
+                step = tier['step']
+                result[name] = series.query(start, end, tier)
+        return result, step
+    
+    def names(self):
+        with self._lock:
+            return sorted(self.series)
+    
+    def retention(self):
+        """Seconds covered by the longest tier; no query can reach further back"""
+        return max(step * slots for step, slots in self.tiers)
+    
+    def drop(self, prefix):
+        with self._lock:
+            for name in [name for name in self.series if name.startswith(prefix)]:
+                del self.series[name]
+    
+    def stats(self):
+        with self._lock:
+            return {
+                'series': len(self.series),
+                'bytes': sum(series.nbytes() for series in self.series.values()),
+                'tiers': [{'step': step, 'slots': slots} for step, slots in self.tiers],
+            }
+
+class MetricsSampler:
+    """Background thread that snapshots host and per-server metrics.
+    
+    CPU percent is measured between consecutive samples instead of blocking a
+    request for a second; monitoring endpoints answer from the latest sample.
+    Host samples are kept in a ring buffer and every value is also recorded
+    into a MetricsStore for history queries.
+    """
+    
+    def __init__(self, manager=None, interval=METRICS_INTERVAL, history=METRICS_HISTORY):
+        import platform
+        self.manager = manager
+        self.interval = interval
+        self.samples = deque(maxlen=history)
+        self.store = MetricsStore()
+        self.server_usage = {}  # name -> latest per-server usage
+        self._handles = {}  # name -> {pid: [psutil.Process, read_bytes, write_bytes]}
+        self._recorded = set()  # servers that have series in the store
+        self.process_table = {'rows': [], 'sampled_at': None, 'sample_ms': 0.0}
+        self._process_handles = {}  # pid -> psutil.Process, kept so cpu_percent() has a previous reading
+        self._process_wanted = 0.0
+        self._process_lock = threading.Lock()
+        self.platform = {
+            'platform': platform.system(),
+            'platform_version': platform.version(),
+            'architecture': platform.machine(),
+            'hostname': platform.node(),
+            'python_version': platform.python_version(),
+        }
+        self.stats = {'samples': 0, 'errors': 0, 'last_sample_ms': 0.0}
+        try:
+            import psutil
+            self.available = True
+        except ImportError:
+            self.available = False
+        self._ready = threading.Event()
+        self._demand_lock = threading.Lock()
+        self._primed_at = None  # when the on-demand path took its first cpu_percent() reading
+        self._thread = None
+        if self.available and self.interval > 0:
+            self._thread = threading.Thread(target=self._run, name='metrics-sampler', daemon=True)
+            self._thread.start()
+    
+    def _run(self):
+        import psutil
+        psutil.cpu_percent(None)  # prime the counters the first delta is taken from
+        time.sleep(min(self.interval, 0.5))
+        deadline = time.monotonic()
+        while True:
+            started = time.perf_counter()
+            try:
+                sample = self.sample()
+                self.samples.append(sample)
+                self.stats['samples'] += 1
+                self._ready.set()
+                self.record_host(sample)
+                if self.manager is not None:
+                    self.sample_servers(sample['time'])
+                table_age = sample['time'] - (self.process_table['sampled_at'] or 0)
+                if table_age >= PROCESS_TABLE_INTERVAL and sample['time'] - self._process_wanted < PROCESS_TABLE_IDLE:
+                    self.sample_processes()
+            except Exception as e:
+                self.stats['errors'] += 1
+                print(f"Metrics sample failed: {e}")
+            self.stats['last_sample_ms'] = round((time.perf_counter() - started) * 1000, 2)
+            # Sleep to the next tick rather than a fixed interval so slow samples don't drift the buckets
+            deadline = max(deadline + self.interval, time.monotonic())
+            time.sleep(deadline - time.monotonic())
+    
+    def sample(self):
+        import psutil
+        now = time.time()
+        memory = psutil.virtual_memory()
+        disk = psutil.disk_usage('/')
+        net_io = psutil.net_io_counters()
+        previous = self.samples[-1] if self.samples else None
+        sent_rate = recv_rate = 0.0
+        if previous and net_io:
+            elapsed = now - previous['time']
+            if elapsed > 0:
+                sent_rate = max(net_io.bytes_sent - previous['network']['bytes_sent'], 0) / elapsed
+                recv_rate = max(net_io.bytes_recv - previous['network']['bytes_recv'], 0) / elapsed
+        interfaces = {}
+        for interface, addresses in psutil.net_if_addrs().items():
+            interfaces[interface] = []
+            for addr in addresses:
+                if addr.family == socket.AF_INET:
+                    interfaces[interface].append({'type': 'IPv4', 'address': addr.address, 'netmask': addr.netmask})
+                elif addr.family == socket.AF_INET6:
+                    interfaces[interface].append({'type': 'IPv6', 'address': addr.address, 'netmask': addr.netmask})
+        try:
+            load = [round(value, 2) for value in os.getloadavg()]
+        except (AttributeError, OSError):
+            load = None
+        return {
+            'time': now,
+            'cpu': {'percent': psutil.cpu_percent(None), 'count': psutil.cpu_count()},
+            'memory': {
+                'total': memory.total,
+                'used': memory.used,
+                'percent': memory.percent,
+                'total_gb': round(memory.total / (1024**3), 2),
+                'used_gb': round(memory.used / (1024**3), 2)
+            },
+            'disk': {
+                'total': disk.total,
+                'used': disk.used,
+                'percent': disk.percent,
+                'total_gb': round(disk.total / (1024**3), 2),
+                'used_gb': round(disk.used / (1024**3), 2)
+            },
+            'network': {
+                'bytes_sent': net_io.bytes_sent if net_io else 0,
+                'bytes_recv': net_io.bytes_recv if net_io else 0,
+                'packets_sent': net_io.packets_sent if net_io else 0,
+                'packets_recv': net_io.packets_recv if net_io else 0,
+                'sent_per_sec': round(sent_rate, 1),
+                'recv_per_sec': round(recv_rate, 1)
+            },
+            'interfaces': interfaces,
+            'load': load,
+        }
+    
+    def record_host(self, sample):
+        self.store.record(sample['time'], {
+            'host.cpu': sample['cpu']['percent'],
+            'host.memory': sample['memory']['percent'],
+            'host.memory_used': sample['memory']['used'],
+            'host.disk': sample['disk']['percent'],
+            'host.net_sent': sample['network']['sent_per_sec'],
+            'host.net_recv': sample['network']['recv_per_sec'],
+            'host.load1': sample['load'][0] if sample['load'] else None,
+        })
+    
+    def sample_servers(self, now):
+        """CPU, RSS and IO rates summed over each running server's process tree"""
+        import psutil
+        servers = self.manager.servers
+        tracked = {name: server for name, server in list(servers.items())
+                   if server.get('status') == 'running' or server.get('pgid')}
+        for name in list(self._handles):
+            if name not in tracked:
+                del self._handles[name]
+                self.server_usage.pop(name, None)
+        for name in self._recorded - set(servers):
+            self.store.drop(f'servers.{name}.')
+            self._recorded.discard(name)
+        # One pass over the process table finds the session members of every server
+        sessions = session_members({server['pgid'] for server in tracked.values() if server.get('pgid')})
+        for name in tracked:
+            cached = self._handles.get(name, {})
+            tree = []
+            for pid in self.manager.server_pids(name, sessions):
+                entry = cached.get(pid)
+                if entry is not None and entry[0].is_running():
+                    tree.append(entry[0])
+                    continue
+                try:
+                    tree.append(psutil.Process(pid))
+                except (psutil.NoSuchProcess, psutil.AccessDenied):
+                    continue
+            if not tree:
+                self._handles.pop(name, None)
+                self.server_usage.pop(name, None)
+                continue
+            previous = self.server_usage.get(name)
+            elapsed = now - previous['time'] if previous else 0
+            handles = {}
+            cpu = rss = read_delta = write_delta = fds = threads = 0
+            process_io = []
+            for proc in tree:
+                entry = cached.get(proc.pid)
+                if entry is None or entry[0] != proc:  # new process or pid reused
+                    entry = [proc, None, None]  # its first cpu_percent() call returns 0.0
+                try:
+                    proc = entry[0]
+                    cpu += proc.cpu_percent(None)
+                    rss += proc.memory_info().rss
+                    threads += proc.num_threads()
+                    try:
+                        fds += proc.num_fds()
+                    except (psutil.AccessDenied, AttributeError):
+                        pass
+                    try:
+                        io = proc.io_counters()
+                        if entry[1] is not None and elapsed > 0:
+                            read = max(io.read_bytes - entry[1], 0)
+                            write = max(io.write_bytes - entry[2], 0)
+                            read_delta += read
+                            write_delta += write
+                            process_io.append({
+                                'pid': proc.pid,
+                                'read_per_sec': round(read / elapsed, 1),
+                                'write_per_sec': round(write / elapsed, 1),
+                            })
+                        entry[1], entry[2] = io.read_bytes, io.write_bytes
+                    except (psutil.AccessDenied, AttributeError):
+                        pass
+                    handles[proc.pid] = entry
+                except (psutil.NoSuchProcess, psutil.AccessDenied):
+                    continue
+            self._handles[name] = handles
+            usage = {
+                'time': now,
+                'cpu': round(cpu, 1),
+                'rss': rss,
+                'io_read_per_sec': round(read_delta / elapsed, 1) if elapsed > 0 else 0.0,
+                'io_write_per_sec': round(write_delta / elapsed, 1) if elapsed > 0 else 0.0,
+                'process_io': process_io,
+                'processes': len(handles),
+                'fds': fds,
+                'threads': threads,
+            }
+            self.server_usage[name] = usage
+            self._recorded.add(name)
+            self.store.record(now, {
+                f'servers.{name}.cpu': usage['cpu'],
+                f'servers.{name}.rss': usage['rss'],
+                f'servers.{name}.io_read': usage['io_read_per_sec'],
+                f'servers.{name}.io_write': usage['io_write_per_sec'],
+            })
+    
+    def sample_processes(self):
+        """Refresh the process table from long-lived Process handles and tag managed servers' processes"""
+        with self._process_lock:
+            self._sample_processes()
+    
+    def _sample_processes(self):
+        import psutil
+        started = time.perf_counter()
+        owners = {pid: name for name, handles in list(self._handles.items()) for pid in handles}
+        handles = {}
+        rows = []
+        for pid in psutil.pids():
+            proc = self._process_handles.get(pid)
+            try:
+                if proc is None or not proc.is_running():  # new, or the pid was reused
+                    proc = psutil.Process(pid)
+                info = proc.as_dict(attrs=PROCESS_FIELDS, ad_value=None)
+            except (psutil.NoSuchProcess, psutil.ZombieProcess):
+                continue
+            handles[pid] = proc
+            memory = info.pop('memory_info')
+            cmdline = info.pop('cmdline')
+            info.update(
+                cpu_percent=round(info['cpu_percent'] or 0.0, 1),
+                memory_percent=round(info['memory_percent'] or 0.0, 1),
+                rss=memory.rss if memory else None,
+                command=' '.join(cmdline) if cmdline else '',
+                server=owners.get(pid),
+                new=pid not in self._process_handles
+            )
+            rows.append(info)
+        self._process_handles = handles
+        self.process_table = {
+            'rows': rows,
+            'sampled_at': time.time(),
+            'sample_ms': round((time.perf_counter() - started) * 1000, 2),
+        }
+    
+    def processes(self):
+        """Latest process table; refreshes it in the request if sampling had gone idle"""
+        self._process_wanted = time.time()
+        sampled_at = self.process_table['sampled_at']
+        if self.available and (sampled_at is None or time.time() - sampled_at > PROCESS_TABLE_INTERVAL * 2):
+            with self._process_lock:
+                if self.process_table['sampled_at'] == sampled_at:  # not refreshed by a concurrent request
+                    if not self._process_handles:
+                        # A fresh handle's first cpu_percent() is 0.0; take that reading now and measure against it
+                        self._sample_processes()
+                        time.sleep(PROCESS_COLD_WINDOW)
+                    self._sample_processes()
+        return self.process_table
+    
+    def latest(self, wait=None):
+        """Most recent sample, or None; waits up to `wait` seconds for the first one.
+        
+        With the periodic sampler off (interval 0) the sample is taken in the caller.
+        """
+        if self._thread is None:
+            return self._sample_on_demand(wait) if self.available else None
+        if not self.samples:
+            self._ready.wait(self.interval + 1 if wait is None else wait)
+        return self.samples[-1] if self.samples else None
+    
+    def _sample_on_demand(self, wait):
+        import psutil
+        with self._demand_lock:
+            if not self.samples:
+                # cpu_percent() measures against an earlier reading; the very first one is 0.0
+                if self._primed_at is None:
+                    psutil.cpu_percent(None)
+                    self._primed_at = time.monotonic()
+                remaining = self._primed_at + PROCESS_COLD_WINDOW - time.monotonic()
+                if remaining > 0:
+                    if wait == 0:
+                        return None
+                    time.sleep(remaining)
+            sample = self.sample()
+            self.samples.append(sample)
+            return sample
+    
+    def history(self, since=None):
+        return [sample for sample in list(self.samples) if since is None or sample['time'] > since]
+
+class RequestMetrics:
+    """Per-route request latency histograms and response counts for /metrics"""
+    
+    def __init__(self, buckets=REQUEST_LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.histograms = {}  # (route, method) -> [bucket counts..., +Inf count, sum]
+        self.responses = {}  # (route, method, status) -> count
+        self._lock = threading.Lock()
+    
+    def observe(self, route, method, status, seconds):
+        with self._lock:
+            histogram = self.histograms.get((route, method))
+            if histogram is None:
+                histogram = self.histograms[(route, method)] = [0] * (len(self.buckets) + 1) + [0.0]
+            for index, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram[index] += 1
+            histogram[-2] += 1
+            histogram[-1] += seconds
+            key = (route, method, status)
+            self.responses[key] = self.responses.get(key, 0) + 1
+    
+    def snapshot(self):
+        with self._lock:
+            return ({key: list(value) for key, value in self.histograms.items()}, dict(self.responses))
+
+class DiskUsageTracker:
+    """Per-server directory footprint, kept current without walking the tree per request.
+    
+    Each server is scanned once in the background, panel file operations then
+    adjust the totals by the bytes they write or remove, and a slow periodic
+    rescan (one server at a time) corrects for changes made by the servers
+    themselves. Operations whose effect is unknown just mark the server dirty.
+    """
+    
+    def __init__(self, manager, root='servers', rescan_interval=DISK_RESCAN_INTERVAL):
+        self.manager = manager
+        self.root = root
+        self.rescan_interval = rescan_interval
+        self.usage = {}  # name -> {'bytes', 'files', 'dirs', 'scanned_at', 'scan_ms'}
+        self.stats = {'scans': 0, 'entries': 0}
+        self._dirty = set(manager.servers)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='disk-usage', daemon=True)
+        self._thread.start()
+    
+    @staticmethod
+    def scan(path):
+        """(bytes, files, dirs) under path; iterative so deep trees don't hit the recursion limit"""
+        total = files = dirs = 0
+        stack = [path]
+        while stack:
+            try:
+                with os.scandir(stack.pop()) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                dirs += 1
+                                stack.append(entry.path)
+                            else:
+                                files += 1
+                                total += entry.stat(follow_symlinks=False).st_size
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+        return total, files, dirs
+    
+    def rescan(self, name):
+        started = time.perf_counter()
+        total, files, dirs = self.scan(os.path.join(self.root, name))
+        with self._lock:
+            self._dirty.discard(name)
+            if name not in self.manager.servers:
+                self.usage.pop(name, None)
+                return None
+            self.usage[name] = {
+                'bytes': total,
+                'files': files,
+                'dirs': dirs,
+                'scanned_at': time.time(),
+                'scan_ms': round((time.perf_counter() - started) * 1000, 1),
+            }
+            self.stats['scans'] += 1
+            self.stats['entries'] += files + dirs
+            return dict(self.usage[name])
+    
+    def _run(self):
+        while True:
+            self._wake.wait(5)
+            self._wake.clear()
+            with self._lock:
+                dirty = list(self._dirty)
+            for name in dirty:
+                try:
+                    self.rescan(name)
+                except Exception as e:
+                    print(f"Disk usage scan of {name} failed: {e}")
+            # Periodic rescans: only the stalest server per pass, to spread the IO out
+            now = time.time()
+            stale = [(usage['scanned_at'], name) for name, usage in list(self.usage.items())
+                     if now - usage['scanned_at'] >= self.rescan_interval]
+            if stale:
+                self.invalidate(min(stale)[1])
+    
+    def get(self, name):
+        """Latest totals for a server, or None while its first scan is pending"""
+        with self._lock:
+            usage = self.usage.get(name)
+            if usage is None:
+                self._dirty.add(name)
+                self._wake.set()
+                return None
+            return dict(usage, dirty=name in self._dirty)
+    
+    def add(self, name, delta_bytes, delta_files=0):
+        with self._lock:
+            usage = self.usage.get(name)
+            if usage:
+                usage['bytes'] = max(usage['bytes'] + delta_bytes, 0)
+                usage['files'] = max(usage['files'] + delta_files, 0)
+    
+    def invalidate(self, name):
+        with self._lock:
+            self._dirty.add(name)
+        self._wake.set()
+    
+    def forget(self, name):
+        with self._lock:
+            self.usage.pop(name, None)
+            self._dirty.discard(name)
+    
+    def quota(self, name):
+        """(quota_bytes, action) for a server, or (None, None) without a quota"""
+        server = self.manager.servers.get(name) or {}
+        try:
+            quota_mb = float(server.get('disk_quota_mb') or 0)
+        except (TypeError, ValueError):
+            quota_mb = 0
+        if quota_mb <= 0:
+            return None, None
+        action = server.get('disk_quota_action') or DISK_QUOTA_ACTION
+        return int(quota_mb * 1024 * 1024), action if action in DISK_QUOTA_ACTIONS else 'warn'
+    
+    def check_quota(self, name, incoming):
+        """None if `incoming` more bytes fit, else (action, message)"""
+        quota, action = self.quota(name)
+        usage = self.get(name)
+        if quota is None or usage is None or usage['bytes'] + incoming <= quota:
+            return None
+        message = (f"Disk quota exceeded: {(usage['bytes'] + incoming) / 1024 / 1024:.1f} MB "
+                   f"of {quota / 1024 / 1024:.1f} MB")
+        return action, message
+
+class QuotaExceeded(Exception):
+    """Raised by a job whose writes would go over a blocking disk quota"""
+
 # Server manager class - Lightweight version
 class ServerManager:
     def __init__(self):
         self.servers = {}
         self.servers_file = 'servers.json'
+        self.store = create_state_store(self.servers_file)
+        self.console_logs = ConsoleLogStore('servers')
+        self.events = ServerEventHub()
+        self.output = OutputMultiplexer()
+        self.supervisor = ProcessSupervisor(self.output, self._on_process_exit)
+        self.health = HealthProber(self, self.supervisor.loop)
+        self.save_interval = SAVE_INTERVAL
+        self.save_stats = {
+            'save_requests': 0,
+            'change_requests': 0,
+            'writes': 0,
+            'snapshot_writes': 0,
+            'journal_appends': 0,
+            'errors': 0,
+            'bytes_written': 0,
+            'last_flush_ms': 0.0,
+            'max_flush_ms': 0.0,
+            'total_flush_ms': 0.0,
+            'last_flush_at': None,
+            'load_ms': 0.0
+        }
+        self._dirty = False
+        self._changes = {}
+        self._changes_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._save_event = threading.Event()
+        # Pids being stopped on purpose (their exit is not a crash) and pending auto-restarts
+        self._stopping = set()
+        self._pending_restarts = {}
+        self._command_lock = threading.Lock()
+        self.shells = {}
+        # Status table version, bumped whenever a status-relevant field changes (ETag for /api/servers/status)
+        self.status_version = 0
+        self._status_epoch = int(time.time())
         self.load_servers()
+        self._adopt_running()
+        self.health.start()
+        
+        # Write-behind flusher: coalesces changes into one write per interval
+        self._flush_thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self._flush_thread.start()
+        atexit.register(self.flush_servers)
     
     def load_servers(self):
-        if os.path.exists(self.servers_file):
+        started = time.perf_counter()
+        self.servers = self.store.load()
+        migrated = False
+        for name, server in self.servers.items():
+            # Console output used to live in servers.json; move it into the log ring
+            legacy_logs = server.pop('console_logs', None)
+            if legacy_logs is not None:
+                migrated = True
+                ring = self.console_logs.ring(name)
+                if not ring.stats()['lines']:
+                    for line in legacy_logs:
+                        # Drop the old "[HH:MM:SS] " prefix, the ring stores its own timestamp
+                        ring.append(re.sub(r'^\[\d{2}:\d{2}:\d{2}\] ', '', line))
+        self.save_stats['load_ms'] = round((time.perf_counter() - started) * 1000, 3)
+        if migrated or self.store.journal_records:
+            # Fold the replayed journal into a fresh snapshot in the background
+            self.save_servers()
+    
+    def _adopt_running(self):
+        """Reconcile servers recorded as running with the processes that are actually alive"""
+        for name, server in list(self.servers.items()):
+            if server.get('status') != 'running':
+                continue
+            pid = server.get('pid')
             try:
-                with open(self.servers_file, 'r') as f:
-                    data = json.load(f)
-                    for name, server in data.items():
-                        # Ensure console_logs exists for all servers
-                        if 'console_logs' not in server:
-                            server['console_logs'] = []
-                        self.servers[name] = server
-            except:
-                self.servers = {}
+                started_at = datetime.fromisoformat(server.get('start_time')).timestamp()
+            except (TypeError, ValueError):
+                started_at = None
+            # Nothing is our child yet at startup; check the recorded pid itself
+            if pid and self.supervisor.pid_alive(pid, started_at):
+                # The supervisor reaps it like its own children from now on
+                self.supervisor.adopt(pid)
+                server.setdefault('ready', True)
+            else:
+                self.update_server(name, status='stopped', pid=None, pgid=None)
     
     def save_servers(self):
-        with open(self.servers_file, 'w') as f:
-            json.dump(self.servers, f, indent=2)
+        """Mark the whole registry dirty; the flusher rewrites the snapshot within save_interval"""
+        self.save_stats['save_requests'] += 1
+        self._dirty = True
+        self._save_event.set()
+    
+    def mark_changed(self, name, *fields):
+        """Journal changed fields of one server (no fields = whole record, or removal if gone)"""
+        self.save_stats['change_requests'] += 1
+        if not fields or STATUS_FIELDS.intersection(fields):
+            self.status_version += 1
+        with self._changes_lock:
+            changed = self._changes.get(name)
+            if changed is None:
+                changed = self._changes[name] = set()
+            if fields:
+                changed.update(fields)
+            else:
+                changed.add('*')
+        self._save_event.set()
+    
+    def find_servers(self, **filters):
+        """Names of servers matching all filters (indexed lookup on the SQLite backend)"""
+        if self._dirty or self._changes:
+            # The store trails the in-memory registry by up to save_interval; catch it up
+            # first so a lookup right after a start or stop sees it on every backend
+            self.flush_servers()
+        return self.store.query(self.servers, filters)
+    
+    def rename_server(self, name, new_name):
+        """Rename a server and its directory"""
+        server = self.servers[name]
+        self.console_logs.close(name)
+        old_dir = os.path.join('servers', name)
+        new_dir = os.path.join('servers', new_name)
+        # Venv scripts embed absolute paths; it is rebuilt from the wheel cache on next start
+        shutil.rmtree(os.path.join(old_dir, SERVER_VENV_DIR), ignore_errors=True)
+        server.pop('requirements_hash', None)
+        if os.path.exists(old_dir):
+            os.rename(old_dir, new_dir)
+        server['name'] = new_name
+        self.servers[new_name] = server
+        del self.servers[name]
+        if name in self.shells:
+            self.shells[new_name] = self.shells.pop(name)
+        self.mark_changed(name)
+        self.mark_changed(new_name)
+        return server
+    
+    def update_server(self, name, **fields):
+        """Update fields of a server and journal only those fields"""
+        server = self.servers.get(name)
+        if server is None:
+            return None
+        server.update(fields)
+        self.mark_changed(name, *fields.keys())
+        if 'status' in fields or 'pid' in fields:
+            self.events.notify(name)
+        return server
+    
+    def _flush_loop(self):
+        while True:
+            self._save_event.wait()
+            # Let further changes pile up so they share a single write
+            time.sleep(self.save_interval)
+            self._save_event.clear()
+            self.flush_servers()
+    
+    def _build_journal_records(self, changes):
+        records = []
+        for name, fields in changes.items():
+            server = self.servers.get(name)
+            if server is None:
+                records.append({'op': 'del', 'name': name})
+            elif '*' in fields:
+                records.append({'op': 'set', 'name': name, 'fields': dict(server)})
+            else:
+                records.append({'op': 'set', 'name': name,
+                                'fields': {field: server.get(field) for field in fields}})
+        return records
+    
+    def flush_servers(self):
+        """Write pending changes immediately: journal records, or a full snapshot when needed"""
+        with self._flush_lock:
+            with self._changes_lock:
+                changes, self._changes = self._changes, {}
+            if not self._dirty and not changes:
+                return False
+            started = time.perf_counter()
+            snapshot = self._dirty or self.store.needs_compaction()
+            try:
+                if snapshot:
+                    self._dirty = False
+                    written = self.store.write_snapshot(self.servers)
+                    self.save_stats['snapshot_writes'] += 1
+                else:
+                    written = self.store.append(self._build_journal_records(changes))
+                    self.save_stats['journal_appends'] += 1
+            except (RuntimeError, OSError, TypeError, ValueError) as e:
+                # RuntimeError: a request thread resized the dict mid-dump; retry next round
+                if snapshot:
+                    self._dirty = True
+                else:
+                    with self._changes_lock:
+                        for name, fields in changes.items():
+                            self._changes.setdefault(name, set()).update(fields)
+                self._save_event.set()
+                self.save_stats['errors'] += 1
+                print(f"Error saving {self.servers_file}: {e}")
+                return False
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            stats = self.save_stats
+            stats['writes'] += 1
+            stats['bytes_written'] += written
+            stats['last_flush_ms'] = round(elapsed_ms, 3)
+            stats['max_flush_ms'] = round(max(stats['max_flush_ms'], elapsed_ms), 3)
+            stats['total_flush_ms'] += elapsed_ms
+            stats['last_flush_at'] = datetime.now().isoformat()
+            return True
+    
+    def get_save_stats(self):
+        """Persistence counters: how many saves were requested vs. actually written"""
+        stats = dict(self.save_stats)
+        requested = stats['save_requests'] + stats['change_requests']
+        stats['coalesced'] = max(requested - stats['writes'], 0)
+        stats['avg_flush_ms'] = round(stats['total_flush_ms'] / stats['writes'], 3) if stats['writes'] else 0.0
+        stats['total_flush_ms'] = round(stats['total_flush_ms'], 3)
+        stats['pending'] = self._dirty or bool(self._changes)
+        stats['save_interval'] = self.save_interval
+        stats['backend'] = STORAGE_BACKEND
+        stats['journal_records'] = self.store.journal_records
+        stats['journal_bytes'] = self.store.journal_bytes
+        return stats
     
     def add_server(self, name, host, port, command, server_type='custom', app_file=None):
         server = {
@@ -50,12 +2470,11 @@ class ServerManager:
             'status': 'stopped',
             'pid': None,
             'start_time': None,
-            'console_logs': [],
             'app_file': app_file
         }
         
         self.servers[name] = server
-        self.save_servers()
+        self.mark_changed(name)
         return server
     
     def create_flask_server(self, name, host, port, app_file='app.py', server_type='flask'):
@@ -85,44 +2504,60 @@ class ServerManager:
         
         server = self.add_server(name, display_host, port, command, server_type, app_file)
         # Store actual host for internal use
-        server['actual_host'] = host
+        self.update_server(name, actual_host=host)
         return server
     
+    @staticmethod
+    def format_console_record(record):
+        seq, timestamp, message = record
+        return f"[{datetime.fromtimestamp(timestamp).strftime('%H:%M:%S')}] {message}"
+    
     def get_console_logs(self, name, lines=50):
         if name in self.servers:
-            server = self.servers[name]
-            if 'console_logs' not in server:
-                server['console_logs'] = []
-            return server['console_logs'][-lines:]
+            return [self.format_console_record(record) for record in self.console_logs.ring(name).tail(lines)]
         return []
     
+    def get_console_logs_since(self, name, since, limit=500):
+        """Console lines newer than the since cursor.
+        
+        Returns (lines, cursor, reset); reset means the client's view is stale
+        (the console was cleared or the cursor fell out of scrollback) and the
+        lines replace it instead of being appended.
+        """
+        if name not in self.servers:
+            return [], since, True
+        ring = self.console_logs.ring(name)
+        reset = since < ring.cleared_seq or since > ring.last_seq
+        if reset:
+            since = ring.cleared_seq
+        records = ring.read_since(since, limit)
+        if records and records[0][0] > since + 1:
+            # Some of the requested lines were already rotated out
+            reset = True
+        cursor = records[-1][0] if records else max(since, ring.cleared_seq)
+        return [self.format_console_record(record) for record in records], cursor, reset
+    
     def add_console_log(self, name, message):
         if name in self.servers:
-            server = self.servers[name]
-            if 'console_logs' not in server:
-                server['console_logs'] = []
-            
-            timestamp = datetime.now().strftime('%H:%M:%S')
-            log_entry = f'[{timestamp}] {message}'
-            server['console_logs'].append(log_entry)
-            
-            # Keep only last 100 logs (reduced for lightweight)
-            if len(server['console_logs']) > 100:
-                server['console_logs'] = server['console_logs'][-100:]
-            
-            self.save_servers()
+            self.console_logs.ring(name).append(message)
+            self.events.notify(name)
+    
+    def add_console_lines(self, name, lines):
+        """Append a batch of output lines with a single wake-up for stream viewers"""
+        if name in self.servers and lines:
+            self.console_logs.ring(name).append_many(lines)
+            self.events.notify(name)
     
     def clear_console_logs(self, name):
         """Clear all console logs for a server"""
         if name in self.servers:
-            server = self.servers[name]
-            server['console_logs'] = []
-            self.save_servers()
+            self.console_logs.ring(name).clear()
+            self.events.notify(name)
             return True
         return False
     
-    def install_server_dependencies(self, name, requirements_file='requirements.txt'):
-        """Install dependencies from requirements.txt for a server"""
+    def install_server_dependencies(self, name, requirements_file='requirements.txt', force=False, job=None):
+        """Install dependencies from requirements.txt for a server, unless they are already installed"""
         if name not in self.servers:
             return False, "Server not found"
         
@@ -134,47 +2569,138 @@ class ServerManager:
             return True, "No requirements.txt found, skipping dependency installation."
         
         try:
-            # Log the installation start
-            self.add_console_log(name, f"Installing dependencies from {requirements_file}...")
+            if SERVER_VENVS:
+                python = self.ensure_server_venv(name)
+                pip = self.venv_pip(python)
+            else:
+                python = 'python3'
+                pip = ['pip3']
             
-            # Run pip install
-            process = subprocess.Popen(
-                ['pip3', 'install', '-r', requirements_file],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True,
-                cwd=server_dir
-            )
+            # Same requirements for the same interpreter: nothing for pip to do
+            fingerprint = requirements_hash(requirements_file, python)
+            if not force and self.servers[name].get('requirements_hash') == fingerprint:
+                self.add_console_log(name, "Requirements unchanged since last install, skipping dependency installation.")
+                return True, "Dependencies already installed"
             
-            # Get output
-            output, _ = process.communicate(timeout=60)  # 60 second timeout
+            # Log the installation start
+            self.add_console_log(name, f"Installing dependencies from {requirements_file}...")
             
-            # Log the output
-            for line in output.splitlines():
-                if line.strip():
-                    self.add_console_log(name, line.strip())
+            requirements_path = os.path.abspath(requirements_file)
+            if SERVER_VENVS:
+                # Offline from the shared wheelhouse first; only build/download wheels it is missing
+                os.makedirs(WHEELHOUSE_DIR, exist_ok=True)
+                wheelhouse = os.path.abspath(WHEELHOUSE_DIR)
+                offline = pip + ['install', '--no-index', '--find-links', wheelhouse, '-r', requirements_path]
+                returncode = self._run_pip(name, offline, server_dir, log_output=False, job=job)
+                if returncode == 0:
+                    self.add_console_log(name, "Installed from the local wheel cache")
+                else:
+                    self.add_console_log(name, "Adding missing packages to the local wheel cache...")
+                    if job:
+                        job.progress(message='Building wheels')
+                    returncode = self._run_pip(name, pip + ['wheel', '--wheel-dir', wheelhouse, '--find-links', wheelhouse,
+                                                            '-r', requirements_path], server_dir,
+                                               timeout=WHEEL_BUILD_TIMEOUT, job=job)
+                    if returncode == 0:
+                        if job:
+                            job.progress(message='Installing from the wheel cache')
+                        returncode = self._run_pip(name, offline, server_dir, job=job)
+            else:
+                returncode = self._run_pip(name, pip + ['install', '-r', requirements_path], server_dir, job=job)
             
-            if process.returncode == 0:
+            if returncode == 0:
+                self.update_server(name, requirements_hash=fingerprint,
+                                   requirements_installed_at=datetime.now().isoformat())
                 self.add_console_log(name, "Dependencies installed successfully!")
                 return True, "Dependencies installed successfully"
             else:
-                self.add_console_log(name, f"Dependency installation failed with exit code: {process.returncode}")
-                return False, f"Installation failed with exit code: {process.returncode}"
+                self.add_console_log(name, f"Dependency installation failed with exit code: {returncode}")
+                return False, f"Installation failed with exit code: {returncode}"
                 
+        except subprocess.TimeoutExpired as e:
+            self.add_console_log(name, f"Dependency installation timed out after {e.timeout:g} seconds")
+            return False, "Installation timed out"
+        except JobCancelled:
+            self.add_console_log(name, "Dependency installation cancelled")
+            raise
+        except Exception as e:
+            self.add_console_log(name, f"Error installing dependencies: {str(e)}")
+            return False, str(e)
+    
+    def _run_pip(self, name, argv, cwd, timeout=60, log_output=True, job=None):
+        """Run a pip command, log its output to the console and return the exit code"""
+        if job:
+            job.check()
+        process = subprocess.Popen(
+            argv,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            cwd=cwd
+        )
+        if job:
+            job.on_cancel(process.kill)
+        try:
+            output, _ = process.communicate(timeout=timeout)
         except subprocess.TimeoutExpired:
             process.kill()
-            self.add_console_log(name, "Dependency installation timed out after 60 seconds")
-            return False, "Installation timed out"
-        except Exception as e:
-            self.add_console_log(name, f"Error installing dependencies: {str(e)}")
-            return False, str(e)
+            process.communicate()
+            raise
+        if job:
+            job.check()
+        if log_output:
+            for line in output.splitlines():
+                if line.strip():
+                    self.add_console_log(name, line.strip())
+        return process.returncode
+    
+    def server_venv(self, name):
+        return os.path.join('servers', name, SERVER_VENV_DIR)
+    
+    def venv_bin(self, name, executable):
+        """Absolute path of an executable in the server's venv, or None if there is none"""
+        if not SERVER_VENVS:
+            return None
+        path = os.path.abspath(os.path.join(self.server_venv(name), 'bin', executable))
+        return path if os.path.exists(path) else None
+    
+    def activate_venv(self, name, env):
+        """Point env at the server's venv (as `source .venv/bin/activate` would), if it has one"""
+        venv_dir = os.path.abspath(self.server_venv(name))
+        if SERVER_VENVS and os.path.isdir(venv_dir):
+            env['VIRTUAL_ENV'] = venv_dir
+            env['PATH'] = os.path.join(venv_dir, 'bin') + os.pathsep + env.get('PATH', '')
+            env.pop('PYTHONHOME', None)
+        return env
+    
+    def ensure_server_venv(self, name):
+        """Create the server's venv if it is missing; returns its interpreter"""
+        venv_dir = self.server_venv(name)
+        python = os.path.abspath(os.path.join(venv_dir, 'bin', 'python'))
+        if not os.path.exists(python):
+            self.add_console_log(name, "Creating virtual environment...")
+            # Same interpreter the servers were launched with; without pip the venv takes milliseconds
+            argv = ['python3', '-m', 'venv', venv_dir]
+            if host_pip_targets_venvs():
+                argv.insert(3, '--without-pip')
+            subprocess.run(argv, check=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=120)
+            # Whatever was recorded as installed does not exist in a fresh venv
+            self.update_server(name, requirements_hash=None)
+        return python
+    
+    def venv_pip(self, python):
+        """pip command line that installs into the venv of the given interpreter"""
+        if host_pip_targets_venvs() and not os.path.exists(os.path.join(os.path.dirname(python), 'pip')):
+            return ['python3', '-m', 'pip', '--python', python]
+        return [python, '-m', 'pip']
     
     def add_welcome_message(self, name):
         """Add welcome message to console"""
         welcome_msg = f"Welcome to {name} console! Type 'help' for commands."
         self.add_console_log(name, welcome_msg)
     
-    def start_server(self, name):
+    def start_server(self, name, install_deps=True, auto=False, force_reinstall=False, wait_ready=False,
+                     ready_timeout=None):
         if name not in self.servers:
             return False, "Server not found"
         
@@ -182,16 +2708,28 @@ class ServerManager:
         if server['status'] == 'running':
             return False, "Server is already running"
         
+        self._pending_restarts.pop(id(server), None)
+        if not auto:
+            # A manual start closes the crash-loop breaker and resets the backoff
+            self.reset_restart_stats(name)
+        
         try:
+            leftover = self.leftover_group(name)
+            if leftover:
+                # Workers of the previous run would still hold its port and files
+                self.supervisor.kill(leftover, leftover)
+                self.update_server(name, pgid=None)
+                self.add_console_log(name, "Killed processes left over from the previous run")
+            
             # Create server directory if it doesn't exist
             server_dir = os.path.join('servers', name)
             os.makedirs(server_dir, exist_ok=True)
             
             # Check for requirements.txt and install dependencies
             requirements_file = os.path.join(server_dir, 'requirements.txt')
-            if os.path.exists(requirements_file):
-                self.add_console_log(name, "Found requirements.txt, installing dependencies...")
-                success, message = self.install_server_dependencies(name)
+            if install_deps and os.path.exists(requirements_file):
+                self.add_console_log(name, "Found requirements.txt, checking dependencies...")
+                success, message = self.install_server_dependencies(name, force=force_reinstall)
                 if not success:
                     self.add_console_log(name, f"Warning: Failed to install dependencies: {message}")
             
@@ -214,54 +2752,39 @@ class ServerManager:
                     app_file = os.path.join(server_dir_abs, app_file)
                 command_parts[1] = app_file
             
+            # Run python/gunicorn/etc. from the server's venv when it provides them
+            venv_executable = command_parts and self.venv_bin(name, command_parts[0])
+            if venv_executable:
+                command_parts[0] = venv_executable
+            
             # Set environment variables for the Flask app
             env = os.environ.copy()
             env['PORT'] = str(server['port'])
             env['HOST'] = actual_host
             env['SERVER_NAME'] = name
+            if venv_executable:
+                self.activate_venv(name, env)
             
-            # Start the server process with proper working directory
-            process = subprocess.Popen(
-                command_parts,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True,
-                bufsize=1,
-                universal_newlines=True,
-                cwd=server_dir_abs,
-                env=env
-            )
-            
-            server['pid'] = process.pid
-            server['status'] = 'running'
-            server['start_time'] = datetime.now().isoformat()
-            self.save_servers()
-            
-            # Start log monitoring thread
-            def monitor_logs():
-                while process.poll() is None:
-                    output = process.stdout.readline()
-                    if output:
-                        self.add_console_log(name, output.strip())
-                    time.sleep(0.2)  # Reduced polling frequency
-                
-                # Process ended
-                server['status'] = 'stopped'
-                server['pid'] = None
-                self.save_servers()
-                
-                # Get any remaining output
-                remaining_output = process.stdout.read()
-                if remaining_output:
-                    for line in remaining_output.splitlines():
-                        if line.strip():
-                            self.add_console_log(name, line.strip())
+            # Start the server process with proper working directory; the supervisor
+            # awaits its exit and output is read by the shared I/O thread (looked up
+            # by current name, in case of rename)
+            spawned = time.monotonic()
             
-            # Start monitoring in background thread
-            monitor_thread = threading.Thread(target=monitor_logs, daemon=True)
-            monitor_thread.start()
+            def started(pid):
+                # The child leads its own session, so its process group id is its pid
+                self.update_server(name, pid=pid, pgid=pid, status='running',
+                                   start_time=datetime.now().isoformat(), ready=False)
+                self.add_console_log(name, f"Server started with PID: {pid}")
             
-            self.add_console_log(name, f"Server started with PID: {process.pid}")
+            pid = self.supervisor.spawn(command_parts, server_dir_abs, env,
+                                        lambda lines: self.add_console_lines(server['name'], lines),
+                                        stdin=subprocess.PIPE, on_start=started)
+            readiness = self.supervisor.submit(self._track_readiness(server, pid, spawned, ready_timeout))
+            if wait_ready:
+                ready, error = readiness.result()
+                if not ready:
+                    return False, error
+                return True, "Server is ready"
             return True, "Server started successfully"
             
         except Exception as e:
@@ -273,52 +2796,548 @@ class ServerManager:
             return False, "Server not found"
         server = self.servers[name]
         if server['status'] != 'running':
-            return False, "Server is not running"
+            leftover = self.leftover_group(name)
+            if not leftover:
+                return False, "Server is not running"
+            graceful, _ = self.supervisor.stop(leftover, self.get_stop_timeout(name), leftover)
+            self._mark_stopped(name, graceful)
+            return True, "Leftover processes stopped"
+        self._pending_restarts.pop(id(server), None)
         try:
             pid = server['pid']
+            graceful = True
             if pid:
-                # Try graceful shutdown first
-                os.kill(pid, 15)  # SIGTERM
-                time.sleep(2)
-                # Force kill if still running
+                # Graceful shutdown of the whole tree, escalating to SIGKILL only if it has not exited in time
+                self._stopping.add(pid)
                 try:
-                    os.kill(pid, 9)  # SIGKILL
-                except:
-                    pass
-            server['status'] = 'stopped'
-            server['pid'] = None
-            self.save_servers()
-            self.clear_console_logs(name)
-            self.add_console_log(name, "Server marking as stopped")
+                    graceful, _ = self.supervisor.stop(pid, self.get_stop_timeout(name), server.get('pgid'))
+                finally:
+                    self._stopping.discard(pid)
+            self._mark_stopped(name, graceful)
             return True, "Server stopped successfully"
         except Exception as e:
             return False, str(e)
     
+    def kill_server(self, name):
+        """SIGKILL a server's whole process tree without a grace period"""
+        if name not in self.servers:
+            return False, "Server not found"
+        server = self.servers[name]
+        if server['status'] != 'running':
+            leftover = self.leftover_group(name)
+            if not leftover:
+                return False, "Server is not running"
+            self.supervisor.kill(leftover, leftover)
+            self.update_server(name, pgid=None)
+            self.add_console_log(name, "Leftover processes killed")
+            return True, "Leftover processes killed"
+        self._pending_restarts.pop(id(server), None)
+        try:
+            pid = server.get('pid')
+            if pid:
+                self._stopping.add(pid)
+                try:
+                    self.supervisor.kill(pid, server.get('pgid'))
+                finally:
+                    self._stopping.discard(pid)
+            self.update_server(name, status='stopped', pid=None, pgid=None)
+            self.add_console_log(name, "Server killed")
+            return True, "Server killed"
+        except Exception as e:
+            return False, str(e)
+    
+    def get_readiness(self, name):
+        """(mode, http_path) for a server; bots have no port to wait for by default"""
+        server = self.servers[name]
+        mode = server.get('readiness')
+        if mode not in READINESS_MODES:
+            mode = 'none' if server.get('server_type') == 'python_bot' else 'port'
+        return mode, (server.get('readiness_path') or '/') if mode == 'http' else None
+    
+    def get_health_check(self, name):
+        """(mode, http_path) of the periodic health check; follows the readiness mode by default"""
+        server = self.servers[name]
+        mode = server.get('health_check')
+        readiness, _ = self.get_readiness(name)
+        if mode not in HEALTH_MODES:
+            mode = {'http': 'http', 'port': 'tcp'}.get(readiness, 'none')
+        path = server.get('health_path') or server.get('readiness_path') or '/'
+        return mode, path if mode == 'http' else None
+    
+    def probe_host(self, name):
+        host = self.servers[name].get('actual_host') or self.servers[name].get('host')
+        return '127.0.0.1' if host in (None, '', '0.0.0.0', '::') else host
+    
+    async def _track_readiness(self, server, pid, spawned, timeout=None):
+        """Runs on the supervisor loop after a start; records time-to-listen"""
+        name = server['name']
+        mode, http_path = self.get_readiness(name)
+        if mode == 'none':
+            ready, error = True, None
+        else:
+            ready, error = await wait_until_ready(pid, int(server['port']), timeout or READY_TIMEOUT,
+                                                  http_path, self.probe_host(name))
+        elapsed_ms = round((time.monotonic() - spawned) * 1000, 1)
+        name = server['name']
+        if server.get('pid') != pid or self.servers.get(name) is not server:
+            return False, "Server was stopped before it was ready"
+        stats = dict(server.get('readiness_stats') or {'count': 0, 'failures': 0})
+        if ready and mode != 'none':
+            count = stats['count'] + 1
+            stats.update(count=count, last_ms=elapsed_ms,
+                         min_ms=min(stats.get('min_ms', elapsed_ms), elapsed_ms),
+                         max_ms=max(stats.get('max_ms', elapsed_ms), elapsed_ms),
+                         avg_ms=round((stats.get('avg_ms', 0) * (count - 1) + elapsed_ms) / count, 1),
+                         last_error=None)
+            self.add_console_log(name, f"Server ready on port {server['port']} after {elapsed_ms:g} ms")
+        elif not ready:
+            stats.update(failures=stats['failures'] + 1, last_error=error)
+            self.add_console_log(name, f"Readiness check failed: {error}")
+        stats['mode'] = mode
+        self.update_server(name, ready=ready, ready_at=datetime.now().isoformat() if ready else None,
+                           readiness_stats=stats)
+        return ready, error
+    
+    def test_startup(self, name, command, timeout=None):
+        """Run command like a start and report whether it becomes ready; the process is killed afterwards"""
+        server = self.servers[name]
+        server_dir = os.path.abspath(os.path.join('servers', name))
+        argv = command.split()
+        venv_executable = argv and self.venv_bin(name, argv[0])
+        if venv_executable:
+            argv[0] = venv_executable
+        env = self.activate_venv(name, os.environ.copy())
+        env['PORT'] = str(server['port'])
+        env['HOST'] = server.get('actual_host', '0.0.0.0')
+        env['SERVER_NAME'] = name
+        
+        output = []
+        exited = threading.Event()
+        result = {}
+        
+        def on_exit(pid, returncode):
+            result['returncode'] = returncode
+            exited.set()
+        
+        started = time.monotonic()
+        pid = self.supervisor.spawn(argv, server_dir, env, output.extend, on_exit=on_exit,
+                                    stdin=subprocess.DEVNULL)
+        try:
+            mode, http_path = self.get_readiness(name)
+            if mode == 'none':
+                # Nothing to listen for: surviving a short grace period counts as started
+                if exited.wait(2):
+                    ready, error = result['returncode'] == 0, None
+                else:
+                    ready, error = True, None
+            else:
+                ready, error = self.supervisor.call(wait_until_ready(
+                    pid, int(server['port']), timeout or READY_TIMEOUT, http_path, self.probe_host(name)))
+            elapsed_ms = round((time.monotonic() - started) * 1000, 1)
+        finally:
+            if not exited.is_set():
+                self.supervisor.kill(pid, pid)
+        exited.wait(5)
+        return {
+            'ready': ready,
+            'error': error,
+            'mode': mode,
+            'time_to_listen_ms': elapsed_ms if ready and mode != 'none' else None,
+            'returncode': result.get('returncode') if mode == 'none' or not ready else None,
+            'output': output[-50:]
+        }
+    
+    def open_shell(self, name):
+        """Return the server's shell session, starting one if there is none"""
+        shell = self.shells.get(name)
+        if shell is not None and shell.alive:
+            return shell
+        server = self.servers[name]
+        server_dir = os.path.abspath(os.path.join('servers', name))
+        os.makedirs(server_dir, exist_ok=True)
+        env = self.activate_venv(name, os.environ.copy())
+        # No prompt or line editing: input is logged as "$ command", output arrives as lines
+        env.update(TERM='dumb', PS1='', PS2='', PROMPT_COMMAND='')
+        if shutil.which('bash'):
+            argv = ['bash', '--noprofile', '--norc', '--noediting', '-i']
+        else:
+            argv = ['/bin/sh', '-i']
+        
+        def on_lines(lines):
+            lines = [ANSI_ESCAPE.sub('', line).split('\r')[-1] for line in lines]
+            lines = [line for line in lines if line.strip()]
+            if lines:
+                self.add_console_lines(server['name'], lines)
+        
+        def on_exit(pid, returncode):
+            self.add_console_log(server['name'], f"Shell session ended (exit code {returncode})")
+        
+        shell = ShellSession()
+        shell.pid, shell.master_fd = self.supervisor.spawn_pty(argv, server_dir, env, on_lines,
+                                                               on_eof=shell.closed, on_exit=on_exit)
+        self.shells[name] = shell
+        self.add_console_log(name, f"Shell session started (PID {shell.pid})")
+        self._schedule_shell_reap(server, shell, SHELL_IDLE_TIMEOUT)
+        return shell
+    
+    def _schedule_shell_reap(self, server, shell, delay):
+        loop = self.supervisor.loop
+        
+        def reap():
+            if not shell.alive:
+                return
+            idle = time.time() - shell.last_used
+            if idle < SHELL_IDLE_TIMEOUT:
+                loop.call_later(SHELL_IDLE_TIMEOUT - idle, reap)
+                return
+            self.add_console_log(server['name'], f"Closing shell session idle for {idle:.0f}s")
+            self.supervisor.kill_nowait(shell.pid, shell.pid)
+        
+        loop.call_soon_threadsafe(loop.call_later, delay, reap)
+    
+    def shell_input(self, name, text, newline=True):
+        """Send text (plus Enter) to the server's shell session, starting it if needed"""
+        shell = self.open_shell(name)
+        if newline and text.strip():
+            self.add_console_log(name, f"$ {text}")
+        shell.write((text + ('\n' if newline else '')).encode())
+        return shell
+    
+    def close_shell(self, name):
+        shell = self.shells.pop(name, None)
+        if shell is None or not shell.alive:
+            return False
+        self.supervisor.kill_nowait(shell.pid, shell.pid)
+        return True
+    
+    def send_stdin(self, name, text, newline=True):
+        """Forward text to the running server process's stdin"""
+        server = self.servers[name]
+        if server['status'] != 'running' or not server.get('pid'):
+            raise RuntimeError("Server is not running")
+        self.supervisor.write_stdin(server['pid'], (text + ('\n' if newline else '')).encode())
+        if newline:
+            self.add_console_log(name, f"> {text}")
+    
+    def running_commands(self, name):
+        return [job for job in job_queue.list(kind='command', target=name) if not job.finished]
+    
+    def run_command(self, name, command, timeout=COMMAND_TIMEOUT):
+        """Run a shell command in the server directory as a tracked job streaming into the console"""
+        server = self.servers[name]
+        server_dir = os.path.abspath(os.path.join('servers', name))
+        with self._command_lock:
+            if len(self.running_commands(name)) >= COMMAND_LIMIT:
+                raise RuntimeError(f"{COMMAND_LIMIT} commands are already running for this server")
+            job = job_queue.track('command', target=name, description=command)
+        self.add_console_log(name, f"$ {command}")
+        
+        # Finish once the process has exited and its output is fully read, so the
+        # completion line comes after the last output line
+        state = {'pending': 2, 'returncode': None}
+        state_lock = threading.Lock()
+        
+        def on_lines(lines):
+            self.add_console_lines(server['name'], lines)
+            job.progress(job.done + len(lines), message=lines[-1][:200])
+        
+        def on_exit(pid, returncode):
+            state['returncode'] = returncode
+            done()
+        
+        def done():
+            with state_lock:
+                state['pending'] -= 1
+                if state['pending']:
+                    return
+            returncode = state['returncode']
+            if job.cancelled:
+                self.add_console_log(server['name'], "Command cancelled")
+            elif returncode == -signal.SIGKILL and time.time() - job.started_at >= timeout:
+                self.add_console_log(server['name'], f"Command timed out after {timeout:g} seconds")
+            elif returncode == 0:
+                self.add_console_log(server['name'], f"Command completed successfully")
+            else:
+                self.add_console_log(server['name'], f"Command failed with exit code: {returncode}")
+            job_queue.finish(job, {'returncode': returncode},
+                             None if returncode == 0 else f"Exit code {returncode}")
+        
+        env = self.activate_venv(name, os.environ.copy())
+        try:
+            pid = self.supervisor.spawn(['/bin/sh', '-c', command], server_dir, env, on_lines,
+                                        on_eof=done, on_exit=on_exit, timeout=timeout,
+                                        stdin=subprocess.DEVNULL)
+        except Exception as e:
+            self.add_console_log(name, f"Error executing command: {str(e)}")
+            job_queue.finish(job, error=str(e))
+            raise
+        job.on_cancel(lambda: self.supervisor.kill_nowait(pid, pid))
+        return job
+    
+    def leftover_group(self, name):
+        """pgid of processes a stopped server's leader left behind; cleared once they are gone"""
+        server = self.servers.get(name)
+        if not server or server.get('status') == 'running' or not server.get('pgid'):
+            return None
+        if self.supervisor.group_alive(server['pgid']):
+            return server['pgid']
+        self.update_server(name, pgid=None)
+        return None
+    
+    def server_pids(self, name, sessions=None):
+        """Pids of a server: the leader's descendants plus every member of the session it leads.
+        
+        A stopped server keeps its pgid while processes it left behind are alive, so those
+        are still accounted for. sessions is a session_members() result to share one scan.
+        """
+        server = self.servers.get(name)
+        if not server:
+            return []
+        pid = server.get('pid') if server.get('status') == 'running' else None
+        pgid = server.get('pgid')
+        pids = process_tree_pids(pid) if pid else []
+        if pgid:
+            if sessions is None or pgid not in sessions:
+                sessions = session_members([pgid])
+            seen = set(pids)
+            pids += [member for member in sessions[pgid] if member not in seen]
+        return pids
+    
+    def process_tree(self, name):
+        """psutil.Process objects for a server's leader, descendants and session members"""
+        import psutil
+        tree = []
+        for pid in self.server_pids(name):
+            try:
+                tree.append(psutil.Process(pid))
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+        return tree
+    
+    def get_stop_timeout(self, name):
+        try:
+            return float(self.servers[name].get('stop_timeout') or STOP_TIMEOUT)
+        except (TypeError, ValueError):
+            return STOP_TIMEOUT
+    
+    def _mark_stopped(self, name, graceful=True):
+        self.update_server(name, status='stopped', pid=None, pgid=None)
+        self.clear_console_logs(name)
+        if not graceful:
+            self.add_console_log(name, f"Server did not exit within {self.get_stop_timeout(name):g}s and was killed")
+        self.add_console_log(name, "Server marking as stopped")
+    
+    def stop_all(self, names=None):
+        """Stop servers (default: all running) in parallel; returns {name: (success, message)}"""
+        if names is None:
+            names = [name for name, server in self.servers.items() if server['status'] == 'running']
+        results = {}
+        targets = {}
+        for name in names:
+            server = self.servers.get(name)
+            if server is None:
+                results[name] = (False, "Server not found")
+            elif server['status'] != 'running':
+                results[name] = self.stop_server(name)
+            elif server.get('pid'):
+                targets[server['pid']] = (name, server.get('pgid'))
+                self._pending_restarts.pop(id(server), None)
+            else:
+                self._mark_stopped(name)
+                results[name] = (True, "Server stopped successfully")
+        
+        self._stopping.update(targets)
+        try:
+            outcomes = self.supervisor.stop_many([(pid, self.get_stop_timeout(name), pgid)
+                                                  for pid, (name, pgid) in targets.items()])
+        finally:
+            self._stopping.difference_update(targets)
+        for pid, (name, pgid) in targets.items():
+            outcome = outcomes.get(pid)
+            if isinstance(outcome, BaseException):
+                results[name] = (False, str(outcome))
+                continue
+            self._mark_stopped(name, outcome[0])
+            results[name] = (True, "Server stopped successfully")
+        return results
+    
+    def restart_server(self, name, wait_ready=False):
+        if name not in self.servers:
+            return False, "Server not found"
+        if self.servers[name]['status'] == 'running':
+            success, message = self.stop_server(name)
+            if not success:
+                return False, message
+        return self.start_server(name, wait_ready=wait_ready)
+    
+    def restart_all(self, names=None):
+        """Stop servers (default: all running) in parallel, then start them in parallel"""
+        if names is None:
+            names = [name for name, server in self.servers.items() if server['status'] == 'running']
+        results = {name: (False, "Server not found") for name in names if name not in self.servers}
+        running = [name for name in names if self.servers.get(name, {}).get('status') == 'running']
+        stopped = self.stop_all(running)
+        results.update({name: result for name, result in stopped.items() if not result[0]})
+        # Servers that were already stopped are simply started
+        to_start = [name for name in names if name in self.servers and name not in results]
+        if to_start:
+            with ThreadPoolExecutor(max_workers=min(len(to_start), 8)) as executor:
+                for name, result in zip(to_start, executor.map(self.start_server, to_start)):
+                    results[name] = result
+        return results
+    
+    def _on_process_exit(self, pid, returncode):
+        """Supervisor callback (loop thread) when a child exits"""
+        for server in list(self.servers.values()):
+            if server.get('pid') == pid:
+                # Keep the pgid while forked workers outlive the leader, so they can still be stopped
+                pgid = server.get('pgid')
+                if pgid and not self.supervisor.group_alive(pgid):
+                    pgid = None
+                self.update_server(server['name'], status='stopped', pid=None, pgid=pgid,
+                                   last_exit_code=returncode)
+                self.add_console_log(server['name'], f"Process {pid} exited with code {returncode}")
+                if pgid:
+                    self.add_console_log(server['name'], "Some of its processes are still running; stop or kill the server to end them")
+                if pid not in self._stopping:
+                    self._schedule_restart(server, returncode)
+                break
+    
+    def get_restart_policy(self, name):
+        policy = self.servers[name].get('restart_policy') or 'never'
+        return policy if policy in RESTART_POLICIES else 'never'
+    
+    def get_restart_stats(self, name):
+        """Restart counters for a server, with the fields every policy reports"""
+        stats = {
+            'restarts': 0,
+            'consecutive_failures': 0,
+            'last_exit_code': None,
+            'last_exit_at': None,
+            'last_restart_at': None,
+            'next_restart_at': None,
+            'crash_loop': False,
+            'crash_loop_at': None
+        }
+        stats.update(self.servers[name].get('restart_stats') or {})
+        return stats
+    
+    def reset_restart_stats(self, name):
+        stats = self.get_restart_stats(name)
+        if stats['consecutive_failures'] or stats['crash_loop'] or stats['next_restart_at']:
+            stats.update(consecutive_failures=0, next_restart_at=None, crash_loop=False,
+                         crash_loop_at=None, recent=[])
+            self.update_server(name, restart_stats=stats)
+    
+    def _schedule_restart(self, server, returncode):
+        """Apply the restart policy after an unexpected exit (runs on the supervisor loop)"""
+        name = server['name']
+        policy = self.get_restart_policy(name)
+        now = time.time()
+        stats = self.get_restart_stats(name)
+        stats.update(last_exit_code=returncode, last_exit_at=datetime.now().isoformat(), next_restart_at=None)
+        if policy == 'never' or (policy == 'on-failure' and returncode == 0):
+            self.update_server(name, restart_stats=stats)
+            return
+        
+        # A run that stayed up long enough starts the backoff over
+        try:
+            uptime = now - datetime.fromisoformat(server.get('start_time')).timestamp()
+        except (TypeError, ValueError):
+            uptime = 0
+        if uptime >= RESTART_STABLE_AFTER:
+            stats['consecutive_failures'] = 0
+        stats['consecutive_failures'] += 1
+        
+        recent = [t for t in stats.get('recent', []) if now - t < RESTART_LOOP_WINDOW]
+        if len(recent) >= RESTART_LOOP_LIMIT:
+            stats.update(crash_loop=True, crash_loop_at=datetime.now().isoformat(), recent=recent)
+            self.update_server(name, restart_stats=stats)
+            self.add_console_log(name, f"Crash loop detected ({len(recent)} restarts in {RESTART_LOOP_WINDOW:g}s), "
+                                       f"automatic restarts paused until the server is started manually")
+            return
+        
+        delay = min(RESTART_BACKOFF_BASE * 2 ** (stats['consecutive_failures'] - 1), RESTART_BACKOFF_MAX)
+        delay *= 1 + random.uniform(-RESTART_JITTER, RESTART_JITTER)
+        recent.append(now + delay)
+        stats.update(recent=recent, next_restart_at=datetime.fromtimestamp(now + delay).isoformat())
+        self.update_server(name, restart_stats=stats)
+        self.add_console_log(name, f"Restarting in {delay:.1f}s (policy: {policy})")
+        
+        token = object()
+        self._pending_restarts[id(server)] = token
+        loop = self.supervisor.loop
+        # start_server blocks on the loop, so the restart itself runs in the executor
+        loop.call_later(delay, lambda: loop.run_in_executor(None, self._auto_restart, server, token))
+    
+    def _auto_restart(self, server, token):
+        if self._pending_restarts.get(id(server)) is not token:
+            return
+        name = server['name']
+        if self.servers.get(name) is not server or server['status'] == 'running':
+            return
+        # Count the attempt before starting: once the process runs, its exit handler owns the stats
+        stats = self.get_restart_stats(name)
+        stats.update(restarts=stats['restarts'] + 1, last_restart_at=datetime.now().isoformat(),
+                     next_restart_at=None)
+        self.update_server(name, restart_stats=stats)
+        # Dependencies were installed by the manual start; retrying pip on each crash only delays recovery
+        success, message = self.start_server(name, install_deps=False, auto=True)
+        if not success:
+            # This runs in the executor; _schedule_restart belongs on the supervisor loop
+            self.supervisor.loop.call_soon_threadsafe(self._schedule_restart, server, None)
+    
     def get_server_status(self, name):
+        # Exits are reaped by the supervisor, so the table is current without probing the pid
         if name not in self.servers:
             return {'status': 'not_found'}
         
         server = self.servers[name]
         if server['status'] == 'running' and server['pid']:
-            try:
-                # Check if process is still running
-                os.kill(server['pid'], 0)
-                return {
-                    'status': 'running',
-                    'pid': server['pid'],
-                    'start_time': server['start_time']
-                }
-            except OSError:
-                # Process is dead
-                server['status'] = 'stopped'
-                server['pid'] = None
-                self.save_servers()
-                return {'status': 'stopped'}
+            return {
+                'status': 'running',
+                'pid': server['pid'],
+                'start_time': server['start_time']
+            }
         
         return {'status': server['status']}
+    
+    def status_etag(self):
+        return f"{self._status_epoch}-{self.status_version}"
+    
+    def get_all_statuses(self):
+        """Status, pid, uptime and restart count of every server"""
+        now = time.time()
+        statuses = {}
+        for name, server in list(self.servers.items()):
+            running = server.get('status') == 'running' and server.get('pid')
+            uptime = None
+            if running:
+                try:
+                    uptime = round(now - datetime.fromisoformat(server.get('start_time')).timestamp(), 1)
+                except (TypeError, ValueError):
+                    pass
+            restart_stats = server.get('restart_stats') or {}
+            statuses[name] = {
+                'status': 'running' if running else server.get('status', 'stopped'),
+                'pid': server.get('pid') if running else None,
+                'start_time': server.get('start_time') if running else None,
+                'uptime': uptime,
+                'restarts': restart_stats.get('restarts', 0),
+                'crash_loop': restart_stats.get('crash_loop', False),
+                'last_exit_code': server.get('last_exit_code'),
+                'ready': bool(running and server.get('ready')),
+                'health': self.health.state(name) if running else 'unknown',
+                'time_to_listen_ms': (server.get('readiness_stats') or {}).get('last_ms')
+            }
+        return statuses
 
 # Initialize server manager
+job_queue = JobQueue()
 server_manager = ServerManager()
+metrics_sampler = MetricsSampler(server_manager)
+disk_tracker = DiskUsageTracker(server_manager)
+request_metrics = RequestMetrics()
 
 def get_local_ip():
     try:
@@ -421,6 +3440,324 @@ def cleanup_nginx_and_ssl(domain, ssl_enabled):
         except Exception as e:
             print(f"Error removing SSL certificate: {e}")
 
+def write_backup_zip(job, server_dir, backup_path, skip_dir=None):
+    """Zip a server directory (minus panel state and skip_dir) with per-file progress"""
+    files = []
+    for root, dirs, names in os.walk(server_dir):
+        # Console scrollback and the venv are panel state, not server files
+        dirs[:] = [d for d in dirs if d not in ('.console', SERVER_VENV_DIR)]
+        if skip_dir and os.path.abspath(root) == os.path.abspath(skip_dir):
+            continue
+        files.extend(os.path.join(root, file) for file in names)
+    job.progress(0, len(files), 'Compressing files')
+    try:
+        with zipfile.ZipFile(backup_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
+            for done, file_path in enumerate(files, 1):
+                job.check()
+                zipf.write(file_path, os.path.relpath(file_path, server_dir))
+                job.progress(done)
+    except BaseException:
+        # No half-written backups
+        if os.path.exists(backup_path):
+            os.remove(backup_path)
+        raise
+    return os.path.getsize(backup_path)
+
+def extract_archive(job, archive_path, destination):
+    """Extract a .zip or .tar.gz member by member with progress"""
+    if archive_path.endswith('.zip'):
+        with zipfile.ZipFile(archive_path, 'r') as archive:
+            members = archive.infolist()
+            job.progress(0, len(members), 'Extracting')
+            for done, member in enumerate(members, 1):
+                job.check()
+                archive.extract(member, destination)
+                job.progress(done)
+    else:
+        with tarfile.open(archive_path, 'r:gz') as archive:
+            members = archive.getmembers()
+            job.progress(0, len(members), 'Extracting')
+            for done, member in enumerate(members, 1):
+                job.check()
+                archive.extract(member, destination)
+                job.progress(done)
+    return len(members)
+
+def restore_archive(job, archive_path, server_dir, keep=()):
+    """Replace server_dir with the contents of an archive, carrying over the items in keep.
+    
+    The archive is extracted into a sibling staging directory first and only swapped in
+    once extraction finished, so a cancelled or failed restore leaves the old files intact.
+    """
+    parent, base = os.path.split(os.path.normpath(server_dir))
+    staging = os.path.join(parent, f'.{base}.restore-{uuid.uuid4().hex[:8]}')
+    os.makedirs(staging)
+    try:
+        count = extract_archive(job, archive_path, staging)
+        for item in keep:
+            source = os.path.join(server_dir, item)
+            if not os.path.lexists(source):
+                continue
+            target = os.path.join(staging, item)
+            if os.path.isdir(target) and not os.path.islink(target):
+                shutil.rmtree(target)
+            elif os.path.lexists(target):
+                os.remove(target)
+            os.replace(source, target)
+    except BaseException:
+        # Put back whatever was already carried over before dropping the staging copy
+        for item in keep:
+            target = os.path.join(staging, item)
+            if os.path.lexists(target) and not os.path.lexists(os.path.join(server_dir, item)):
+                os.replace(target, os.path.join(server_dir, item))
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    
+    # Past this point nothing checks for cancellation; the swap is two renames
+    retired = f'{staging}.old'
+    if os.path.exists(server_dir):
+        os.replace(server_dir, retired)
+    os.replace(staging, server_dir)
+    shutil.rmtree(retired, ignore_errors=True)
+    return count
+
+def copy_tree(job, source, destination):
+    """shutil.copytree with per-file progress and cancellation"""
+    total = sum(len(files) for _, _, files in os.walk(source))
+    job.progress(0, total, 'Copying files')
+    
+    def copy_file(src, dst):
+        job.check()
+        shutil.copy2(src, dst)
+        job.progress(job.done + 1)
+    
+    try:
+        shutil.copytree(source, destination, copy_function=copy_file)
+    except JobCancelled:
+        shutil.rmtree(destination, ignore_errors=True)
+        raise
+    return total
+
+def wants_job():
+    """Clients opt into background execution with ?async=1 or {"async": true}"""
+    if request.args.get('async', '').lower() in ('1', 'true', 'yes'):
+        return True
+    data = request.get_json(silent=True)
+    return isinstance(data, dict) and data.get('async') is True
+
+def run_job(kind, func, *args, target=None, description='', error_status=500):
+    """Run func(job, *args) in the request, or queue it and answer 202 with the job id"""
+    if wants_job():
+        job = job_queue.submit(kind, func, *args, target=target, description=description)
+        response = jsonify({'success': True, 'job_id': job.id, 'status_url': url_for('api_job', job_id=job.id)})
+        response.headers['Location'] = url_for('api_job', job_id=job.id)
+        return response, 202
+    try:
+        return jsonify(func(Job(kind, target, description), *args))
+    except QuotaExceeded as e:
+        return jsonify({'success': False, 'error': str(e)}), 507
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), error_status
+
+def file_size(path):
+    try:
+        return os.lstat(path).st_size
+    except OSError:
+        return None
+
+def track_file_change(name, path, old_size):
+    """Adjust a server's tracked disk usage after the panel wrote or removed a file"""
+    new_size = file_size(path)
+    disk_tracker.add(name, (new_size or 0) - (old_size or 0), (new_size is not None) - (old_size is not None))
+
+def quota_warning(name, exceeded, operation='upload'):
+    message = f"{exceeded[1]} (soft quota, {operation} allowed)"
+    server_manager.add_console_log(name, message)
+    return message
+
+def archive_size(path):
+    """Uncompressed bytes in a .zip or .tar.gz without extracting it; None if unreadable"""
+    try:
+        if path.endswith('.zip'):
+            with zipfile.ZipFile(path) as archive:
+                return sum(member.file_size for member in archive.infolist())
+        # The gzip trailer records the uncompressed size (modulo 4 GiB)
+        with open(path, 'rb') as f:
+            f.seek(-4, os.SEEK_END)
+            return int.from_bytes(f.read(4), 'little')
+    except (OSError, zipfile.BadZipFile):
+        return None
+
+DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+def parse_duration(value, default):
+    """Seconds from '90', '90s', '10m', '24h' or '30d'; None if unparseable, not positive or not finite"""
+    if not value:
+        return default
+    value = value.strip().lower()
+    unit = DURATION_UNITS.get(value[-1])
+    try:
+        seconds = float(value[:-1]) * unit if unit else float(value)
+    except ValueError:
+        return None
+    return seconds if math.isfinite(seconds) and seconds > 0 else None
+
+def parse_timeout(value):
+    """Seconds from a JSON number or numeric string; None if absent, ValueError unless positive and finite"""
+    if value is None:
+        return None
+    try:
+        if isinstance(value, bool):
+            raise ValueError
+        seconds = float(value)
+    except (TypeError, ValueError):
+        raise ValueError('timeout must be a number of seconds')
+    if not math.isfinite(seconds) or seconds <= 0:
+        raise ValueError('timeout must be a positive number of seconds')
+    return seconds
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    started = getattr(g, 'request_started', None)
+    if started is not None:
+        # Label by route pattern, not path, so /console/<name> is one series however many servers exist
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        request_metrics.observe(route, request.method, response.status_code, time.perf_counter() - started)
+    return response
+
+def prometheus_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def prometheus_value(value):
+    if isinstance(value, bool):
+        return str(int(value))
+    return str(value) if isinstance(value, int) else repr(float(value))
+
+def render_prometheus():
+    """Text exposition of panel and per-server metrics, built only from cached samples"""
+    lines = []
+    
+    def metric(name, kind, help_text, samples):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in samples:
+            if value is None:
+                continue
+            label_text = ','.join(f'{key}="{prometheus_label(val)}"' for key, val in labels.items())
+            lines.append(f'{name}{{{label_text}}} {prometheus_value(value)}' if label_text else f'{name} {prometheus_value(value)}')
+    
+    now = time.time()
+    servers = list(server_manager.servers.values())
+    usage = metrics_sampler.server_usage
+    
+    def per_server(func):
+        samples = []
+        for server in servers:
+            try:
+                samples.append(({'server': server['name']}, func(server)))
+            except (KeyError, TypeError, ValueError):
+                continue
+        return samples
+    
+    def uptime(server):
+        if server.get('status') != 'running' or not server.get('start_time'):
+            return None
+        return now - datetime.fromisoformat(server['start_time']).timestamp()
+    
+    def log_lines(server):
+        ring = server_manager.console_logs.get(server['name'])
+        return ring.last_seq if ring else None
+    
+    metric('flare_server_up', 'gauge', 'Whether the server process is running',
+           per_server(lambda server: 1 if server.get('status') == 'running' else 0))
+    metric('flare_server_ready', 'gauge', 'Whether the running server passed its readiness check',
+           per_server(lambda server: 1 if server.get('status') == 'running' and server.get('ready') else 0))
+    metric('flare_server_uptime_seconds', 'gauge', 'Seconds since the server was started', per_server(uptime))
+    metric('flare_server_restarts_total', 'counter', 'Automatic restarts performed by the restart policy',
+           per_server(lambda server: (server.get('restart_stats') or {}).get('restarts', 0)))
+    metric('flare_server_crash_loop', 'gauge', 'Whether automatic restarts were suspended after a crash loop',
+           per_server(lambda server: 1 if (server.get('restart_stats') or {}).get('crash_loop') else 0))
+    metric('flare_server_cpu_percent', 'gauge', 'CPU percent summed over the server process tree',
+           per_server(lambda server: usage[server['name']]['cpu']))
+    metric('flare_server_resident_memory_bytes', 'gauge', 'RSS summed over the server process tree',
+           per_server(lambda server: usage[server['name']]['rss']))
+    metric('flare_server_open_fds', 'gauge', 'Open file descriptors in the server process tree',
+           per_server(lambda server: usage[server['name']]['fds']))
+    metric('flare_server_threads', 'gauge', 'Threads in the server process tree',
+           per_server(lambda server: usage[server['name']]['threads']))
+    metric('flare_server_processes', 'gauge', 'Processes in the server process tree',
+           per_server(lambda server: usage[server['name']]['processes']))
+    metric('flare_server_io_read_bytes_per_second', 'gauge', 'Disk read rate of the server process tree',
+           per_server(lambda server: usage[server['name']]['io_read_per_sec']))
+    metric('flare_server_io_write_bytes_per_second', 'gauge', 'Disk write rate of the server process tree',
+           per_server(lambda server: usage[server['name']]['io_write_per_sec']))
+    metric('flare_server_disk_bytes', 'gauge', 'Tracked size of the server directory',
+           per_server(lambda server: disk_tracker.usage[server['name']]['bytes']))
+    metric('flare_server_log_lines_total', 'counter', 'Console lines written for the server',
+           per_server(log_lines))
+    
+    health_states = []
+    health_latency = []
+    health_success = []
+    for server in servers:
+        summary = server_manager.health.summary(server['name'])
+        for state in ('healthy', 'degraded', 'unhealthy', 'unknown'):
+            health_states.append(({'server': server['name'], 'state': state}, 1 if summary['state'] == state else 0))
+        for stat in ('avg', 'p95', 'max'):
+            value = summary.get(f'{stat}_ms')
+            health_latency.append(({'server': server['name'], 'stat': stat}, None if value is None else value / 1000))
+        health_success.append(({'server': server['name']}, summary.get('success_rate')))
+    metric('flare_server_health_state', 'gauge', 'Health probe state (1 for the current state)', health_states)
+    metric('flare_server_health_latency_seconds', 'gauge', 'Health probe latency over the rolling window', health_latency)
+    metric('flare_server_health_success_ratio', 'gauge', 'Share of successful probes in the rolling window', health_success)
+    
+    sample = metrics_sampler.latest(wait=0)
+    if sample:
+        metric('flare_host_cpu_percent', 'gauge', 'Host CPU percent', [({}, sample['cpu']['percent'])])
+        metric('flare_host_memory_used_bytes', 'gauge', 'Host memory in use', [({}, sample['memory']['used'])])
+        metric('flare_host_memory_total_bytes', 'gauge', 'Host memory', [({}, sample['memory']['total'])])
+        metric('flare_host_disk_used_bytes', 'gauge', 'Used space on /', [({}, sample['disk']['used'])])
+        metric('flare_host_network_sent_bytes_total', 'counter', 'Bytes sent on all interfaces', [({}, sample['network']['bytes_sent'])])
+        metric('flare_host_network_received_bytes_total', 'counter', 'Bytes received on all interfaces', [({}, sample['network']['bytes_recv'])])
+        if sample['load']:
+            metric('flare_host_load1', 'gauge', 'One-minute load average', [({}, sample['load'][0])])
+    
+    histograms, responses = request_metrics.snapshot()
+    lines.append('# HELP flare_http_request_duration_seconds Panel request latency by route')
+    lines.append('# TYPE flare_http_request_duration_seconds histogram')
+    for (route, method), histogram in sorted(histograms.items()):
+        labels = f'route="{prometheus_label(route)}",method="{method}"'
+        for bound, count in zip(request_metrics.buckets, histogram):
+            lines.append(f'flare_http_request_duration_seconds_bucket{{{labels},le="{bound:g}"}} {count}')
+        lines.append(f'flare_http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {histogram[-2]}')
+        lines.append(f'flare_http_request_duration_seconds_sum{{{labels}}} {prometheus_value(histogram[-1])}')
+        lines.append(f'flare_http_request_duration_seconds_count{{{labels}}} {histogram[-2]}')
+    metric('flare_http_responses_total', 'counter', 'Panel responses by route, method and status',
+           [({'route': route, 'method': method, 'status': status}, count)
+            for (route, method, status), count in sorted(responses.items())])
+    
+    save_stats = server_manager.get_save_stats()
+    metric('flare_save_requests_total', 'counter', 'save_servers and change notifications requested',
+           [({'kind': 'save'}, save_stats['save_requests']), ({'kind': 'change'}, save_stats['change_requests'])])
+    metric('flare_save_writes_total', 'counter', 'Registry writes actually performed',
+           [({'kind': 'snapshot'}, save_stats['snapshot_writes']), ({'kind': 'journal'}, save_stats['journal_appends'])])
+    metric('flare_save_errors_total', 'counter', 'Registry writes that failed', [({}, save_stats['errors'])])
+    metric('flare_save_written_bytes_total', 'counter', 'Bytes written to the registry', [({}, save_stats['bytes_written'])])
+    metric('flare_save_flush_seconds_total', 'counter', 'Time spent writing the registry',
+           [({}, save_stats['total_flush_ms'] / 1000)])
+    
+    jobs = job_queue.stats()
+    metric('flare_jobs_queued', 'gauge', 'Background jobs waiting for a worker', [({}, jobs['queued'])])
+    metric('flare_jobs_running', 'gauge', 'Background jobs running by kind',
+           [({'kind': kind}, count) for kind, count in sorted(jobs['running'].items())])
+    metric('flare_metrics_sample_seconds', 'gauge', 'Duration of the last metrics sample',
+           [({}, metrics_sampler.stats['last_sample_ms'] / 1000)])
+    return '\n'.join(lines) + '\n'
+
 # Routes - Lightweight version
 @app.route('/')
 def index():
@@ -480,8 +3817,7 @@ def create_server():
         # Save server with extra info
         server = server_manager.create_flask_server(name, host, port, app_file, server_type)
         if server_type == 'gunicorn':
-            server['command'] = gunicorn_command
-            server_manager.save_servers()
+            server_manager.update_server(name, command=gunicorn_command)
         flash(f'Server "{name}" created successfully', 'success')
         return redirect(url_for('dashboard'))
     
@@ -500,19 +3836,16 @@ def start_server(name):
     if not os.path.exists(requirements_path):
         flash('requirements.txt not found. Please add dependencies in settings before starting the server.', 'error')
         return redirect(url_for('dashboard'))
-    # Install dependencies
-    import subprocess
-    try:
-        subprocess.check_call(['pip', 'install', '-r', requirements_path])
-    except Exception as e:
-        flash(f'Failed to install dependencies: {e}', 'error')
-        return redirect(url_for('dashboard'))
-    # Start the server
-    try:
-        server_manager.start_server(name)
+    # Dependencies are installed by start_server, and only when requirements.txt changed
+    # (?reinstall=1 forces a fresh pip install)
+    force_reinstall = request.args.get('reinstall', '').lower() in ('1', 'true', 'yes')
+    # ?wait=1 returns once the server listens on its port (or readiness fails)
+    wait_ready = request.args.get('wait', '').lower() in ('1', 'true', 'yes')
+    success, message = server_manager.start_server(name, force_reinstall=force_reinstall, wait_ready=wait_ready)
+    if success:
         flash('Server started successfully', 'success')
-    except Exception as e:
-        flash(f'Failed to start server: {e}', 'error')
+    else:
+        flash(f'Failed to start server: {message}', 'error')
     return redirect(url_for('dashboard'))
 
 @app.route('/stop_server/<name>')
@@ -544,6 +3877,8 @@ def delete_server(name):
             cleanup_nginx_and_ssl(server['domain'], server.get('ssl_enabled', False))
         
         # Remove server directory
+        server_manager.close_shell(name)
+        server_manager.console_logs.close(name)
         server_dir = os.path.join('servers', name)
         if os.path.exists(server_dir):
             import shutil
@@ -551,21 +3886,245 @@ def delete_server(name):
         
         # Remove from server manager
         del server_manager.servers[name]
-        server_manager.save_servers()
+        server_manager.mark_changed(name)
+        disk_tracker.forget(name)
         
         flash(f'Server "{name}" deleted successfully', 'success')
     else:
         flash('Server not found', 'error')
     
-    return redirect(url_for('dashboard'))
+    return redirect(url_for('dashboard'))
+
+@app.route('/api/server_status/<name>')
+def api_server_status(name):
+    if 'username' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    status = server_manager.get_server_status(name)
+    return jsonify(status)
+
+@app.route('/api/servers/status')
+def api_servers_status():
+    if 'username' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    # Weak ETag: uptime keeps growing but is derived from start_time, which only changes with the version
+    etag = server_manager.status_etag()
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify({'servers': server_manager.get_all_statuses(), 'generated_at': time.time()})
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/api/servers/health')
+def api_servers_health():
+    if 'username' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    health = {}
+    for name in list(server_manager.servers):
+        mode, path = server_manager.get_health_check(name)
+        health[name] = dict(server_manager.health.summary(name), mode=mode, path=path)
+    return jsonify({'servers': health, 'prober': dict(server_manager.health.stats, interval=server_manager.health.interval)})
+
+@app.route('/api/servers/<name>/health')
+def api_server_health(name):
+    if 'username' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    if name not in server_manager.servers:
+        return jsonify({'error': 'Server not found'}), 404
+    
+    mode, path = server_manager.get_health_check(name)
+    return jsonify(dict(server_manager.health.summary(name), mode=mode, path=path))
+
+@app.route('/api/servers')
+def api_list_servers():
+    if 'username' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    filters = {}
+    for field in ('status', 'server_type'):
+        if request.args.get(field):
+            filters[field] = request.args[field]
+    if request.args.get('port'):
+        try:
+            filters['port'] = int(request.args['port'])
+        except ValueError:
+            return jsonify({'error': 'Invalid port'}), 400
+    
+    servers = []
+    for name in server_manager.find_servers(**filters):
+        server = server_manager.servers.get(name)
+        if server:
+            servers.append({
+                'name': name,
+                'status': server.get('status'),
+                'port': server.get('port'),
+                'server_type': server.get('server_type'),
+                'pid': server.get('pid')
+            })
+    return jsonify({'servers': servers})
+
+def fleet_results(results):
+    return {name: {'success': success, 'message': message} for name, (success, message) in results.items()}
+
+@app.route('/api/servers/stop_all', methods=['POST'])
+def api_stop_all():
+    if 'username' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    data = request.get_json(silent=True) or {}
+    started = time.perf_counter()
+    results = server_manager.stop_all(data.get('servers'))
+    return jsonify({'success': all(r[0] for r in results.values()),
+                    'results': fleet_results(results),
+                    'elapsed_ms': round((time.perf_counter() - started) * 1000, 1)})
+
+@app.route('/api/servers/restart_all', methods=['POST'])
+def api_restart_all():
+    if 'username' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    data = request.get_json(silent=True) or {}
+    started = time.perf_counter()
+    results = server_manager.restart_all(data.get('servers'))
+    return jsonify({'success': all(r[0] for r in results.values()),
+                    'results': fleet_results(results),
+                    'elapsed_ms': round((time.perf_counter() - started) * 1000, 1)})
+
+@app.route('/api/servers/<name>/restart_policy', methods=['GET', 'POST'])
+def api_restart_policy(name):
+    if 'username' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    if name not in server_manager.servers:
+        return jsonify({'error': 'Server not found'}), 404
+    
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        policy = data.get('policy')
+        if policy not in RESTART_POLICIES:
+            return jsonify({'error': f"Policy must be one of: {', '.join(RESTART_POLICIES)}"}), 400
+        server_manager.update_server(name, restart_policy=policy)
+        if data.get('reset'):
+            server_manager.reset_restart_stats(name)
+    
+    stats = server_manager.get_restart_stats(name)
+    stats.pop('recent', None)
+    return jsonify({
+        'success': True,
+        'policy': server_manager.get_restart_policy(name),
+        'stats': stats,
+        'backoff': {
+            'base': RESTART_BACKOFF_BASE,
+            'max': RESTART_BACKOFF_MAX,
+            'jitter': RESTART_JITTER,
+            'loop_limit': RESTART_LOOP_LIMIT,
+            'loop_window': RESTART_LOOP_WINDOW
+        }
+    })
+
+@app.route('/api/servers/<name>/start', methods=['POST'])
+def api_start_server(name):
+    if 'username' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    if name not in server_manager.servers:
+        return jsonify({'error': 'Server not found'}), 404
+    
+    data = request.get_json(silent=True) or {}
+    try:
+        timeout = parse_timeout(data.get('timeout'))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    started = time.perf_counter()
+    success, message = server_manager.start_server(name, force_reinstall=bool(data.get('reinstall')),
+                                                   wait_ready=bool(data.get('wait_ready')),
+                                                   ready_timeout=timeout)
+    server = server_manager.servers.get(name, {})
+    return jsonify({
+        'success': success,
+        'message': message,
+        'ready': bool(server.get('ready')),
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 1),
+        'readiness': server.get('readiness_stats')
+    }), 200 if success else 400
+
+@app.route('/api/servers/<name>/readiness')
+def api_server_readiness(name):
+    if 'username' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    if name not in server_manager.servers:
+        return jsonify({'error': 'Server not found'}), 404
+    
+    server = server_manager.servers[name]
+    mode, http_path = server_manager.get_readiness(name)
+    return jsonify({
+        'mode': mode,
+        'path': http_path,
+        'ready': bool(server.get('status') == 'running' and server.get('ready')),
+        'ready_at': server.get('ready_at'),
+        'stats': server.get('readiness_stats')
+    })
+
+@app.route('/api/servers/<name>/kill', methods=['POST'])
+def api_kill_server(name):
+    if 'username' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    success, message = server_manager.kill_server(name)
+    if success:
+        return jsonify({'success': True, 'message': message})
+    return jsonify({'success': False, 'error': message}), 404 if message == 'Server not found' else 400
+
+@app.route('/api/servers/<name>/restart', methods=['POST'])
+def api_restart_server(name):
+    if 'username' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    data = request.get_json(silent=True) or {}
+    success, message = server_manager.restart_server(name, wait_ready=bool(data.get('wait_ready')))
+    if success:
+        return jsonify({'success': True, 'message': message})
+    return jsonify({'success': False, 'error': message}), 404 if message == 'Server not found' else 500
 
-@app.route('/api/server_status/<name>')
-def api_server_status(name):
+@app.route('/api/jobs')
+def api_jobs():
     if 'username' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
     
-    status = server_manager.get_server_status(name)
-    return jsonify(status)
+    jobs = job_queue.list(kind=request.args.get('kind'), target=request.args.get('server'))
+    return jsonify({'jobs': [job.to_dict() for job in jobs], 'queue': job_queue.stats()})
+
+@app.route('/api/jobs/<job_id>')
+def api_job(job_id):
+    if 'username' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def api_cancel_job(job_id):
+    if 'username' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    if not job_queue.cancel(job_id):
+        return jsonify({'success': False, 'error': 'Job not found or already finished'}), 404
+    return jsonify({'success': True, 'job': job_queue.get(job_id).to_dict()})
+
+@app.route('/api/panel/persistence')
+def api_persistence_stats():
+    if 'username' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    return jsonify(server_manager.get_save_stats())
 
 @app.route('/console/<name>')
 def server_console(name):
@@ -594,8 +4153,72 @@ def api_console_logs(name):
     if 'username' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
     
-    logs = server_manager.get_console_logs(name)
-    return jsonify({'logs': logs})
+    since = request.args.get('since', type=int)
+    if since is None:
+        logs = server_manager.get_console_logs(name)
+        cursor = server_manager.console_logs.ring(name).last_seq if name in server_manager.servers else 0
+        return jsonify({'logs': logs, 'cursor': cursor, 'reset': True})
+    
+    # Incremental fetch: only lines after the client's cursor
+    limit = min(request.args.get('limit', 500, type=int), 5000)
+    logs, cursor, reset = server_manager.get_console_logs_since(name, since, limit)
+    return jsonify({'logs': logs, 'cursor': cursor, 'reset': reset})
+
+@app.route('/api/servers/<name>/console/stream')
+def api_console_stream(name):
+    if 'username' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    if name not in server_manager.servers:
+        return jsonify({'error': 'Server not found'}), 404
+    
+    # Resume from the browser's Last-Event-ID after a reconnect
+    resume = request.headers.get('Last-Event-ID') or request.args.get('since')
+    try:
+        cursor = int(resume) if resume is not None else None
+    except ValueError:
+        cursor = None
+    
+    def sse(event, data, event_id=None):
+        message = f'id: {event_id}\n' if event_id is not None else ''
+        return message + f'event: {event}\ndata: {json.dumps(data)}\n\n'
+    
+    def generate():
+        current = cursor
+        last_status = None
+        # Tell EventSource to wait 2s before reconnecting
+        yield 'retry: 2000\n\n'
+        while True:
+            version = server_manager.events.version(name)
+            server = server_manager.servers.get(name)
+            if server is None:
+                yield sse('deleted', {'name': name})
+                return
+            
+            if current is None:
+                lines = server_manager.get_console_logs(name)
+                current = server_manager.console_logs.ring(name).last_seq
+                yield sse('log', {'lines': lines, 'reset': True}, current)
+            else:
+                lines, new_cursor, reset = server_manager.get_console_logs_since(name, current, 500)
+                if lines or reset:
+                    current = new_cursor
+                    yield sse('log', {'lines': lines, 'reset': reset}, current)
+                    if len(lines) >= 500:
+                        continue  # More backlog waiting
+            
+            status = {'status': server.get('status'), 'pid': server.get('pid'),
+                      'start_time': server.get('start_time')}
+            if status != last_status:
+                last_status = status
+                yield sse('status', status)
+            
+            if not server_manager.events.wait(name, version, 15):
+                # Comment line keeps proxies from closing an idle stream
+                yield ': keepalive\n\n'
+    
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/api/send_command/<name>', methods=['POST'])
 def send_command(name):
@@ -608,56 +4231,93 @@ def send_command(name):
     if command:
         # Execute the command in the server's directory
         server_dir = os.path.join('servers', name)
-        if not os.path.exists(server_dir):
+        if name not in server_manager.servers or not os.path.exists(server_dir):
             return jsonify({'success': False, 'error': 'Server directory not found'})
         
+        # Runs in the background; output streams into the console as it is produced
         try:
-            # Log the command
-            server_manager.add_console_log(name, f"$ {command}")
-            
-            # Set up environment
-            env = os.environ.copy()
-            
-            # Execute the command
-            process = subprocess.Popen(
-                command,
-                shell=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                stdin=subprocess.PIPE,
-                text=True,
-                cwd=server_dir,
-                env=env
-            )
-            
-            # Get output with timeout
-            try:
-                output, _ = process.communicate(timeout=15)  # Reduced timeout
-            except subprocess.TimeoutExpired:
-                process.kill()
-                server_manager.add_console_log(name, "Command timed out after 15 seconds")
-                return jsonify({'success': True})
-            
-            # Log the output
-            if output:
-                for line in output.splitlines():
-                    if line.strip():
-                        server_manager.add_console_log(name, line.strip())
-            
-            # Log completion
-            if process.returncode == 0:
-                server_manager.add_console_log(name, f"Command completed successfully")
-            else:
-                server_manager.add_console_log(name, f"Command failed with exit code: {process.returncode}")
-            
-            return jsonify({'success': True})
-            
+            job = server_manager.run_command(name, command)
+        except RuntimeError as e:
+            return jsonify({'success': False, 'error': str(e)}), 429
         except Exception as e:
-            server_manager.add_console_log(name, f"Error executing command: {str(e)}")
             return jsonify({'success': False, 'error': str(e)})
+        return jsonify({'success': True, 'job_id': job.id, 'status_url': url_for('api_job', job_id=job.id)}), 202
     
     return jsonify({'success': False, 'error': 'No command provided'})
 
+@app.route('/api/servers/<name>/commands')
+def api_server_commands(name):
+    if 'username' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    jobs = job_queue.list(kind='command', target=name)
+    if request.args.get('running'):
+        jobs = [job for job in jobs if not job.finished]
+    return jsonify({'commands': [job.to_dict() for job in jobs], 'limit': COMMAND_LIMIT})
+
+@app.route('/api/servers/<name>/commands/<job_id>/cancel', methods=['POST'])
+def api_cancel_command(name, job_id):
+    if 'username' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    job = job_queue.get(job_id)
+    if job is None or job.kind != 'command' or job.target != name:
+        return jsonify({'success': False, 'error': 'Command not found'}), 404
+    if not job_queue.cancel(job_id):
+        return jsonify({'success': False, 'error': 'Command already finished'}), 400
+    return jsonify({'success': True})
+
+@app.route('/api/servers/<name>/shell', methods=['GET', 'POST', 'DELETE'])
+def api_server_shell(name):
+    if 'username' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    if name not in server_manager.servers:
+        return jsonify({'error': 'Server not found'}), 404
+    
+    if request.method == 'DELETE':
+        return jsonify({'success': server_manager.close_shell(name)})
+    if request.method == 'POST':
+        try:
+            server_manager.open_shell(name)
+        except Exception as e:
+            return jsonify({'success': False, 'error': str(e)}), 500
+    shell = server_manager.shells.get(name)
+    return jsonify({'success': True, 'shell': shell.to_dict() if shell else None})
+
+@app.route('/api/servers/<name>/shell/input', methods=['POST'])
+def api_shell_input(name):
+    if 'username' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    if name not in server_manager.servers:
+        return jsonify({'error': 'Server not found'}), 404
+    
+    data = request.get_json(silent=True) or {}
+    try:
+        # newline=false sends raw keystrokes, e.g. "\u0003" for Ctrl+C
+        shell = server_manager.shell_input(name, data.get('data', ''), newline=data.get('newline', True))
+    except RuntimeError as e:
+        return jsonify({'success': False, 'error': str(e)}), 409
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+    return jsonify({'success': True, 'shell': shell.to_dict()})
+
+@app.route('/api/servers/<name>/stdin', methods=['POST'])
+def api_server_stdin(name):
+    if 'username' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    if name not in server_manager.servers:
+        return jsonify({'error': 'Server not found'}), 404
+    
+    data = request.get_json(silent=True) or {}
+    try:
+        server_manager.send_stdin(name, data.get('data', ''), newline=data.get('newline', True))
+    except RuntimeError as e:
+        return jsonify({'success': False, 'error': str(e)}), 409
+    return jsonify({'success': True})
+
 @app.route('/api/clear_logs/<name>', methods=['POST'])
 def clear_logs(name):
     if 'username' not in session:
@@ -682,12 +4342,16 @@ def install_dependencies(name):
     
     data = request.get_json()
     requirements_file = data.get('requirements_file', 'requirements.txt')
+    # force=true reinstalls even if the requirements have not changed since the last install
+    force = bool(data.get('force', False))
     
-    success, message = server_manager.install_server_dependencies(name, requirements_file)
-    if success:
-        return jsonify({'success': True, 'message': message})
-    else:
-        return jsonify({'error': message}), 500
+    def install(job):
+        success, message = server_manager.install_server_dependencies(name, requirements_file, force=force, job=job)
+        if not success:
+            raise RuntimeError(message)
+        return {'success': True, 'message': message}
+    
+    return run_job('install', install, target=name, description=f'Install {requirements_file}')
 
 @app.route('/server_file_manager/<name>')
 @app.route('/server_file_manager/<name>/<path:path>')
@@ -728,9 +4392,18 @@ def server_upload_file(name):
             flash('Invalid path - Upload location outside server directory', 'error')
             return redirect(url_for('server_file_manager', name=name, path=path))
         
+        exceeded = disk_tracker.check_quota(name, request.content_length or 0)
+        if exceeded and exceeded[0] == 'block':
+            flash(f'{exceeded[1]} - upload blocked', 'error')
+            return redirect(url_for('server_file_manager', name=name, path=path))
+        
         try:
+            old_size = file_size(upload_path)
             file.save(upload_path)
+            track_file_change(name, upload_path, old_size)
             flash(f'File "{filename}" uploaded successfully', 'success')
+            if exceeded:
+                flash(quota_warning(name, exceeded), 'warning')
         except Exception as e:
             flash(f'Error uploading file: {str(e)}', 'error')
     
@@ -821,9 +4494,12 @@ def server_delete_file(name):
         if os.path.isdir(full_path_abs):
             import shutil
             shutil.rmtree(full_path_abs)
+            disk_tracker.invalidate(name)
             flash('Folder deleted successfully', 'success')
         else:
+            old_size = file_size(full_path_abs)
             os.remove(full_path_abs)
+            track_file_change(name, full_path_abs, old_size)
             flash('File deleted successfully', 'success')
     except PermissionError:
         flash('Permission denied - Cannot delete file/folder', 'error')
@@ -946,60 +4622,21 @@ def system_info():
         return jsonify({'error': 'Unauthorized'}), 401
     
     try:
-        import platform
-        
         # Basic system info (always available)
-        system_info = {
-            'platform': platform.system(),
-            'platform_version': platform.version(),
-            'architecture': platform.machine(),
-            'hostname': platform.node(),
-            'python_version': platform.python_version(),
-        }
+        system_info = dict(metrics_sampler.platform)
         
-        # Try to get detailed info with psutil
-        try:
-            import psutil
-            
-            # CPU Info
-            cpu_percent = psutil.cpu_percent(interval=1)
-            cpu_count = psutil.cpu_count()
-            
-            # Memory Info
-            memory = psutil.virtual_memory()
-            memory_total = memory.total
-            memory_used = memory.used
-            memory_percent = memory.percent
-            
-            # Disk Info
-            disk = psutil.disk_usage('/')
-            disk_total = disk.total
-            disk_used = disk.used
-            disk_percent = disk.percent
-            
-            # Add detailed info
+        # Detailed info comes from the background sampler, so this never blocks on psutil
+        sample = metrics_sampler.latest()
+        if sample:
             system_info.update({
-                'cpu': {
-                    'percent': cpu_percent,
-                    'count': cpu_count
-                },
-                'memory': {
-                    'total': memory_total,
-                    'used': memory_used,
-                    'percent': memory_percent,
-                    'total_gb': round(memory_total / (1024**3), 2),
-                    'used_gb': round(memory_used / (1024**3), 2)
-                },
-                'disk': {
-                    'total': disk_total,
-                    'used': disk_used,
-                    'percent': disk_percent,
-                    'total_gb': round(disk_total / (1024**3), 2),
-                    'used_gb': round(disk_used / (1024**3), 2)
-                }
+                'cpu': sample['cpu'],
+                'memory': sample['memory'],
+                'disk': sample['disk'],
+                'load': sample['load'],
+                'sampled_at': sample['time'],
+                'sample_age': round(time.time() - sample['time'], 3)
             })
-            
-        except ImportError:
+        else:
             # psutil not available, provide basic info
             system_info.update({
                 'cpu': {
@@ -1020,45 +4657,128 @@ def system_info():
                     'total_gb': 0,
                     'used_gb': 0
                 },
-                'psutil_available': False
+                'psutil_available': metrics_sampler.available
             })
         
         return jsonify(system_info)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Prometheus exposition
+@app.route('/metrics')
+def prometheus_metrics():
+    authorized = 'username' in session
+    if not authorized and METRICS_TOKEN:
+        authorized = hmac.compare_digest(request.headers.get('Authorization', '').encode(),
+                                         f'Bearer {METRICS_TOKEN}'.encode())
+    if not authorized and METRICS_ALLOW_LOCALHOST:
+        authorized = request.remote_addr in ('127.0.0.1', '::1')
+    if not authorized:
+        return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    return Response(render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+# Metrics history API
+@app.route('/api/metrics/history')
+def api_metrics_history():
+    if 'username' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    store = metrics_sampler.store
+    requested = [name.strip() for name in request.args.get('series', '').split(',') if name.strip()]
+    if not requested:
+        return jsonify({'series': store.names(), 'store': store.stats()})
+    seconds = parse_duration(request.args.get('range'), 600)
+    if seconds is None:
+        return jsonify({'error': 'Invalid range'}), 400
+    seconds = min(seconds, store.retention())
+    
+    # 'servers.web.*' selects every series of a server
+    known = store.names()
+    names = []
+    for name in requested:
+        if name.endswith('*'):
+            names.extend(known_name for known_name in known if known_name.startswith(name[:-1]))
+        else:
+            names.append(name)
+    end = time.time()
+    series, step = store.query(names, end - seconds, end)
+    missing = [name for name in requested if not name.endswith('*') and name not in series]
+    if not series:
+        return jsonify({'error': 'Unknown series', 'missing': missing}), 404
+    return jsonify({
+        'start': end - seconds,
+        'end': end,
+        'range': seconds,
+        'step': step,
+        'series': series,
+        'missing': missing
+    })
+
 # Process Management API
+PROCESS_SORT_KEYS = ('cpu_percent', 'memory_percent', 'rss', 'num_threads', 'pid', 'name', 'username', 'create_time')
+
 @app.route('/api/processes')
 def get_processes():
     if 'username' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
     
+    if not metrics_sampler.available:
+        return jsonify({
+            'processes': [],
+            'error': 'psutil not installed - Install with: pip install psutil',
+            'psutil_available': False
+        })
+    
     try:
-        import psutil
+        sort = request.args.get('sort', 'cpu_percent')
+        if sort not in PROCESS_SORT_KEYS:
+            return jsonify({'error': f"Invalid sort key, use one of: {', '.join(PROCESS_SORT_KEYS)}"}), 400
+        # Numbers sort biggest first, text A-Z, unless ?order= says otherwise
+        order = request.args.get('order', 'asc' if sort in ('name', 'username') else 'desc')
+        if order not in ('asc', 'desc'):
+            return jsonify({'error': 'Invalid order, use asc or desc'}), 400
+        try:
+            page = max(int(request.args.get('page', 1)), 1)
+            per_page = min(max(int(request.args.get('per_page', 50)), 1), 500)
+        except ValueError:
+            return jsonify({'error': 'Invalid page or per_page'}), 400
+        query = request.args.get('q', '').lower()
+        user = request.args.get('user')
+        # server=<name> for one server's processes, server=* for any managed server, server=none for the rest
+        server = request.args.get('server')
         
-        processes = []
-        for proc in psutil.process_iter(['pid', 'name', 'cpu_percent', 'memory_percent', 'status']):
-            try:
-                proc_info = proc.info
-                processes.append({
-                    'pid': proc_info['pid'],
-                    'name': proc_info['name'],
-                    'cpu_percent': round(proc_info['cpu_percent'], 1),
-                    'memory_percent': round(proc_info['memory_percent'], 1),
-                    'status': proc_info['status']
-                })
-            except (psutil.NoSuchProcess, psutil.AccessDenied):
-                continue
+        table = metrics_sampler.processes()
+        processes = table['rows']
+        if query:
+            processes = [proc for proc in processes
+                         if query in (proc['name'] or '').lower() or query in proc['command'].lower()]
+        if user:
+            processes = [proc for proc in processes if proc['username'] == user]
+        if server == '*':
+            processes = [proc for proc in processes if proc['server']]
+        elif server == 'none':
+            processes = [proc for proc in processes if not proc['server']]
+        elif server:
+            processes = [proc for proc in processes if proc['server'] == server]
         
-        # Sort by CPU usage
-        processes.sort(key=lambda x: x['cpu_percent'], reverse=True)
+        # None (access denied) sorts last either way
+        present = [proc for proc in processes if proc[sort] is not None]
+        present.sort(key=lambda proc: proc[sort].lower() if isinstance(proc[sort], str) else proc[sort],
+                     reverse=order == 'desc')
+        processes = present + [proc for proc in processes if proc[sort] is None]
         
-        return jsonify({'processes': processes[:50]})  # Return top 50 processes
-    except ImportError:
+        total = len(processes)
+        offset = (page - 1) * per_page
         return jsonify({
-            'processes': [],
-            'error': 'psutil not installed - Install with: pip install psutil',
-            'psutil_available': False
+            'processes': processes[offset:offset + per_page],
+            'total': total,
+            'page': page,
+            'per_page': per_page,
+            'pages': (total + per_page - 1) // per_page,
+            'sort': sort,
+            'order': order,
+            'sampled_at': table['sampled_at'],
+            'sample_ms': table['sample_ms']
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -1098,47 +4818,22 @@ def network_info():
         return jsonify({'error': 'Unauthorized'}), 401
     
     try:
-        import psutil
-        
-        # Network interfaces
-        net_io = psutil.net_io_counters()
-        net_interfaces = psutil.net_if_addrs()
-        
-        network_info = {
-            'bytes_sent': net_io.bytes_sent,
-            'bytes_recv': net_io.bytes_recv,
-            'packets_sent': net_io.packets_sent,
-            'packets_recv': net_io.packets_recv,
-            'interfaces': {}
-        }
-        
-        for interface, addresses in net_interfaces.items():
-            network_info['interfaces'][interface] = []
-            for addr in addresses:
-                if addr.family == socket.AF_INET:  # IPv4
-                    network_info['interfaces'][interface].append({
-                        'type': 'IPv4',
-                        'address': addr.address,
-                        'netmask': addr.netmask
-                    })
-                elif addr.family == socket.AF_INET6:  # IPv6
-                    network_info['interfaces'][interface].append({
-                        'type': 'IPv6',
-                        'address': addr.address,
-                        'netmask': addr.netmask
-                    })
+        sample = metrics_sampler.latest()
+        if not sample:
+            return jsonify({
+                'error': 'psutil not installed - Install with: pip install psutil' if not metrics_sampler.available else 'No metrics sample yet',
+                'psutil_available': metrics_sampler.available,
+                'bytes_sent': 0,
+                'bytes_recv': 0,
+                'packets_sent': 0,
+                'packets_recv': 0,
+                'interfaces': {}
+            })
         
+        network_info = dict(sample['network'])
+        network_info['interfaces'] = sample['interfaces']
+        network_info['sampled_at'] = sample['time']
         return jsonify(network_info)
-    except ImportError:
-        return jsonify({
-            'error': 'psutil not installed - Install with: pip install psutil',
-            'psutil_available': False,
-            'bytes_sent': 0,
-            'bytes_recv': 0,
-            'packets_sent': 0,
-            'packets_recv': 0,
-            'interfaces': {}
-        })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -1175,20 +4870,17 @@ def backup_server(name):
         if os.path.exists(backup_path):
             return jsonify({'error': 'A backup with this name already exists.'}), 400
         # Create zip backup
-        with zipfile.ZipFile(backup_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            for root, dirs, files in os.walk(server_dir):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    arcname = os.path.relpath(file_path, server_dir)
-                    zipf.write(file_path, arcname)
-        backup_size = os.path.getsize(backup_path)
-        return jsonify({
-            'success': True,
-            'message': f'Server {name} backed up successfully',
-            'backup_file': backup_filename,
-            'backup_size': backup_size,
-            'backup_size_mb': round(backup_size / (1024**2), 2)
-        })
+        def backup(job):
+            backup_size = write_backup_zip(job, server_dir, backup_path)
+            return {
+                'success': True,
+                'message': f'Server {name} backed up successfully',
+                'backup_file': backup_filename,
+                'backup_size': backup_size,
+                'backup_size_mb': round(backup_size / (1024**2), 2)
+            }
+        
+        return run_job('backup', backup, target=name, description=f'Backup to {backup_filename}')
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -1214,25 +4906,24 @@ def restore_server(name):
         
         server_dir = os.path.join('servers', name)
         
-        # Stop server if running
-        if name in server_manager.servers and server_manager.servers[name]['status'] == 'running':
-            server_manager.stop_server(name)
-        
-        # Remove existing server directory
-        if os.path.exists(server_dir):
-            shutil.rmtree(server_dir)
-        
-        # Create new server directory
-        os.makedirs(server_dir, exist_ok=True)
-        
-        # Extract backup
-        with zipfile.ZipFile(backup_path, 'r') as zipf:
-            zipf.extractall(server_dir)
+        def restore(job):
+            # Stop server if running
+            if name in server_manager.servers and server_manager.servers[name]['status'] == 'running':
+                job.progress(message='Stopping server')
+                server_manager.stop_server(name)
+            
+            # Replace the server directory with the backup once it is fully extracted
+            try:
+                restore_archive(job, backup_path, server_dir, keep=RESTORE_KEEP)
+            finally:
+                disk_tracker.invalidate(name)
+            
+            return {
+                'success': True,
+                'message': f'Server {name} restored successfully from {backup_file}'
+            }
         
-        return jsonify({
-            'success': True,
-            'message': f'Server {name} restored successfully from {backup_file}'
-        })
+        return run_job('restore', restore, target=name, description=f'Restore {backup_file}')
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -1470,6 +5161,14 @@ def save_settings(name):
     new_name = data.get('new_name', name).strip()
     new_port = data.get('new_port')
     startup_command = data.get('startup_command')
+    stop_timeout = data.get('stop_timeout')
+    restart_policy = data.get('restart_policy')
+    readiness = data.get('readiness')
+    readiness_path = data.get('readiness_path')
+    health_check = data.get('health_check')
+    health_path = data.get('health_path')
+    disk_quota_mb = data.get('disk_quota_mb')
+    disk_quota_action = data.get('disk_quota_action')
     
     try:
         server = server_manager.servers[name]
@@ -1479,15 +5178,10 @@ def save_settings(name):
             # Check if new name already exists
             if new_name in server_manager.servers:
                 return jsonify({'error': 'A server with that name already exists.'}), 400
-            # Rename server directory
-            old_dir = os.path.join('servers', name)
-            new_dir = os.path.join('servers', new_name)
-            if os.path.exists(old_dir):
-                os.rename(old_dir, new_dir)
-            # Update server object and key
-            server['name'] = new_name
-            server_manager.servers[new_name] = server
-            del server_manager.servers[name]
+            # Rename server directory, object and key
+            server_manager.rename_server(name, new_name)
+            disk_tracker.forget(name)
+            disk_tracker.invalidate(new_name)
             name = new_name
             reload_needed = True
         # Handle port change
@@ -1499,6 +5193,51 @@ def save_settings(name):
         # Update startup command if provided
         if startup_command:
             server['command'] = startup_command
+        # How a start decides the server is ready
+        if readiness is not None:
+            if readiness not in READINESS_MODES:
+                return jsonify({'error': 'Invalid readiness mode'}), 400
+            server['readiness'] = readiness
+        if readiness_path:
+            if not readiness_path.startswith('/'):
+                return jsonify({'error': 'Readiness path must start with /'}), 400
+            server['readiness_path'] = readiness_path
+        # Periodic liveness probe
+        if health_check is not None:
+            if health_check not in HEALTH_MODES:
+                return jsonify({'error': 'Invalid health check mode'}), 400
+            server['health_check'] = health_check
+        if health_path:
+            if not health_path.startswith('/'):
+                return jsonify({'error': 'Health check path must start with /'}), 400
+            server['health_path'] = health_path
+        # Soft disk quota checked on uploads; 0 removes it
+        if disk_quota_mb is not None:
+            try:
+                disk_quota_mb = float(disk_quota_mb)
+                if disk_quota_mb < 0:
+                    raise ValueError
+                server['disk_quota_mb'] = disk_quota_mb or None
+            except (TypeError, ValueError):
+                return jsonify({'error': 'Invalid disk quota'}), 400
+        if disk_quota_action is not None:
+            if disk_quota_action not in DISK_QUOTA_ACTIONS:
+                return jsonify({'error': 'Invalid disk quota action'}), 400
+            server['disk_quota_action'] = disk_quota_action
+        # What to do when the process exits on its own
+        if restart_policy is not None:
+            if restart_policy not in RESTART_POLICIES:
+                return jsonify({'error': 'Invalid restart policy'}), 400
+            server['restart_policy'] = restart_policy
+        # Grace period between SIGTERM and SIGKILL on stop
+        if stop_timeout is not None:
+            try:
+                stop_timeout = float(stop_timeout)
+                if stop_timeout <= 0:
+                    raise ValueError
+                server['stop_timeout'] = stop_timeout
+            except (TypeError, ValueError):
+                return jsonify({'error': 'Invalid stop timeout'}), 400
         server_manager.save_servers()
         return jsonify({'success': True, 'reload': reload_needed})
     except Exception as e:
@@ -1517,6 +5256,10 @@ def test_startup(name):
     
     if not command:
         return jsonify({'error': 'No command provided'}), 400
+    try:
+        timeout = parse_timeout(data.get('timeout'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
     try:
         # Get server directory
@@ -1524,33 +5267,17 @@ def test_startup(name):
         if not os.path.exists(server_dir):
             return jsonify({'error': 'Server directory not found'}), 404
         
-        # Set up environment
-        env = os.environ.copy()
-        env['PORT'] = str(server_manager.servers[name]['port'])
-        env['HOST'] = server_manager.servers[name].get('actual_host', '0.0.0.0')
-        env['SERVER_NAME'] = name
-        
-        # Try to run the command with a short timeout
-        process = subprocess.Popen(
-            command.split(),
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            cwd=server_dir,
-            env=env
-        )
-        
-        try:
-            # Wait for a short time to see if the command starts
-            output, _ = process.communicate(timeout=2)
-            if process.returncode == 0:
-                return jsonify({'success': True, 'message': 'Command test successful'})
+        # Success means the command became ready (listening on the server port), not just that it survived
+        result = server_manager.test_startup(name, command, timeout=timeout)
+        if result['ready']:
+            if result['time_to_listen_ms'] is not None:
+                message = f"Server listened on port {server_manager.servers[name]['port']} after {result['time_to_listen_ms']:g} ms"
             else:
-                return jsonify({'error': f'Command failed with exit code: {process.returncode}\nOutput: {output}'})
-        except subprocess.TimeoutExpired:
-            # If we timeout, it might mean the server started successfully
-            process.kill()
-            return jsonify({'success': True, 'message': 'Command appears to start the server successfully'})
+                message = 'Command appears to start the server successfully'
+            return jsonify({'success': True, 'message': message, **result})
+        error = result['error'] or f"Command failed with exit code: {result['returncode']}"
+        output = '\n'.join(result['output'])
+        return jsonify({'error': f'{error}\nOutput: {output}', **result})
             
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -1874,9 +5601,16 @@ def api_upload_file(name):
     upload_path_abs = os.path.abspath(upload_path)
     if '..' in upload_path or not upload_path_abs.startswith(server_dir_abs):
         return jsonify({'success': False, 'error': 'Invalid path'}), 400
+    exceeded = disk_tracker.check_quota(name, request.content_length or 0)
+    if exceeded and exceeded[0] == 'block':
+        return jsonify({'success': False, 'error': exceeded[1]}), 507
     try:
         os.makedirs(os.path.dirname(upload_path_abs), exist_ok=True)
+        old_size = file_size(upload_path_abs)
         file.save(upload_path_abs)
+        track_file_change(name, upload_path_abs, old_size)
+        if exceeded:
+            return jsonify({'success': True, 'warning': quota_warning(name, exceeded)})
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -1924,8 +5658,11 @@ def api_delete_file(name):
         if os.path.isdir(full_path_abs):
             import shutil
             shutil.rmtree(full_path_abs)
+            disk_tracker.invalidate(name)
         else:
+            old_size = file_size(full_path_abs)
             os.remove(full_path_abs)
+            track_file_change(name, full_path_abs, old_size)
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -1949,6 +5686,7 @@ def api_rename_file(name):
         return jsonify({'success': False, 'error': 'Invalid path'}), 400
     try:
         os.rename(abs_old, abs_new)
+        disk_tracker.invalidate(name)
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -1969,9 +5707,16 @@ def api_save_file(name):
     server_dir_abs = os.path.abspath(server_dir)
     if not abs_path.startswith(server_dir_abs):
         return jsonify({'success': False, 'error': 'Invalid path'}), 400
+    old_size = file_size(abs_path)
+    exceeded = disk_tracker.check_quota(name, len(content.encode('utf-8')) - (old_size or 0))
+    if exceeded and exceeded[0] == 'block':
+        return jsonify({'success': False, 'error': exceeded[1]}), 507
     try:
         with open(abs_path, 'w', encoding='utf-8') as f:
             f.write(content)
+        track_file_change(name, abs_path, old_size)
+        if exceeded:
+            return jsonify({'success': True, 'warning': quota_warning(name, exceeded, 'save')})
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -2034,20 +5779,24 @@ def api_extract_file(name):
     server_dir_abs = os.path.abspath(server_dir)
     if not abs_path.startswith(server_dir_abs):
         return jsonify({'success': False, 'error': 'Invalid path'}), 400
-    try:
-        if abs_path.endswith('.zip'):
-            with zipfile.ZipFile(abs_path, 'r') as zip_ref:
-                zip_ref.extractall(os.path.dirname(abs_path))
-        elif abs_path.endswith('.tar.gz') or abs_path.endswith('.tgz'):
-            with tarfile.open(abs_path, 'r:gz') as tar_ref:
-                tar_ref.extractall(os.path.dirname(abs_path))
-        elif abs_path.endswith('.rar'):
-            return jsonify({'success': False, 'error': 'RAR extraction not supported'}), 400
-        else:
-            return jsonify({'success': False, 'error': 'Unsupported archive type'}), 400
-        return jsonify({'success': True})
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+    if abs_path.endswith('.rar'):
+        return jsonify({'success': False, 'error': 'RAR extraction not supported'}), 400
+    if not abs_path.endswith(('.zip', '.tar.gz', '.tgz')):
+        return jsonify({'success': False, 'error': 'Unsupported archive type'}), 400
+    exceeded = disk_tracker.check_quota(name, archive_size(abs_path) or 0)
+    if exceeded and exceeded[0] == 'block':
+        return jsonify({'success': False, 'error': exceeded[1]}), 507
+    
+    def extract(job):
+        try:
+            extract_archive(job, abs_path, os.path.dirname(abs_path))
+        finally:
+            disk_tracker.invalidate(name)
+        if exceeded:
+            return {'success': True, 'warning': quota_warning(name, exceeded, 'extraction')}
+        return {'success': True}
+    
+    return run_job('extract', extract, target=name, description=f'Extract {path}')
 
 @app.route('/api/servers/<name>/files/copy', methods=['POST'])
 def api_copy_file(name):
@@ -2066,14 +5815,32 @@ def api_copy_file(name):
     server_dir_abs = os.path.abspath(server_dir)
     if not abs_source.startswith(server_dir_abs) or not abs_dest.startswith(server_dir_abs):
         return jsonify({'success': False, 'error': 'Invalid path'}), 400
-    try:
-        if os.path.isdir(abs_source):
-            shutil.copytree(abs_source, abs_dest)
-        else:
-            shutil.copy2(abs_source, abs_dest)
-        return jsonify({'success': True})
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+    exceeded = None
+    if not os.path.isdir(abs_source):
+        exceeded = disk_tracker.check_quota(name, (file_size(abs_source) or 0) - (file_size(abs_dest) or 0))
+        if exceeded and exceeded[0] == 'block':
+            return jsonify({'success': False, 'error': exceeded[1]}), 507
+    
+    def copy(job):
+        nonlocal exceeded
+        if os.path.isdir(abs_source) and disk_tracker.quota(name)[0] is not None:
+            # Sizing a tree means walking it, so that happens in the job rather than the request
+            job.progress(message='Checking disk quota')
+            exceeded = disk_tracker.check_quota(name, DiskUsageTracker.scan(abs_source)[0])
+            if exceeded and exceeded[0] == 'block':
+                raise QuotaExceeded(exceeded[1])
+        try:
+            if os.path.isdir(abs_source):
+                copy_tree(job, abs_source, abs_dest)
+            else:
+                shutil.copy2(abs_source, abs_dest)
+        finally:
+            disk_tracker.invalidate(name)
+        if exceeded:
+            return {'success': True, 'warning': quota_warning(name, exceeded, 'copy')}
+        return {'success': True}
+    
+    return run_job('copy', copy, target=name, description=f'Copy {source} to {destination}')
 
 @app.route('/api/servers/<name>/files/move', methods=['PATCH'])
 def api_move_file(name):
@@ -2122,6 +5889,76 @@ def api_read_file_content(name):
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def resource_usage(name):
+    """Latest sampled usage of a server; never touches psutil.Process itself"""
+    import psutil
+    server = server_manager.servers[name]
+    usage = metrics_sampler.server_usage.get(name) if server['status'] == 'running' and server.get('pid') else None
+    sample = metrics_sampler.latest(wait=0)
+    memory_total = sample['memory']['total'] if sample else 0
+    result = {
+        'ram_percent': round(usage['rss'] * 100 / memory_total, 1) if usage and memory_total else 0,
+        'ram_mb': int(usage['rss'] / 1024 / 1024) if usage else 0,
+        'cpu': usage['cpu'] if usage else 0,
+        'io_read_per_sec': usage['io_read_per_sec'] if usage else 0,
+        'io_write_per_sec': usage['io_write_per_sec'] if usage else 0,
+        'process_io': usage['process_io'] if usage else [],
+        'processes': usage['processes'] if usage else 0,
+        'sampled_at': usage['time'] if usage else None,
+        'disk_percent': 0,
+        'disk_mb': 0,
+        'disk_quota_mb': None,
+        'disk_over_quota': False
+    }
+    # Disk usage: the server directory's own footprint, as a share of its quota or else of the partition
+    disk = disk_tracker.get(name)
+    if disk:
+        quota, _ = disk_tracker.quota(name)
+        if quota:
+            capacity = quota
+            result['disk_quota_mb'] = round(quota / 1024 / 1024, 1)
+            result['disk_over_quota'] = disk['bytes'] > quota
+        else:
+            capacity = sample['disk']['total'] if sample else psutil.disk_usage('/').total
+        result['disk_mb'] = int(disk['bytes'] / 1024 / 1024)
+        result['disk_percent'] = round(disk['bytes'] * 100 / capacity, 1) if capacity else 0
+    return result
+
+@app.route('/api/servers/resource_usage')
+def api_servers_resource_usage():
+    if 'username' not in session:
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+    try:
+        servers = {}
+        for name in list(server_manager.servers):
+            try:
+                servers[name] = resource_usage(name)
+            except KeyError:
+                continue  # deleted while iterating
+        return jsonify({'success': True, 'servers': servers})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/servers/<name>/disk_usage')
+def api_server_disk_usage(name):
+    if 'username' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    if name not in server_manager.servers:
+        return jsonify({'error': 'Server not found'}), 404
+    # ?rescan=1 walks the directory now instead of returning the tracked totals
+    if request.args.get('rescan', '').lower() in ('1', 'true', 'yes'):
+        usage = disk_tracker.rescan(name)
+    else:
+        usage = disk_tracker.get(name)
+    quota, action = disk_tracker.quota(name)
+    return jsonify({
+        'usage': usage,
+        'pending': usage is None,
+        'quota_bytes': quota,
+        'quota_action': action,
+        'over_quota': bool(usage and quota and usage['bytes'] > quota)
+    })
+
 @app.route('/api/servers/<name>/resource_usage')
 def api_server_resource_usage(name):
     if 'username' not in session:
@@ -2129,44 +5966,7 @@ def api_server_resource_usage(name):
     if name not in server_manager.servers:
         return jsonify({'success': False, 'error': 'Server not found'}), 404
     try:
-        import psutil
-        server = server_manager.servers[name]
-        pid = server.get('pid')
-        if server['status'] == 'running' and pid:
-            try:
-                p = psutil.Process(pid)
-                ram_mb = int(p.memory_info().rss / 1024 / 1024)
-                ram_percent = p.memory_percent()
-                cpu = p.cpu_percent(interval=0.5)
-                # Disk usage: sum of all open files by this process (approximate)
-                # For simplicity, use server dir disk usage as before
-                server_dir = os.path.join('servers', name)
-                if os.path.exists(server_dir):
-                    disk = psutil.disk_usage(server_dir)
-                else:
-                    disk = psutil.disk_usage('/')
-                disk_percent = disk.percent
-                disk_mb = int(disk.used / 1024 / 1024)
-            except Exception:
-                ram_mb = 0
-                ram_percent = 0
-                cpu = 0
-                disk_percent = 0
-                disk_mb = 0
-        else:
-            ram_mb = 0
-            ram_percent = 0
-            cpu = 0
-            disk_percent = 0
-            disk_mb = 0
-        return jsonify({
-            'success': True,
-            'ram_percent': round(ram_percent, 1),
-            'ram_mb': ram_mb,
-            'cpu': round(cpu, 1),
-            'disk_percent': disk_percent,
-            'disk_mb': disk_mb
-        })
+        return jsonify(dict(resource_usage(name), success=True))
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
@@ -2194,15 +5994,11 @@ def save_settings_form(name):
             if new_name in server_manager.servers:
                 flash('A server with that name already exists.', 'error')
                 return redirect(url_for('save_settings_form', name=name))
-            old_dir = os.path.join('servers', name)
-            new_dir = os.path.join('servers', new_name)
-            if os.path.exists(old_dir):
-                os.rename(old_dir, new_dir)
-            server['name'] = new_name
-            server_manager.servers[new_name] = server
-            del server_manager.servers[name]
+            server_manager.rename_server(name, new_name)
+            disk_tracker.forget(name)
+            disk_tracker.invalidate(new_name)
             name = new_name
-            server_dir = new_dir
+            server_dir = os.path.join('servers', new_name)
             requirements_path = os.path.join(server_dir, 'requirements.txt')
         # Update host and port
         server['host'] = new_host
@@ -2238,12 +6034,15 @@ def delete_server_form(name):
         if server.get('server_type') == 'gunicorn' and server.get('domain'):
             cleanup_nginx_and_ssl(server['domain'], server.get('ssl_enabled', False))
         # Remove server directory
+        server_manager.close_shell(name)
+        server_manager.console_logs.close(name)
         server_dir = os.path.join('servers', name)
         if os.path.exists(server_dir):
             shutil.rmtree(server_dir)
         # Remove from server manager
         del server_manager.servers[name]
-        server_manager.save_servers()
+        server_manager.mark_changed(name)
+        disk_tracker.forget(name)
         flash(f'Server "{name}" deleted successfully', 'success')
     else:
         flash('Server not found', 'error')
@@ -2296,26 +6095,19 @@ def api_create_backup(name):
     backup_path = os.path.join(backup_dir, backup_filename)
     if os.path.exists(backup_path):
         return jsonify({'error': 'A backup with this name already exists.'}), 400
-    try:
-        with zipfile.ZipFile(backup_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            for root, dirs, files in os.walk(server_dir):
-                # Skip the backups directory itself
-                if os.path.abspath(root) == os.path.abspath(backup_dir):
-                    continue
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    arcname = os.path.relpath(file_path, server_dir)
-                    zipf.write(file_path, arcname)
-        backup_size = os.path.getsize(backup_path)
-        return jsonify({
+    
+    def backup(job):
+        # Skip the backups directory itself
+        backup_size = write_backup_zip(job, server_dir, backup_path, skip_dir=backup_dir)
+        return {
             'success': True,
             'message': f'Server {name} backed up successfully',
             'backup_file': backup_filename,
             'backup_size': backup_size,
             'backup_size_mb': round(backup_size / (1024**2), 2)
-        })
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        }
+    
+    return run_job('backup', backup, target=name, description=f'Backup to {backup_filename}')
 
 @app.route('/api/servers/<name>/backups/<backup_name>/download', methods=['GET'])
 def api_download_backup(name, backup_name):
@@ -2356,31 +6148,28 @@ def api_restore_backup(name):
     if not os.path.exists(backup_path):
         return jsonify({'error': 'Backup file not found'}), 404
     server_dir = os.path.join('servers', name)
-    try:
+    
+    def restore(job):
         # Stop server if running
         if name in server_manager.servers and server_manager.servers[name]['status'] == 'running':
+            job.progress(message='Stopping server')
             server_manager.stop_server(name)
-        # Remove everything except backups dir
-        for item in os.listdir(server_dir):
-            item_path = os.path.join(server_dir, item)
-            if item == 'backups':
-                continue
-            if os.path.isdir(item_path):
-                import shutil
-                shutil.rmtree(item_path)
-            else:
-                os.remove(item_path)
-        # Extract backup
-        with zipfile.ZipFile(backup_path, 'r') as zipf:
-            zipf.extractall(server_dir)
-        return jsonify({'success': True, 'message': f'Server {name} restored from {backup_file}'})
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        # Replace everything except backups dir, console scrollback and the venv
+        try:
+            restore_archive(job, backup_path, server_dir, keep=RESTORE_KEEP)
+        finally:
+            disk_tracker.invalidate(name)
+        return {'success': True, 'message': f'Server {name} restored from {backup_file}'}
+    
+    return run_job('restore', restore, target=name, description=f'Restore {backup_file}')
 
 if __name__ == '__main__':
     # Create necessary directories
     os.makedirs('servers', exist_ok=True)
     
+    # Exit cleanly on SIGTERM (systemd stop) so pending changes are flushed by atexit
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    
     print("🚀 Flare Panel (Lightweight) starting...")
     print("Default login: hxc / 123")
     print(f"Local IP: {get_local_ip()}")
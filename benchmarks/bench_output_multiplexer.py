@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Console ingest benchmark
+Spawns 1, 50 and 500 chatty children and measures how many output lines per
+second the shared OutputMultiplexer ingests into the console log rings,
+compared with the old readline() + sleep(0.2) monitor thread per child.
+
+Usage: python3 benchmarks/bench_output_multiplexer.py [children ...]
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# Importing app starts its background threads; keep the periodic samplers from competing for the CPU
+os.environ.setdefault('FLARE_HEALTH_INTERVAL', '0')
+os.environ.setdefault('FLARE_METRICS_INTERVAL', '0')
+
+TOTAL_LINES = 500000
+LEGACY_SECONDS = 3
+
+CHILD = (
+    "import sys\n"
+    "w = sys.stdout.write\n"
+    "for i in range({lines}):\n"
+    "    w('chatty child output line %d with some payload text\\n' % i)\n"
+)
+
+def spawn(count, lines, binary=True):
+    code = CHILD.format(lines=lines)
+    return [subprocess.Popen([sys.executable, '-c', code], stdout=subprocess.PIPE,
+                             stderr=subprocess.STDOUT, bufsize=0 if binary else 1,
+                             text=not binary) for _ in range(count)]
+
+def bench_multiplexer(count, workdir):
+    from app import OutputMultiplexer, ConsoleLogStore
+
+    lines_per_child = max(TOTAL_LINES // count, 1000)
+    store = ConsoleLogStore(os.path.join(workdir, f'mux_{count}'))
+    mux = OutputMultiplexer()
+    done = threading.Semaphore(0)
+    processes = spawn(count, lines_per_child)
+    started = time.perf_counter()
+    for i, process in enumerate(processes):
+        ring = store.ring(f'server{i}')
+        mux.register(process.stdout, ring.append_many, done.release)
+    for _ in processes:
+        done.acquire()
+    elapsed = time.perf_counter() - started
+    for process in processes:
+        process.wait()
+    store.close_all()
+    return mux.stats['lines'], elapsed
+
+def bench_legacy(count, workdir):
+    # The previous design: one thread per child, readline() then sleep(0.2)
+    from app import ConsoleLogStore
+
+    store = ConsoleLogStore(os.path.join(workdir, f'legacy_{count}'))
+    # Children that keep writing for the whole measurement window
+    processes = spawn(count, 10 ** 8, binary=False)
+    counter = [0]
+    stop = threading.Event()
+
+    def monitor(process, ring):
+        while process.poll() is None and not stop.is_set():
+            output = process.stdout.readline()
+            if output:
+                ring.append(output.strip())
+                counter[0] += 1
+            time.sleep(0.2)
+
+    threads = [threading.Thread(target=monitor, args=(p, store.ring(f'server{i}')), daemon=True)
+               for i, p in enumerate(processes)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(LEGACY_SECONDS)
+    stop.set()
+    elapsed = time.perf_counter() - started
+    lines = counter[0]
+    for process in processes:
+        process.kill()
+        process.wait()
+    store.close_all()
+    return lines, elapsed
+
+def main():
+    counts = [int(arg) for arg in sys.argv[1:]] or [1, 50, 500]
+    workdir = tempfile.mkdtemp(prefix='flare_bench_')
+    os.chdir(workdir)
+
+    print(f"{'children':>8}  {'multiplexer lines/s':>20}  {'legacy lines/s':>15}")
+    for count in counts:
+        lines, elapsed = bench_multiplexer(count, workdir)
+        legacy_lines, legacy_elapsed = bench_legacy(count, workdir)
+        print(f"{count:>8}  {lines / elapsed:>20,.0f}  {legacy_lines / legacy_elapsed:>15,.0f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+State journal benchmark
+Compares full servers.json rewrites against journal appends for single-server
+status changes, and measures startup replay time for a 5k server registry.
+
+Usage: python3 benchmarks/bench_state_journal.py [servers] [journal_records]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# Importing app starts its background threads; keep the periodic samplers from competing for the CPU
+os.environ.setdefault('FLARE_HEALTH_INTERVAL', '0')
+os.environ.setdefault('FLARE_METRICS_INTERVAL', '0')
+
+def make_registry(count):
+    servers = {}
+    for i in range(count):
+        name = f'server{i}'
+        servers[name] = {
+            'name': name,
+            'host': '0.0.0.0',
+            'port': 10000 + i,
+            'command': 'python3 app.py',
+            'server_type': 'flask',
+            'status': 'stopped',
+            'pid': None,
+            'start_time': None,
+            'console_logs': [f'[12:00:00] log line {n}' for n in range(20)],
+            'app_file': 'app.py'
+        }
+    return servers
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    journal_records = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    workdir = tempfile.mkdtemp(prefix='flare_bench_')
+    os.chdir(workdir)
+    from app import JsonStateStore
+
+    store = JsonStateStore('servers.json', 'servers.journal')
+    servers = make_registry(count)
+
+    started = time.perf_counter()
+    snapshot_bytes = store.write_snapshot(servers)
+    snapshot_ms = (time.perf_counter() - started) * 1000
+
+    # One status change per write, the way start/stop/reap produce them
+    changes = 200
+    started = time.perf_counter()
+    for i in range(changes):
+        store.write_snapshot(servers)
+    full_ms = (time.perf_counter() - started) * 1000 / changes
+
+    started = time.perf_counter()
+    for i in range(changes):
+        store.append([{'op': 'set', 'name': f'server{i % count}',
+                       'fields': {'status': 'running', 'pid': 4000 + i}}])
+    append_ms = (time.perf_counter() - started) * 1000 / changes
+
+    # Startup: snapshot + a journal that has not been compacted yet
+    store.write_snapshot(servers)
+    for i in range(journal_records):
+        store.append([{'op': 'set', 'name': f'server{i % count}',
+                       'fields': {'status': 'running' if i % 2 else 'stopped', 'pid': 4000 + i}}])
+    started = time.perf_counter()
+    loaded = JsonStateStore('servers.json', 'servers.journal').load()
+    replay_ms = (time.perf_counter() - started) * 1000
+
+    print(f"Servers:                 {count}")
+    print(f"Snapshot size:           {snapshot_bytes / 1024:.1f} KiB ({snapshot_ms:.1f} ms)")
+    print(f"Full rewrite per change: {full_ms:.3f} ms")
+    print(f"Journal append/change:   {append_ms:.3f} ms ({full_ms / append_ms:.0f}x faster)")
+    print(f"Startup replay:          {replay_ms:.1f} ms ({len(loaded)} servers, {journal_records} journal records)")
+
+if __name__ == '__main__':
+    main()
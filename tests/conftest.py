@@ -0,0 +1,67 @@
+import os
+import sys
+import tempfile
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# app keeps servers.json, console rings and server directories relative to the
+# working directory and starts its background threads on import, so the whole
+# session runs in a scratch directory with the periodic health prober and metrics sampler off
+WORKDIR = tempfile.mkdtemp(prefix='flare_tests_')
+os.chdir(WORKDIR)
+os.environ.setdefault('FLARE_HEALTH_INTERVAL', '0')
+os.environ.setdefault('FLARE_METRICS_INTERVAL', '0')
+
+import app as flare  # noqa: E402
+
+
+def make_server(name, **fields):
+    server = {
+        'name': name,
+        'command': 'python3 app.py',
+        'status': 'stopped',
+        'pid': None,
+        'server_type': 'flask',
+        'port': 5999,
+        'host': '127.0.0.1',
+    }
+    server.update(fields)
+    os.makedirs(os.path.join('servers', name), exist_ok=True)
+    return server
+
+
+def wait_for(predicate, timeout=5.0, interval=0.02):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(interval)
+    return predicate()
+
+
+@pytest.fixture
+def manager():
+    """The global ServerManager; servers a test adds are stopped and removed afterwards"""
+    manager = flare.server_manager
+    before = set(manager.servers)
+    yield manager
+    for name in set(manager.servers) - before:
+        server = manager.servers.get(name) or {}
+        if server.get('status') == 'running' and server.get('pid') or server.get('pgid'):
+            manager.kill_server(name)
+        # Close the console ring now; at exit its relative paths would land in whatever the cwd is then
+        manager.console_logs.close(name)
+        manager.servers.pop(name, None)
+
+
+@pytest.fixture
+def client():
+    flare.app.config['TESTING'] = True
+    client = flare.app.test_client()
+    with client.session_transaction() as session:
+        session['username'] = 'admin'
+    return client
@@ -0,0 +1,81 @@
+from conftest import flare, make_server
+
+
+def messages(records):
+    return [message for _, _, message in records]
+
+
+def test_ring_rotates_and_reads_from_disk(tmp_path):
+    ring = flare.ConsoleLogRing(str(tmp_path), segment_lines=10, max_segments=3, memory_lines=5)
+    for n in range(45):
+        ring.append(f'line {n}')
+    
+    # At most three segments: two full ones and the five newest lines; the oldest twenty rotated out
+    assert ring.last_seq == 45
+    assert messages(ring.tail(3)) == ['line 42', 'line 43', 'line 44']
+    records = ring.read_since(20, limit=100)  # older than the in-memory tail
+    assert [seq for seq, _, _ in records] == list(range(21, 46))
+    assert messages(ring.read_since(0, limit=3)) == ['line 20', 'line 21', 'line 22']
+    ring.close()
+    
+    reopened = flare.ConsoleLogRing(str(tmp_path), segment_lines=10, max_segments=3, memory_lines=5)
+    assert reopened.last_seq == 45
+    assert reopened.append('after restart') == 46
+    assert messages(reopened.read_since(44)) == ['line 44', 'after restart']
+    reopened.close()
+
+
+def test_clear_keeps_sequence_numbers_increasing(tmp_path):
+    ring = flare.ConsoleLogRing(str(tmp_path))
+    ring.append_many(['a', 'b'])
+    ring.clear()
+    assert ring.tail(10) == []
+    assert ring.cleared_seq >= 2
+    seq = ring.append('c')
+    assert seq > ring.cleared_seq
+    assert messages(ring.read_since(0)) == ['c']
+    ring.close()
+
+
+def test_cursor_is_incremental(manager):
+    manager.servers['cursor'] = make_server('cursor')
+    manager.add_console_lines('cursor', ['one', 'two'])
+    
+    lines, cursor, reset = manager.get_console_logs_since('cursor', 0)
+    assert [line.split('] ', 1)[1] for line in lines] == ['one', 'two']
+    assert not reset
+    
+    manager.add_console_log('cursor', 'three')
+    lines, cursor, reset = manager.get_console_logs_since('cursor', cursor)
+    assert [line.split('] ', 1)[1] for line in lines] == ['three']
+    assert not reset
+    
+    lines, same_cursor, reset = manager.get_console_logs_since('cursor', cursor)
+    assert (lines, same_cursor, reset) == ([], cursor, False)
+
+
+def test_clear_resets_once(manager):
+    manager.servers['cleared'] = make_server('cleared')
+    manager.add_console_lines('cleared', ['before'])
+    _, cursor, _ = manager.get_console_logs_since('cleared', 0)
+    
+    # A reader that had seen every line before the clear must still be told to drop them
+    manager.clear_console_logs('cleared')
+    lines, cursor, reset = manager.get_console_logs_since('cleared', cursor)
+    assert (lines, reset) == ([], True)
+    
+    # ...but only once, not on every poll until new output arrives
+    lines, cursor, reset = manager.get_console_logs_since('cleared', cursor)
+    assert (lines, reset) == ([], False)
+    
+    manager.add_console_log('cleared', 'after')
+    lines, cursor, reset = manager.get_console_logs_since('cleared', cursor)
+    assert [line.split('] ', 1)[1] for line in lines] == ['after']
+    assert not reset
+
+
+def test_cursor_past_the_end_resets(manager):
+    manager.servers['ahead'] = make_server('ahead')
+    manager.add_console_log('ahead', 'only')
+    _, _, reset = manager.get_console_logs_since('ahead', 10 ** 6)
+    assert reset
@@ -0,0 +1,109 @@
+import os
+import tarfile
+import zipfile
+
+import pytest
+
+from conftest import flare, make_server, wait_for
+
+
+@pytest.fixture
+def quota_server(manager):
+    """A server using 600 of its 1000 bytes, with a blocking quota"""
+    manager.servers['quota'] = make_server('quota', disk_quota_mb=1000 / 1024 / 1024, disk_quota_action='block')
+    with open('servers/quota/data.txt', 'w') as f:
+        f.write('x' * 600)
+    flare.disk_tracker.rescan('quota')
+    yield manager.servers['quota']
+    flare.disk_tracker.forget('quota')
+
+
+def test_save_over_quota_is_blocked(client, quota_server):
+    response = client.post('/api/servers/quota/files/save', json={'path': 'big.txt', 'content': 'y' * 500})
+    assert response.status_code == 507
+    assert not os.path.exists('servers/quota/big.txt')
+    
+    # Rewriting a file counts only the growth
+    response = client.post('/api/servers/quota/files/save', json={'path': 'data.txt', 'content': 'z' * 800})
+    assert response.status_code == 200
+    assert flare.disk_tracker.get('quota')['bytes'] == 800
+
+
+def test_save_over_soft_quota_warns(client, quota_server):
+    quota_server['disk_quota_action'] = 'warn'
+    response = client.post('/api/servers/quota/files/save', json={'path': 'big.txt', 'content': 'y' * 500})
+    assert response.status_code == 200
+    assert 'soft quota, save allowed' in response.get_json()['warning']
+
+
+def test_copy_over_quota_is_blocked(client, quota_server):
+    response = client.post('/api/servers/quota/files/copy', json={'source': 'data.txt', 'destination': 'copy.txt'})
+    assert response.status_code == 507
+    assert not os.path.exists('servers/quota/copy.txt')
+
+
+@pytest.mark.parametrize('archive', ['bundle.zip', 'bundle.tar.gz'])
+def test_extract_over_quota_is_blocked(client, quota_server, archive):
+    os.makedirs('scratch', exist_ok=True)
+    with open('scratch/payload.txt', 'w') as f:
+        f.write('p' * 5000)
+    path = os.path.join('servers/quota', archive)
+    if archive.endswith('.zip'):
+        # Compresses to far less than the quota; the uncompressed size is what counts
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as bundle:
+            bundle.write('scratch/payload.txt', 'payload.txt')
+    else:
+        with tarfile.open(path, 'w:gz') as bundle:
+            bundle.add('scratch/payload.txt', 'payload.txt')
+    assert os.path.getsize(path) < 400
+    flare.disk_tracker.rescan('quota')
+    
+    response = client.post('/api/servers/quota/files/extract', json={'path': archive})
+    assert response.status_code == 507
+    assert not os.path.exists('servers/quota/payload.txt')
+
+
+def test_rename_triggers_a_rescan(client, quota_server):
+    scanned_at = flare.disk_tracker.get('quota')['scanned_at']
+    response = client.patch('/api/servers/quota/files/rename', json={'old_path': 'data.txt', 'new_name': 'renamed.txt'})
+    assert response.status_code == 200
+    assert wait_for(lambda: flare.disk_tracker.get('quota')['scanned_at'] > scanned_at)
+
+
+def make_tree(path, size):
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, 'blob.bin'), 'w') as f:
+        f.write('b' * size)
+
+
+def test_directory_copy_over_quota_is_blocked(client, quota_server):
+    make_tree('servers/quota/assets', 300)
+    flare.disk_tracker.rescan('quota')
+    response = client.post('/api/servers/quota/files/copy', json={'source': 'assets', 'destination': 'assets2'})
+    assert response.status_code == 507
+    assert 'quota' in response.get_json()['error'].lower()
+    assert not os.path.exists('servers/quota/assets2')
+
+
+def test_async_directory_copy_fails_the_job_over_quota(client, quota_server):
+    make_tree('servers/quota/assets', 300)
+    flare.disk_tracker.rescan('quota')
+    response = client.post('/api/servers/quota/files/copy?async=1', json={'source': 'assets', 'destination': 'assets2'})
+    assert response.status_code == 202
+    job = flare.job_queue.get(response.get_json()['job_id'])
+    assert wait_for(lambda: job.finished)
+    assert job.status == 'failed'
+    assert 'quota' in job.error.lower()
+    assert not os.path.exists('servers/quota/assets2')
+
+
+def test_directory_copy_without_quota_does_not_size_the_tree(client, manager, monkeypatch):
+    manager.servers['unlimited'] = make_server('unlimited')
+    make_tree('servers/unlimited/assets', 300)
+    
+    def no_scan(path):
+        raise AssertionError(f'scanned {path}')
+    monkeypatch.setattr(flare.DiskUsageTracker, 'scan', staticmethod(no_scan))
+    response = client.post('/api/servers/unlimited/files/copy', json={'source': 'assets', 'destination': 'assets2'})
+    assert response.status_code == 200, response.get_json()
+    assert os.path.exists('servers/unlimited/assets2/blob.bin')
@@ -0,0 +1,127 @@
+import os
+import threading
+import zipfile
+
+import pytest
+
+from conftest import flare, make_server, wait_for
+
+
+@pytest.fixture
+def queue():
+    return flare.JobQueue(workers=2, limits={'restore': 1}, history=50)
+
+
+def blocker(release):
+    def run(job):
+        release.wait(5)
+        return 'done'
+    return run
+
+
+def test_queued_job_is_cancelled_without_running(queue):
+    release = threading.Event()
+    ran = []
+    first = queue.submit('restore', blocker(release))
+    second = queue.submit('restore', lambda job: ran.append(job))
+    try:
+        assert wait_for(lambda: first.status == 'running')
+        # The per-kind limit keeps the second restore queued even with a worker free
+        assert second.status == 'queued'
+        assert queue.cancel(second.id)
+        assert second.status == 'cancelled'
+    finally:
+        release.set()
+    assert wait_for(lambda: first.finished)
+    assert first.status == 'succeeded' and first.result == 'done'
+    assert ran == []
+    assert not queue.cancel(first.id)
+
+
+def test_running_job_stops_at_its_next_check(queue):
+    started = threading.Event()
+    
+    def spin(job):
+        started.set()
+        while True:
+            job.check()
+            job.progress(job.done + 1)
+    
+    job = queue.submit('backup', spin)
+    assert started.wait(5)
+    assert queue.cancel(job.id)
+    assert wait_for(lambda: job.finished)
+    assert job.status == 'cancelled'
+    assert queue.stats()['running'].get('backup') == 0
+
+
+def make_backup(path, files):
+    with zipfile.ZipFile(path, 'w') as archive:
+        for name, content in files.items():
+            archive.writestr(name, content)
+
+
+def make_live_dir(path):
+    os.makedirs(os.path.join(path, 'backups'), exist_ok=True)
+    with open(os.path.join(path, 'app.py'), 'w') as f:
+        f.write('live')
+    with open(os.path.join(path, 'backups', 'keep.zip'), 'w') as f:
+        f.write('kept')
+
+
+def test_cancelled_restore_leaves_the_server_dir_intact(tmp_path):
+    server_dir = str(tmp_path / 'site')
+    make_live_dir(server_dir)
+    archive = str(tmp_path / 'backup.zip')
+    make_backup(archive, {f'file{n}.txt': 'restored' for n in range(5)})
+    
+    job = flare.Job('restore')
+    progress = job.progress
+    
+    def cancel_midway(done=None, total=None, message=None):
+        progress(done, total, message)
+        if done == 2:
+            job.cancel()
+    job.progress = cancel_midway
+    
+    with pytest.raises(flare.JobCancelled):
+        flare.restore_archive(job, archive, server_dir, keep=('backups',))
+    assert sorted(os.listdir(tmp_path)) == ['backup.zip', 'site']
+    assert sorted(os.listdir(server_dir)) == ['app.py', 'backups']
+    with open(os.path.join(server_dir, 'app.py')) as f:
+        assert f.read() == 'live'
+    assert os.listdir(os.path.join(server_dir, 'backups')) == ['keep.zip']
+
+
+def test_restore_replaces_files_and_carries_over_kept_items(tmp_path):
+    server_dir = str(tmp_path / 'site')
+    make_live_dir(server_dir)
+    archive = str(tmp_path / 'backup.zip')
+    make_backup(archive, {'main.py': 'restored', 'static/style.css': 'body {}'})
+    
+    assert flare.restore_archive(flare.Job('restore'), archive, server_dir, keep=('backups', '.console')) == 2
+    assert sorted(os.listdir(tmp_path)) == ['backup.zip', 'site']
+    assert sorted(os.listdir(server_dir)) == ['backups', 'main.py', 'static']
+    assert os.listdir(os.path.join(server_dir, 'backups')) == ['keep.zip']
+
+
+def test_both_restore_routes_keep_backups_console_and_venv(client, manager):
+    manager.servers['restored'] = make_server('restored')
+    server_dir = os.path.join('servers', 'restored')
+    make_live_dir(server_dir)
+    for kept in ('.console', flare.SERVER_VENV_DIR):
+        os.makedirs(os.path.join(server_dir, kept), exist_ok=True)
+        with open(os.path.join(server_dir, kept, 'marker'), 'w') as f:
+            f.write('kept')
+    os.makedirs('backups', exist_ok=True)
+    make_backup(os.path.join('backups', 'top-level.zip'), {'main.py': 'top'})
+    make_backup(os.path.join(server_dir, 'backups', 'per-server.zip'), {'main.py': 'per-server'})
+    
+    response = client.post('/api/restore_server/restored', json={'backup_file': 'top-level.zip'})
+    assert response.status_code == 200, response.get_json()
+    response = client.post('/api/servers/restored/backups/restore', json={'backup_file': 'per-server.zip'})
+    assert response.status_code == 200, response.get_json()
+    assert sorted(os.listdir(server_dir)) == sorted(['.console', flare.SERVER_VENV_DIR, 'backups', 'main.py'])
+    for kept in ('.console', flare.SERVER_VENV_DIR):
+        assert os.path.exists(os.path.join(server_dir, kept, 'marker'))
+    os.remove(os.path.join('backups', 'top-level.zip'))
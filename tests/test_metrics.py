@@ -0,0 +1,124 @@
+import re
+import time
+
+import pytest
+
+from conftest import flare, make_server
+
+
+@pytest.fixture
+def recorded():
+    store = flare.metrics_sampler.store
+    now = time.time()
+    store.record(now - 2, {'test.value': 1.0})
+    store.record(now, {'test.value': 3.0})
+    yield store
+    store.drop('test.')
+
+
+@pytest.mark.parametrize('value', ['inf', '1e309', 'nan', '-5m', '0', 'soon', 'infd'])
+def test_history_rejects_bad_ranges(client, recorded, value):
+    response = client.get('/api/metrics/history', query_string={'series': 'test.value', 'range': value})
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'Invalid range'
+
+
+def test_history_range_is_clamped_to_retention(client, recorded):
+    response = client.get('/api/metrics/history', query_string={'series': 'test.value', 'range': '1e12d'})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['range'] == recorded.retention()
+    assert body['series']['test.value']
+
+
+def test_history_picks_the_finest_tier_covering_the_range(client, recorded):
+    step, slots = recorded.tiers[0]
+    body = client.get('/api/metrics/history', query_string={'series': 'test.*', 'range': '60s'}).get_json()
+    assert body['step'] == step
+    assert [value for _, value in body['series']['test.value']] == [1.0, 3.0]
+
+
+SAMPLE_LINE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{([a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\]|\\.)*",?)*\})? (\S+)$')
+
+
+def test_exposition_format(client, manager):
+    manager.servers['exposed'] = make_server('exposed')
+    client.get('/api/system_info')
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain; version=0.0.4')
+    
+    declared = {}
+    histogram = {}
+    for line in response.get_data(as_text=True).splitlines():
+        if line.startswith('# HELP '):
+            continue
+        if line.startswith('# TYPE '):
+            _, _, name, kind = line.split(' ')
+            assert name not in declared
+            declared[name] = kind
+            continue
+        match = SAMPLE_LINE.match(line)
+        assert match, line
+        name, value = match.group(1), match.group(4)
+        float(value)
+        base = re.sub(r'_(bucket|sum|count)$', '', name) if name not in declared else name
+        assert base in declared, line
+        if name.startswith('flare_http_request_duration_seconds_') and 'route="/api/system_info"' in line:
+            histogram.setdefault(name.rsplit('_', 1)[1], []).append(float(value))
+    
+    assert declared['flare_server_up'] == 'gauge'
+    assert declared['flare_server_restarts_total'] == 'counter'
+    assert declared['flare_http_request_duration_seconds'] == 'histogram'
+    assert 'flare_server_up{server="exposed"} 0' in response.get_data(as_text=True)
+    # Buckets are cumulative and the +Inf bucket equals the count
+    assert histogram['bucket'] == sorted(histogram['bucket'])
+    assert histogram['bucket'][-1] == histogram['count'][0] >= 1
+
+
+def test_label_values_are_escaped():
+    assert flare.prometheus_label('a"b\\c\nd') == 'a\\"b\\\\c\\nd'
+
+
+@pytest.fixture
+def anonymous():
+    return flare.app.test_client()
+
+
+def test_metrics_require_a_session_or_token(anonymous, monkeypatch):
+    monkeypatch.setattr(flare, 'METRICS_TOKEN', 's3cret')
+    monkeypatch.setattr(flare, 'METRICS_ALLOW_LOCALHOST', False)
+    # The test client connects from 127.0.0.1, like everything behind a reverse proxy
+    assert anonymous.get('/metrics').status_code == 401
+    assert anonymous.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+    assert anonymous.get('/metrics', headers={'Authorization': 'Bearer s3cret'}).status_code == 200
+
+
+def test_metrics_without_token_need_a_session(anonymous, client, monkeypatch):
+    monkeypatch.setattr(flare, 'METRICS_TOKEN', '')
+    monkeypatch.setattr(flare, 'METRICS_ALLOW_LOCALHOST', False)
+    assert anonymous.get('/metrics').status_code == 401
+    assert client.get('/metrics').status_code == 200
+
+
+def test_localhost_scrapes_only_when_allowed(anonymous, monkeypatch):
+    monkeypatch.setattr(flare, 'METRICS_TOKEN', '')
+    monkeypatch.setattr(flare, 'METRICS_ALLOW_LOCALHOST', True)
+    assert anonymous.get('/metrics').status_code == 200
+    assert anonymous.get('/metrics', environ_base={'REMOTE_ADDR': '203.0.113.7'}).status_code == 401
+
+
+def test_system_info_samples_on_demand_with_the_sampler_off(client, monkeypatch):
+    sampler = flare.metrics_sampler
+    assert sampler._thread is None  # the test session runs with FLARE_METRICS_INTERVAL=0
+    monkeypatch.setattr(sampler, 'samples', type(sampler.samples)(maxlen=sampler.samples.maxlen))
+    monkeypatch.setattr(sampler, '_primed_at', None)
+    # A scrape must not block on the priming window; it omits host metrics instead of reporting zeros
+    assert 'flare_host_memory_total_bytes' not in client.get('/metrics').get_data(as_text=True)
+    
+    body = client.get('/api/system_info').get_json()
+    assert body['memory']['total'] > 0
+    assert body['disk']['total'] > 0
+    assert body['cpu']['count'] >= 1
+    assert body['sampled_at'] is not None
+    assert 'flare_host_memory_total_bytes' in client.get('/metrics').get_data(as_text=True)
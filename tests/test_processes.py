@@ -0,0 +1,77 @@
+import subprocess
+import sys
+
+import pytest
+
+from conftest import flare
+
+
+def row(pid, name, cpu, username='alice', server=None, rss=1000):
+    return {'pid': pid, 'ppid': 1, 'name': name, 'username': username, 'status': 'running',
+            'cpu_percent': cpu, 'memory_percent': 0.1, 'rss': rss, 'num_threads': 1,
+            'create_time': 1700000000.0 + pid, 'command': f'/usr/bin/{name} --serve', 'server': server,
+            'new': False}
+
+
+@pytest.fixture
+def table(monkeypatch):
+    rows = [
+        row(10, 'nginx', 2.0, username='www-data'),
+        row(11, 'gunicorn', 30.5, server='web'),
+        row(12, 'gunicorn', 12.0, server='web'),
+        row(13, 'Python3', 5.0, server='bot'),
+        row(14, 'sshd', 0.0, username='root', rss=None),
+    ]
+    snapshot = {'rows': rows, 'sampled_at': 1700000100.0, 'sample_ms': 1.5}
+    monkeypatch.setattr(flare.metrics_sampler, 'processes', lambda: snapshot)
+    return rows
+
+
+def pids(response):
+    assert response.status_code == 200, response.get_json()
+    return [proc['pid'] for proc in response.get_json()['processes']]
+
+
+def test_numbers_sort_descending_and_text_ascending_by_default(client, table):
+    assert pids(client.get('/api/processes')) == [11, 12, 13, 10, 14]
+    assert pids(client.get('/api/processes?sort=name')) == [11, 12, 10, 13, 14]
+    assert pids(client.get('/api/processes?sort=cpu_percent&order=asc')) == [14, 10, 13, 12, 11]
+
+
+def test_missing_values_sort_last_either_way(client, table):
+    assert pids(client.get('/api/processes?sort=rss&order=desc'))[-1] == 14
+    assert pids(client.get('/api/processes?sort=rss&order=asc'))[-1] == 14
+
+
+def test_filters_combine(client, table):
+    assert pids(client.get('/api/processes?q=GUNI')) == [11, 12]
+    assert pids(client.get('/api/processes?user=root')) == [14]
+    assert pids(client.get('/api/processes?server=*')) == [11, 12, 13]
+    assert pids(client.get('/api/processes?server=none')) == [10, 14]
+    assert pids(client.get('/api/processes?server=web&q=serve&sort=pid&order=asc')) == [11, 12]
+
+
+def test_paging(client, table):
+    body = client.get('/api/processes?sort=pid&order=asc&per_page=2&page=2').get_json()
+    assert [proc['pid'] for proc in body['processes']] == [12, 13]
+    assert (body['total'], body['pages'], body['page'], body['per_page']) == (5, 3, 2, 2)
+    assert pids(client.get('/api/processes?sort=pid&per_page=2&page=9')) == []
+
+
+@pytest.mark.parametrize('query', ['order=up', 'sort=ppid', 'page=x', 'per_page=ten'])
+def test_invalid_parameters_are_rejected(client, table, query):
+    assert client.get(f'/api/processes?{query}').status_code == 400
+
+
+def test_first_request_reports_cpu_usage(client, monkeypatch):
+    sampler = flare.metrics_sampler
+    monkeypatch.setattr(sampler, 'process_table', {'rows': [], 'sampled_at': None, 'sample_ms': 0.0})
+    monkeypatch.setattr(sampler, '_process_handles', {})
+    busy = subprocess.Popen([sys.executable, '-c', 'while True: pass', 'cold-cache-marker'])
+    try:
+        body = client.get('/api/processes?q=cold-cache-marker').get_json()
+        assert [proc['pid'] for proc in body['processes']] == [busy.pid]
+        assert body['processes'][0]['cpu_percent'] > 0
+    finally:
+        busy.kill()
+        busy.wait()
@@ -0,0 +1,77 @@
+import os
+import socket
+import threading
+
+import pytest
+
+from conftest import flare, make_server
+
+
+LISTENER = '''import os, socket, time
+time.sleep(0.2)
+sock = socket.socket()
+sock.bind((os.environ['HOST'], int(os.environ['PORT'])))
+sock.listen()
+time.sleep(60)
+'''
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def add_server(manager, name, script):
+    manager.servers[name] = make_server(name, command='python3 main.py', port=free_port())
+    with open(f'servers/{name}/main.py', 'w') as f:
+        f.write(script)
+
+
+def test_start_waits_until_the_port_listens(manager, client):
+    add_server(manager, 'listener', LISTENER)
+    response = client.post('/api/servers/listener/start', json={'wait_ready': True, 'timeout': '5'})
+    assert response.status_code == 200, response.get_json()
+    body = response.get_json()
+    assert body['ready'] is True
+    assert body['readiness']['count'] == 1
+    assert body['readiness']['last_ms'] >= 200
+
+
+def test_start_reports_a_server_that_never_listens(manager, client):
+    add_server(manager, 'silent', 'import time\ntime.sleep(60)\n')
+    response = client.post('/api/servers/silent/start', json={'wait_ready': True, 'timeout': 0.3})
+    assert response.status_code == 400
+    body = response.get_json()
+    assert body['ready'] is False
+    assert body['readiness']['failures'] == 1
+
+
+@pytest.mark.parametrize('timeout', ['soon', -1, 0, 'inf', 'nan', True, [5]])
+def test_bad_timeout_is_rejected_before_spawning(manager, client, timeout):
+    add_server(manager, 'strict', LISTENER)
+    response = client.post('/api/servers/strict/start', json={'wait_ready': True, 'timeout': timeout})
+    assert response.status_code == 400
+    assert 'timeout' in response.get_json()['error']
+    assert manager.servers['strict']['status'] == 'stopped'
+    assert manager.servers['strict']['pid'] is None
+    
+    response = client.post('/api/test_startup/strict', json={'command': 'python3 main.py', 'timeout': timeout})
+    assert response.status_code == 400
+    assert 'timeout' in response.get_json()['error']
+
+
+def test_port_lookups_run_off_the_loop_and_back_off(monkeypatch):
+    supervisor = flare.server_manager.supervisor
+    calls = []
+    
+    def never_listening(pid, port):
+        calls.append(threading.current_thread())
+        return True, False
+    monkeypatch.setattr(flare, 'tree_listening', never_listening)
+    
+    ready, error = supervisor.call(flare.wait_until_ready(os.getpid(), free_port(), 1.5))
+    assert not ready and 'Not listening' in error
+    assert supervisor._thread not in calls
+    # 50 ms polling would take 30 lookups; the backoff to 500 ms needs well under half that
+    assert 5 <= len(calls) <= 12
@@ -0,0 +1,88 @@
+import re
+import threading
+
+import pytest
+
+from conftest import flare, make_server, wait_for
+
+
+@pytest.fixture
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(flare, 'RESTART_BACKOFF_BASE', 0.05)
+    monkeypatch.setattr(flare, 'RESTART_BACKOFF_MAX', 0.2)
+    monkeypatch.setattr(flare, 'RESTART_JITTER', 0)
+    monkeypatch.setattr(flare, 'RESTART_LOOP_LIMIT', 4)
+
+
+def add_exiting(manager, name, code, policy):
+    manager.servers[name] = make_server(name, command='sh exit.sh', server_type='python_bot',
+                                        restart_policy=policy)
+    with open(f'servers/{name}/exit.sh', 'w') as f:
+        f.write(f'exit {code}\n')
+
+
+def restart_delays(manager, name):
+    return [float(match) for line in manager.get_console_logs(name, 200)
+            for match in re.findall(r'Restarting in ([\d.]+)s', line)]
+
+
+def test_backoff_doubles_up_to_the_cap_then_trips_the_breaker(manager, fast_backoff):
+    add_exiting(manager, 'crasher', 3, 'on-failure')
+    assert manager.start_server('crasher')[0]
+    
+    assert wait_for(lambda: manager.get_restart_stats('crasher')['crash_loop'])
+    stats = manager.get_restart_stats('crasher')
+    assert stats['restarts'] == 4
+    assert stats['consecutive_failures'] == 5
+    assert stats['last_exit_code'] == 3
+    assert stats['next_restart_at'] is None
+    assert restart_delays(manager, 'crasher') == [0.1, 0.1, 0.2, 0.2]  # 0.05 (logged as 0.1), 0.1, 0.2, then the 0.2 cap
+    assert manager.servers['crasher']['status'] == 'stopped'
+
+
+def test_manual_start_resets_the_breaker(manager, fast_backoff):
+    add_exiting(manager, 'looping', 3, 'on-failure')
+    assert manager.start_server('looping')[0]
+    assert wait_for(lambda: manager.get_restart_stats('looping')['crash_loop'])
+    
+    with open('servers/looping/exit.sh', 'w') as f:
+        f.write('sleep 30\n')
+    assert manager.start_server('looping')[0]
+    stats = manager.get_restart_stats('looping')
+    assert not stats['crash_loop']
+    assert stats['consecutive_failures'] == 0
+
+
+def test_clean_exit_is_not_restarted_on_failure_policy(manager, fast_backoff):
+    add_exiting(manager, 'oneshot', 0, 'on-failure')
+    assert manager.start_server('oneshot')[0]
+    assert wait_for(lambda: manager.get_restart_stats('oneshot')['last_exit_code'] == 0)
+    assert manager.get_restart_stats('oneshot')['restarts'] == 0
+    assert restart_delays(manager, 'oneshot') == []
+
+
+def test_stop_does_not_trigger_a_restart(manager, fast_backoff):
+    manager.servers['sleeper'] = make_server('sleeper', command='sleep 30', server_type='python_bot',
+                                             restart_policy='always')
+    assert manager.start_server('sleeper')[0]
+    assert manager.stop_server('sleeper')[0]
+    assert not wait_for(lambda: manager.servers['sleeper']['status'] == 'running', timeout=0.3)
+    assert manager.get_restart_stats('sleeper')['restarts'] == 0
+
+
+def test_failed_restart_is_rescheduled_on_the_loop(manager, fast_backoff, monkeypatch):
+    manager.servers['unstartable'] = make_server('unstartable', command='no-such-binary --serve',
+                                                 server_type='python_bot', restart_policy='always')
+    threads = []
+    schedule = manager._schedule_restart
+    
+    def recording(server, returncode):
+        threads.append(threading.current_thread())
+        schedule(server, returncode)
+    monkeypatch.setattr(manager, '_schedule_restart', recording)
+    
+    loop = manager.supervisor.loop
+    loop.call_soon_threadsafe(manager._schedule_restart, manager.servers['unstartable'], 1)
+    assert wait_for(lambda: manager.get_restart_stats('unstartable')['crash_loop'])
+    assert len(threads) == 5
+    assert set(threads) == {manager.supervisor._thread}
@@ -0,0 +1,34 @@
+import os
+
+import pytest
+
+from conftest import flare, make_server, wait_for
+
+
+def test_shell_owns_its_terminal(manager):
+    manager.servers['shelled'] = make_server('shelled')
+    try:
+        shell = manager.shell_input('shelled', 'ps -o tty= -p $$; echo marker-$((6*7))')
+        assert wait_for(lambda: any('marker-42' in line for line in manager.get_console_logs('shelled')))
+        lines = manager.get_console_logs('shelled')
+        # The shell itself keeps the pid (the helper execs it) and has the PTY as controlling tty
+        assert any(line.split()[-1].startswith('pts/') for line in lines if 'ps -o' not in line)
+        assert os.getsid(shell.pid) == shell.pid
+    finally:
+        manager.close_shell('shelled')
+
+
+def test_write_to_a_full_terminal_raises_instead_of_spinning():
+    read_fd, write_fd = os.pipe()
+    os.set_blocking(write_fd, False)
+    try:
+        shell = flare.ShellSession(pid=None, master_fd=write_fd)
+        with pytest.raises(RuntimeError):
+            shell.write(b'x' * (1 << 20))
+        # The lock was released, so the session stays usable
+        os.read(read_fd, 1 << 20)
+        with pytest.raises(RuntimeError):
+            shell.write(b'y' * (1 << 20))
+    finally:
+        os.close(read_fd)
+        os.close(write_fd)
@@ -0,0 +1,87 @@
+import json
+
+import pytest
+
+from conftest import flare
+
+
+def test_journal_replays_over_snapshot(tmp_path):
+    store = flare.JsonStateStore(str(tmp_path / 'servers.json'), str(tmp_path / 'servers.journal'))
+    store.write_snapshot({'web': {'name': 'web', 'status': 'stopped', 'port': 5000}})
+    store.append([
+        {'op': 'set', 'name': 'web', 'fields': {'status': 'running', 'pid': 42}},
+        {'op': 'set', 'name': 'api', 'fields': {'name': 'api', 'port': 6000}},
+        {'op': 'del', 'name': 'api'},
+    ])
+    
+    servers = flare.JsonStateStore(store.snapshot_file, store.journal_file).load()
+    assert servers == {'web': {'name': 'web', 'status': 'running', 'port': 5000, 'pid': 42}}
+
+
+def test_torn_journal_line_is_skipped(tmp_path):
+    store = flare.JsonStateStore(str(tmp_path / 'servers.json'), str(tmp_path / 'servers.journal'))
+    store.append([{'op': 'set', 'name': 'web', 'fields': {'status': 'running'}}])
+    with open(store.journal_file, 'a') as f:
+        f.write('{"op": "set", "name": "web", "fie')  # crash mid-write
+    
+    reloaded = flare.JsonStateStore(store.snapshot_file, store.journal_file)
+    assert reloaded.load() == {'web': {'status': 'running'}}
+    assert reloaded.journal_records == 1
+
+
+def test_snapshot_compacts_journal(tmp_path, monkeypatch):
+    monkeypatch.setattr(flare, 'JOURNAL_COMPACT_RECORDS', 3)
+    store = flare.JsonStateStore(str(tmp_path / 'servers.json'), str(tmp_path / 'servers.journal'))
+    servers = {}
+    for port in range(3):
+        record = {'op': 'set', 'name': 'web', 'fields': {'port': port}}
+        store.append([record])
+        store.apply_record(servers, record)
+    assert store.needs_compaction()
+    
+    store.write_snapshot(servers)
+    assert not store.needs_compaction()
+    assert (tmp_path / 'servers.journal').read_text() == ''
+    with open(store.snapshot_file) as f:
+        assert json.load(f) == {'web': {'port': 2}}
+    assert flare.JsonStateStore(store.snapshot_file, store.journal_file).load() == {'web': {'port': 2}}
+
+
+def test_manager_journals_changes_then_compacts(manager, monkeypatch):
+    if not isinstance(manager.store, flare.JsonStateStore):
+        pytest.skip('journal compaction is specific to the json backend')
+    manager.servers['journaled'] = {'name': 'journaled', 'status': 'stopped', 'pid': None}
+    manager.save_servers()
+    manager.flush_servers()
+    snapshots = manager.save_stats['snapshot_writes']
+    
+    manager.update_server('journaled', status='running', pid=1234)
+    manager.flush_servers()
+    assert manager.save_stats['snapshot_writes'] == snapshots
+    assert manager.store.load()['journaled']['pid'] == 1234
+    
+    monkeypatch.setattr(flare, 'JOURNAL_COMPACT_RECORDS', manager.store.journal_records)
+    manager.update_server('journaled', status='stopped', pid=None)
+    manager.flush_servers()
+    assert manager.save_stats['snapshot_writes'] == snapshots + 1
+    assert manager.store.journal_records == 0
+    assert manager.store.load()['journaled']['status'] == 'stopped'
+
+
+def test_server_store_is_abstract():
+    with pytest.raises(TypeError):
+        flare.ServerStore()
+
+
+def test_sqlite_query_sees_unflushed_changes(manager, monkeypatch, tmp_path):
+    store = flare.SQLiteStateStore(str(tmp_path / 'servers.db'), import_from=None)
+    monkeypatch.setattr(manager, 'store', store)
+    monkeypatch.setattr(manager, 'save_interval', 3600)  # the background flusher won't get there first
+    manager.servers['indexed'] = {'name': 'indexed', 'status': 'stopped', 'port': 5123, 'server_type': 'flask'}
+    manager.save_servers()
+    manager.flush_servers()
+    
+    manager.update_server('indexed', status='running')
+    assert 'indexed' in manager.find_servers(status='running')
+    assert 'indexed' not in manager.find_servers(status='stopped')
+    assert manager.find_servers(port=5123, server_type='flask') == ['indexed']
@@ -0,0 +1,108 @@
+import os
+import subprocess
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import flare, make_server, wait_for
+
+
+def test_instant_exit_is_not_lost(manager):
+    names = [f'instant{n}' for n in range(20)]
+    for name in names:
+        manager.servers[name] = make_server(name, command='true', server_type='python_bot')
+    for name in names:
+        success, message = manager.start_server(name)
+        assert success, message
+    
+    assert wait_for(lambda: all(manager.servers[name]['status'] == 'stopped' for name in names), timeout=5)
+    for name in names:
+        assert manager.servers[name]['pid'] is None
+        assert manager.servers[name]['last_exit_code'] == 0
+
+
+def test_exit_code_is_recorded(manager):
+    manager.servers['failing'] = make_server('failing', command='sh exit3.sh', server_type='python_bot')
+    with open('servers/failing/exit3.sh', 'w') as f:
+        f.write('exit 3\n')
+    assert manager.start_server('failing')[0]
+    assert wait_for(lambda: manager.servers['failing']['status'] == 'stopped')
+    assert manager.servers['failing']['last_exit_code'] == 3
+
+
+FORKER = '''import os, time
+pid = os.fork()
+if pid == 0:
+    os.setpgid(0, 0)
+    time.sleep(60)
+    os._exit(0)
+with open('worker.pid', 'w') as f:
+    f.write(str(pid))
+'''
+
+
+def start_forker(manager, name):
+    """A server whose leader exits at once, leaving a worker in a process group of its own"""
+    manager.servers[name] = make_server(name, command='python3 forker.py', server_type='python_bot')
+    with open(f'servers/{name}/forker.py', 'w') as f:
+        f.write(FORKER)
+    assert manager.start_server(name)[0]
+    leader = manager.servers[name]['pgid']
+    assert wait_for(lambda: manager.servers[name]['status'] == 'stopped')
+    with open(f'servers/{name}/worker.pid') as f:
+        return leader, int(f.read())
+
+
+@pytest.mark.parametrize('action', ['stop_server', 'kill_server'])
+def test_leftover_worker_can_be_ended(manager, action):
+    name = f'forker_{action}'
+    leader, worker = start_forker(manager, name)
+    
+    assert manager.servers[name]['pgid'] == leader
+    assert worker in manager.server_pids(name)
+    
+    success, message = getattr(manager, action)(name)
+    assert success, message
+    assert wait_for(lambda: not os.path.exists(f'/proc/{worker}') or open(f'/proc/{worker}/stat').read().split()[2] == 'Z')
+    assert manager.servers[name]['pgid'] is None
+    assert manager.stop_server(name) == (False, "Server is not running")
+
+
+def recorded_running(name, pid, started=None):
+    started = started or datetime.now()
+    return make_server(name, status='running', pid=pid, pgid=pid, start_time=started.isoformat())
+
+
+def test_surviving_server_is_adopted(manager):
+    survivor = subprocess.Popen(['sleep', '30'], start_new_session=True)
+    try:
+        manager.servers['survivor'] = recorded_running('survivor', survivor.pid)
+        manager._adopt_running()
+        assert manager.servers['survivor']['status'] == 'running'
+        assert manager.servers['survivor']['pid'] == survivor.pid
+        
+        # Its exit is observed like that of a child the panel spawned itself
+        survivor.kill()
+        assert wait_for(lambda: manager.servers['survivor']['status'] == 'stopped')
+        assert manager.servers['survivor']['pid'] is None
+    finally:
+        survivor.kill()
+        survivor.wait()
+
+
+def test_dead_or_reused_pid_is_not_adopted(manager):
+    gone = subprocess.Popen(['true'])
+    gone.wait()
+    reused = subprocess.Popen(['sleep', '30'], start_new_session=True)
+    try:
+        manager.servers['gone'] = recorded_running('gone', gone.pid)
+        # The recorded start is an hour before the live process with that pid was created
+        manager.servers['reused'] = recorded_running('reused', reused.pid, datetime.now() - timedelta(hours=1))
+        manager._adopt_running()
+        for name in ('gone', 'reused'):
+            assert manager.servers[name]['status'] == 'stopped'
+            assert manager.servers[name]['pid'] is None
+        assert reused.poll() is None
+    finally:
+        reused.kill()
+        reused.wait()